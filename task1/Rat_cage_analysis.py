@@ -1,187 +1,352 @@
 # -*- coding: utf-8 -*-
 """
-Reads the rat_path.csv file created by motion_detector.py and calculates rat behavior results.
+Reads the rat_path.npz (or rat_path.csv) file created by motion_detector.py and calculates rat behavior results.
 Computes and plots the ditribution of path lengths and durations in each room, and total time spent in each room.
+
+The rat path is read in chunks, the open visit is carried over from one chunk to the next, so recordings of any
+length are analyzed in bounded memory - only the table of visits is kept.
+
+   python Rat_cage_analysis.py rat_path.npz --arena rooms.json --output figures/results.png
 """
 
+import argparse
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import math
+
+from trajectory import load_trajectory, iter_trajectory_chunks
+from arena import load_arena
 
 # Use r-like style for plots
 plt.style.use('ggplot')
 
-# Define the room borders
-left_border = 276
-right_border = 463
-
-def plot_results():
-    """Parses and plots rat path results.
-       Plots total time and total distance per room in the top row.
-       Plots boxplots for visit durations and path lengths in bottom row.
-    """
-    # Parse rat_path.csv and group it by room occupied by the rat
-    grouped = prepare_data().groupby('room_id')
-    # Prepare a dict for storing the results per each room
-    results = {'path_lengths' :{}, 'n_frames': {}, 'visit_durations' : {}}
-    
-    # iterate over rooms and calcualte results
-    for name, room in grouped:
-       # Store results in a dict
-       results['path_lengths'][name], results['n_frames'][name],  results['visit_durations'][name] = calc_results(room, name) 
-    
-    # Create figure 
-    fig, axes = plt.subplots(nrows = 2, ncols = 2)
-    fig.suptitle('Rat movement results', fontweight = 'bold', fontsize =  12)
-    
-    # get room names for plot legend
-    room_names = sorted(list(results['path_lengths'].keys()))
-    
-    # Plot total time per room
-    sns.barplot(x = list(results['n_frames'].keys()), y =list(results['n_frames'].values()),
-                ax = axes[0, 0], order = room_names)
-                
-    # Plot total distance per room    
-    sns.barplot(x = list(results['path_lengths'].keys()), y = [sum(item) for item in list(results['path_lengths'].values())],
-                ax = axes[0, 1], order = room_names)
-
-    # Convert path lengths dict to dataframe
-    p_len = pd.DataFrame(dict([(key, pd.Series(value)) for key,value in results['path_lengths'].items() ]))
-    # Plot path lenghts distributions 
-    sns.boxplot(x = 'variable', y = 'value', data = pd.melt(p_len), ax = axes[1, 1], order = room_names,
-                **dict(showmeans = True,meanline = True))        
-    
-    # Convert visit durations dict to dataframe
-    v_dur = pd.DataFrame(dict([(key, pd.Series(value)) for key,value in results['visit_durations'].items() ]))
-    # Plot visit times distributions 
-    sns.boxplot(x = 'variable', y = 'value', data = pd.melt(v_dur), ax = axes[1, 0], order = room_names,
-                **dict(showmeans = True,meanline = True))       
-    
-    
-    axes[0, 0].set_ylabel('total time (frames)')
-    axes[0, 1].set_ylabel('total distance (pixels)')
-    axes[1, 1].set_ylabel('path lengths (pixels)')
-    axes[1, 0].set_ylabel('visit durations (frames)')
-    axes[1, 0].set_xlabel('')
-    axes[1, 1].set_xlabel('')
-    
-
-
-
-
-def prepare_data():
-    """Reads the csv with path the rat has traveled in the video. 
-       Annotates each position with the room number and the distance traveled from previous position. 
-
-       Return
-       ------
-       rat_path: DataFrame
-                 columns are: room_id, x_cords, y_cords, distance
-    """
-    
-    # Read the csv output of the motion_detector script
-    rat_path = pd.read_csv('/Users/user/Desktop/OpenCV_python/rat_path.csv')
-
-    # Annotate each position with room id, based on room borders
-    rat_path['room_id'] = 'room_2'
-    rat_path.loc[rat_path['x_cords'] <= left_border, 'room_id'] = 'room_1'
-    rat_path.loc[rat_path['x_cords'] >= right_border, 'room_id'] = 'room_3'
-    
-    # Calculate the ditance between each and next position using pythagorean formula
-    rat_path['x_delta'] = (rat_path['x_cords'].shift() - rat_path['x_cords']).fillna(0)
-    rat_path['y_delta'] = (rat_path['y_cords'].shift() - rat_path['y_cords']).fillna(0)
-    
-    rat_path['distance'] = np.vectorize(dist)(rat_path['x_delta'], rat_path['y_delta'])
-    
-    return rat_path.drop(['x_delta', 'y_delta'], axis = 1)
-    
-
-
-def calc_results(room, room_id):
-    """Compute the path results per room. 
-       Slice the room dataframe into pieces representing signle visits to the room.
-       Aggregate distance traveled and time spent during each visit.  
-
-       Parameters
-       ----------
-       room: DataFrame
-           DataFrame resulting from filtering the `rat_path` for a single room. 
-
-       room_id:str
-           name of the room, ex.'room_1'
-             
-       Returns
-       -------
-       path_lengths: numpy.array
-           collection of distances covered during each visit to the room.
-       
-       total_room_time: int
-           number of frames spent in a room during the whole recording.
-       
-       visit_durations: numpy.array
-           collection of durations of visits to the room.
-
-
-    """
-    
-    # Store the index in a new column. 
-    room.loc[:,'frame'] = room.index        
-    # Calculate the difference between consecutive frame numbers 
-    # Note, filtering rat_path by room_id, will result in frames beeing consecutive during one room visit, and having large differences when rat was changing rooms.
-    room.loc[:,'f_delta'] = (room['frame']-room['frame'].shift()).fillna(1)
-    # Reseting index is only for convienience, so the values are continous again   
-    room.reset_index(inplace = True)
-    
-    # Indexes where f_delta was greater then 1 indicate rat was in a different room one frame before, and this frame was removed during filtering by room_id.
-    # Insert 0 at index 0, to account for entering the room where the rat started.
-    entering = np.insert(room[room['f_delta'] > 1].index.values,0,0)
-    # Indexes 1 position before entering a new room, are when rat left the old room
-    leaving = np.append(entering[1::] - 1, len(room))
-    
-    # Store the room entering and leaving frame indices in a dataframe.
-    crossings = pd.DataFrame({'entering': entering, 'leaving' : leaving})
-    
-    # Define entering to the room as the starting point to calculate the path length for each visit.
-    room.loc[room['f_delta'] > 1, 'distance'] = 0
-
-    # For storing the distance traveled in each visit to the room    
-    path_lengths = []
-    # For storing the time spent in each visit to the room    
-    visit_durations = []
-    
-    # Slice the room dataframe by entering and leaving indices
-    for idx, row in crossings.iterrows():        
-        # Get a single visit slice
-        # + 1 because the upper range is not included
-        single_path = room.iloc[row['entering']:row['leaving'] + 1]
-   
-        # Correct for special cases when rat only passed by room 2 and was captured there for a single frame
-        if((len(single_path) == 1) and (room_id == 'room_2')):
-            # In such case state the rat covered the distance equal to the width of room 2
-            path_lengths.append(right_border - left_border)
-        else:
-            # Otherwise save the path length covered during the visit
-            path_lengths.append(single_path['distance'].sum())    
-        # Store the time of a visit in frames
-        visit_durations.append(len(single_path))
-    
-    # Get total time spent in this room
-    total_room_time = len(room)
-    
-    return np.array(path_lengths), total_room_time , np.array(visit_durations)
-    
-
-def dist(x, y):
-    """Calculate distance between points (0,0) and (`x`, `y`)
-        
-        Parameters
-        ----------
-        x,y: int, int
-            x-distance and y-distance between rat_path frames
-    """
-    return math.hypot(x, y)
-    
-if __name__ == '__main__':  
-    plot_results()
+# Columns of the visits table
+VISIT_COLUMNS = ['room_id', 'start_frame', 'end_frame', 'duration', 'distance']
+
+
+def plot_results(path = 'rat_path.npz', arena = None, chunksize = 100000):
+	"""Parses and plots rat path results.
+	   Plots total time and total distance per room in the top row.
+	   Plots boxplots for visit durations and path lengths in bottom row.
+
+	   Parameters
+	   ----------
+	   path: str
+		   rat path saved by motion_detector.py, see `prepare_data`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+
+	   chunksize: int
+		   rows of the rat path read at once, see `stream_visits`.
+
+	   Returns
+	   -------
+	   fig: matplotlib Figure
+	"""
+	arena = load_arena(arena)
+	# Parse the rat path and split it into single visits to the rooms
+	visits = pd.concat(list(stream_visits(path, arena, chunksize)), ignore_index = True)
+	visits[['duration', 'distance']] = visits[['duration', 'distance']].astype(float)
+
+	# Create figure
+	fig, axes = plt.subplots(nrows = 2, ncols = 2)
+	fig.suptitle('Rat movement results', fontweight = 'bold', fontsize =  12)
+
+	# get room names for plot legend
+	room_names = sorted(arena.room_names)
+	totals = visits.groupby('room_id')[['duration', 'distance']].sum()
+
+	# Plot total time per room
+	sns.barplot(x = totals.index, y = totals['duration'], ax = axes[0, 0], order = room_names)
+
+	# Plot total distance per room
+	sns.barplot(x = totals.index, y = totals['distance'], ax = axes[0, 1], order = room_names)
+
+	# Plot path lenghts distributions
+	sns.boxplot(x = 'room_id', y = 'distance', data = visits, ax = axes[1, 1], order = room_names,
+				**dict(showmeans = True,meanline = True))
+
+	# Plot visit times distributions
+	sns.boxplot(x = 'room_id', y = 'duration', data = visits, ax = axes[1, 0], order = room_names,
+				**dict(showmeans = True,meanline = True))
+
+
+	axes[0, 0].set_ylabel('total time (frames)')
+	axes[0, 1].set_ylabel('total distance (pixels)')
+	axes[1, 1].set_ylabel('path lengths (pixels)')
+	axes[1, 0].set_ylabel('visit durations (frames)')
+	axes[1, 0].set_xlabel('')
+	axes[1, 1].set_xlabel('')
+
+	return fig
+
+
+
+
+def prepare_data(path = 'rat_path.npz', arena = None):
+	"""Reads the path the rat has traveled in the video.
+	   Annotates each position with the room number and the distance traveled from previous position.
+
+	   Parameters
+	   ----------
+	   path: str
+		   rat path saved by motion_detector.py - the binary .npz file, a folder of checkpoint chunks or a csv file.
+
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+
+	   Return
+	   ------
+	   rat_path: DataFrame
+				 columns are: room_id, room_code, x_cords, y_cords, distance
+				 Frames where the rat was not detected are left out, room_code is the label of the room in the arena.
+	"""
+
+	# Read the output of the motion_detector script
+	return annotate_rooms(load_trajectory(path), arena)
+
+
+def annotate_rooms(rat_path, arena = None, previous = None):
+	"""Annotates a piece of the rat path with the room number and the distance traveled from previous position.
+
+	   Parameters
+	   ----------
+	   rat_path: DataFrame
+		   rat path with x_cords and y_cords columns, see `trajectory.load_trajectory`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+
+	   previous: (x, y) or None
+		   last position of the preceding piece of the rat path, the distance of the first position is measured
+		   from there. None for the start of the path.
+
+	   Return
+	   ------
+	   rat_path: DataFrame
+		   see `prepare_data`.
+	"""
+	rat_path = rat_path[rat_path['x_cords'].notnull() & rat_path['y_cords'].notnull()].copy()
+
+	# Annotate each position with room id, one vectorized lookup in the arena
+	arena = load_arena(arena)
+	rat_path['room_code'] = arena.room_codes(rat_path['x_cords'].values, rat_path['y_cords'].values)
+	rat_path['room_id'] = arena.room_names_of(rat_path['room_code'].values)
+
+	# Calculate the ditance between each and next position using pythagorean formula
+	x_cords = rat_path['x_cords'].values
+	y_cords = rat_path['y_cords'].values
+	if previous is None:
+		previous = (x_cords[:1], y_cords[:1])
+	x_delta = np.diff(x_cords, prepend = previous[0])
+	y_delta = np.diff(y_cords, prepend = previous[1])
+
+	rat_path['distance'] = np.hypot(x_delta, y_delta)
+
+	return rat_path
+
+
+class VisitStream(object):
+	"""Splits a rat path, given piece by piece, into single visits to the rooms.
+	   A visit is a run of consecutive frames with the same room_id.
+	   The distance of the frame entering a room is not counted, entering is the starting point of the visit path.
+
+	   The last visit of every piece stays open, the next piece continues it if the rat is still in the same room.
+	   The stream keeps only this open visit (room, first and last frame, duration, distance) and the last position.
+
+	   Parameters
+	   ----------
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+	"""
+
+	def __init__(self, arena = None):
+		self.arena = load_arena(arena)
+		# path length of a single frame visit per room label, NaN for rooms that are not corridors
+		self.corridor_lengths = np.array([np.nan] + [self.arena.corridor_length(name) or np.nan for name in self.arena.room_names])
+		self.previous = None
+		self.open_visit = None
+
+	def update(self, rat_path):
+		"""Add the next piece of the rat path, as read by `trajectory.iter_trajectory_chunks`.
+
+		   Returns
+		   -------
+		   visits: DataFrame
+			   the visits finished in this piece, see `visits_table`.
+		"""
+		return self.update_prepared(annotate_rooms(rat_path, self.arena, self.previous))
+
+	def update_prepared(self, rat_path):
+		"""Add the next piece of the rat path, already annotated by `annotate_rooms`. Returns the finished visits."""
+		rooms = rat_path['room_code'].values
+		n_frames = len(rooms)
+		if n_frames == 0:
+			return self._visits([], [], [], [], [])
+		self.previous = (rat_path['x_cords'].values[-1:], rat_path['y_cords'].values[-1:])
+
+		# Run-length encode the rooms: a visit starts where the room differs from the previous frame
+		starts = np.concatenate(([0], np.flatnonzero(rooms[1:] != rooms[:-1]) + 1))
+		ends = np.append(starts[1:], n_frames)
+
+		# the rat still in the room of the open visit continues it
+		continues = self.open_visit is not None and self.open_visit[0] == rooms[0]
+
+		# Entering the room is the starting point of the visit path
+		distance = np.nan_to_num(rat_path['distance'].values.astype(float))
+		distance[starts[1:] if continues else starts] = 0
+		path_lengths = np.add.reduceat(distance, starts)
+
+		frames = rat_path.index.values
+		room_codes = rooms[starts]
+		start_frames = frames[starts]
+		end_frames = frames[ends - 1]
+		durations = ends - starts
+
+		if self.open_visit is not None:
+			room, start_frame, _, duration, length = self.open_visit
+			if continues:
+				# the first run continues the open visit
+				start_frames[0] = start_frame
+				durations[0] += duration
+				path_lengths[0] += length
+			else:
+				room_codes = np.concatenate(([room], room_codes))
+				start_frames = np.concatenate(([start_frame], start_frames))
+				end_frames = np.concatenate(([self.open_visit[2]], end_frames))
+				durations = np.concatenate(([duration], durations))
+				path_lengths = np.concatenate(([length], path_lengths))
+
+		# the last run stays open
+		self.open_visit = (room_codes[-1], start_frames[-1], end_frames[-1], durations[-1], path_lengths[-1])
+		return self._visits(room_codes[:-1], start_frames[:-1], end_frames[:-1], durations[:-1], path_lengths[:-1])
+
+	def close(self):
+		"""End of the rat path, return the open visit as a visits table."""
+		if self.open_visit is None:
+			return self._visits([], [], [], [], [])
+		visits = self._visits(*[[value] for value in self.open_visit])
+		self.open_visit = None
+		return visits
+
+	def _visits(self, room_codes, start_frames, end_frames, durations, path_lengths):
+		room_codes = np.asarray(room_codes, dtype = int)
+		durations = np.asarray(durations, dtype = int)
+		path_lengths = np.array(path_lengths, dtype = float)
+		# Correct for special cases when rat only passed by a corridor and was captured there for a single frame
+		corridor_lengths = self.corridor_lengths[room_codes]
+		passed = (durations == 1) & ~np.isnan(corridor_lengths)
+		path_lengths[passed] = corridor_lengths[passed]
+		return pd.DataFrame({'room_id': self.arena.room_names_of(room_codes), 'start_frame': np.asarray(start_frames, dtype = int),
+							 'end_frame': np.asarray(end_frames, dtype = int), 'duration': durations, 'distance': path_lengths},
+							columns = VISIT_COLUMNS)
+
+
+def visits_table(rat_path, arena = None):
+	"""Split the whole path into single visits to the rooms, in one vectorized pass.
+
+	   Parameters
+	   ----------
+	   rat_path: DataFrame
+		   output of `prepare_data`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, the same as given to `prepare_data`.
+
+	   Returns
+	   -------
+	   visits: DataFrame
+		   one row per visit, in time order.
+		   columns: room_id, start_frame, end_frame, duration, distance
+
+			   start_frame, end_frame - index of the first and last frame of the visit in `rat_path`.
+			   duration - number of frames of the visit.
+			   distance - path length covered during the visit in pixels. A rat captured in a corridor room for
+						  a single frame only passed by, in that case the distance is the width of the room.
+		   Positions outside of every room make visits with a None room_id.
+	"""
+	stream = VisitStream(arena)
+	return pd.concat([stream.update_prepared(rat_path), stream.close()], ignore_index = True)
+
+
+def stream_visits(path, arena = None, chunksize = 100000):
+	"""Read the rat path in chunks and yield the visits finished in each chunk, see `VisitStream`.
+	   Concatenated, the tables are the same as `visits_table(prepare_data(path, arena), arena)`.
+
+	   Parameters
+	   ----------
+	   path: str
+		   rat path saved by motion_detector.py, see `prepare_data`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+
+	   chunksize: int
+		   rows read at once from csv files, .npz files and checkpoint chunks are read one file at a time.
+	"""
+	stream = VisitStream(arena)
+	for chunk in iter_trajectory_chunks(path, chunksize):
+		yield stream.update(chunk)
+	yield stream.close()
+
+
+def summarize_visits(visits):
+	"""Per-room totals of a visits table, see `room_summary`."""
+	grouped = visits.groupby('room_id')
+	summary = pd.DataFrame({'total_time': grouped['duration'].sum(), 'total_distance': grouped['distance'].sum(),
+							'n_visits': grouped.size(), 'mean_visit_duration': grouped['duration'].mean(),
+							'mean_path_length': grouped['distance'].mean()})
+	summary.index.name = 'room_id'
+	return summary.reset_index()[['room_id', 'total_time', 'total_distance', 'n_visits', 'mean_visit_duration', 'mean_path_length']]
+
+
+def room_summary(rat_path, arena = None):
+	"""Per-room totals of a prepared rat path, without plotting.
+
+	   Parameters
+	   ----------
+	   rat_path: DataFrame
+		   output of `prepare_data`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, the same as given to `prepare_data`.
+
+	   Returns
+	   -------
+	   summary: DataFrame
+		   columns: room_id, total_time, total_distance, n_visits, mean_visit_duration, mean_path_length.
+		   Times are in frames and distances in pixels.
+	"""
+	return summarize_visits(visits_table(rat_path, arena))
+
+
+def stream_summary(path, arena = None, chunksize = 100000):
+	"""Per-room totals of a saved rat path, read in chunks. Same as `room_summary(prepare_data(path, arena), arena)`."""
+	visits = pd.concat(list(stream_visits(path, arena, chunksize)), ignore_index = True)
+	return summarize_visits(visits)
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Per-room statistics and plots of a tracked rat path.')
+	parser.add_argument('path', nargs = '?', default = 'rat_path.npz', help = 'rat path: .npz, csv or checkpoint folder')
+	parser.add_argument('--arena', default = None, help = 'json file with the rooms of the cage, see arena.py')
+	parser.add_argument('--chunksize', type = int, default = 100000, help = 'rows of the rat path read at once')
+	parser.add_argument('--summary', default = None, help = 'save the per-room totals to this csv file')
+	parser.add_argument('--output', default = None, help = 'save the figure to this file instead of showing it')
+	args = parser.parse_args(argv)
+
+	if args.summary is not None:
+		stream_summary(args.path, args.arena, args.chunksize).to_csv(args.summary, index = False)
+	fig = plot_results(args.path, args.arena, args.chunksize)
+	if args.output is not None:
+		fig.savefig(args.output)
+	else:
+		plt.show()
+
+
+if __name__ == '__main__':
+	main()
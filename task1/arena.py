@@ -0,0 +1,225 @@
+"""
+Geometry of the cage: named polygonal rooms and zones, shared by motion_detector.py and Rat_cage_analysis.py.
+
+The polygons are rasterized once into integer label images (0 - outside of every polygon, i - the i-th room),
+so the room of a position is a single array lookup, and the rooms of a whole rat path one fancy-indexing lookup.
+Positions outside of the label image are clipped to its border. Zones (ex. a feeder or a nest) are a second
+label image, they may overlap the rooms. Where polygons overlap, the later one in the file wins.
+
+The arena is read from a json file with pixel coordinates of the video:
+
+   {"width": 640, "height": 480,
+	"rooms": [{"name": "room_1", "polygon": [[0, 0], [276, 0], [276, 479], [0, 479]]}, ...],
+	"zones": [{"name": "feeder", "polygon": [[20, 20], [60, 20], [60, 60], [20, 60]]}]}
+
+A room can be marked with "corridor": true - a rat seen there in a single frame only passed through it,
+Rat_cage_analysis then counts the room width as the path length of that visit.
+
+Rooms side by side can instead be given by the x positions of their vertical borders, they are looked up by
+comparing x with the borders (`BorderArena`), so positions between two pixels are never rounded into a room:
+
+   {"width": 720, "height": 576, "borders": [276, 463], "room_names": ["room_1", "room_2", "room_3"],
+	"corridors": ["room_2"]}
+
+Without a file the default arena is the three rooms of the original cage split at x = 276 and x = 463,
+sized to the video.
+"""
+
+import json
+
+import cv2
+import numpy as np
+
+
+# Room borders of the default arena
+left_border = 276
+right_border = 463
+
+# Label of positions outside of every polygon
+OUTSIDE = 0
+
+
+class Arena(object):
+	"""Rooms and zones of the cage rasterized to label images.
+
+	   Parameters
+	   ----------
+	   rooms: list of dict
+		   {'name': str, 'polygon': [[x, y], ...], 'corridor': bool (optional)} for every room.
+
+	   zones: list of dict
+		   same as `rooms`, for zones inside the rooms.
+
+	   width, height: int
+		   size of the label images, usually the video resolution.
+	"""
+
+	def __init__(self, rooms, zones = (), width = 640, height = 480):
+		self.width = int(width)
+		self.height = int(height)
+		self.rooms = [dict(room) for room in rooms]
+		self.zones = [dict(zone) for zone in zones]
+		if not self.rooms:
+			raise ValueError('An arena needs at least one room')
+		self.room_names = [room['name'] for room in self.rooms]
+		self.zone_names = [zone['name'] for zone in self.zones]
+		self.room_labels = self._rasterize(self.rooms)
+		self.zone_labels = self._rasterize(self.zones)
+
+	def _rasterize(self, regions):
+		"""Label image with the (index + 1) of the region covering each pixel."""
+		if len(regions) >= np.iinfo(np.uint8).max:
+			raise ValueError('At most %i rooms or zones are supported' % (np.iinfo(np.uint8).max - 1))
+		labels = np.zeros((self.height, self.width), dtype = np.uint8)
+		for label, region in enumerate(regions, 1):
+			polygon = np.round(np.asarray(region['polygon'], dtype = float)).astype(np.int32)
+			cv2.fillPoly(labels, [polygon.reshape(-1, 1, 2)], label)
+		return labels
+
+	@classmethod
+	def load(cls, path):
+		"""Read an arena json file, see the module description."""
+		with open(path) as f:
+			config = json.load(f)
+		if 'borders' in config:
+			return BorderArena(config['borders'], config.get('room_names'), config.get('corridors', ()),
+							   config.get('zones', ()), config.get('width', 640), config.get('height', 480))
+		return cls(config['rooms'], config.get('zones', ()), config.get('width', 640), config.get('height', 480))
+
+	def save(self, path):
+		"""Write the arena to a json file readable by `load`."""
+		with open(path, 'w') as f:
+			json.dump({'width': self.width, 'height': self.height, 'rooms': self.rooms, 'zones': self.zones}, f, indent = 2)
+
+	def _lookup(self, labels, x, y):
+		"""Labels at the positions `x`, `y` (scalars or arrays), NaN positions are OUTSIDE."""
+		x = np.asarray(x, dtype = float)
+		y = np.asarray(y, dtype = float)
+		missing = np.isnan(x) | np.isnan(y)
+		cols = np.clip(np.floor(np.where(missing, 0, x)), 0, self.width - 1).astype(np.intp)
+		rows = np.clip(np.floor(np.where(missing, 0, y)), 0, self.height - 1).astype(np.intp)
+		codes = labels[rows, cols]
+		return np.where(missing, OUTSIDE, codes)
+
+	def room_codes(self, x, y):
+		"""Room labels of the positions, 1 for the first room, OUTSIDE (0) for no room."""
+		return self._lookup(self.room_labels, x, y)
+
+	def zone_codes(self, x, y):
+		"""Zone labels of the positions, 1 for the first zone, OUTSIDE (0) for no zone."""
+		return self._lookup(self.zone_labels, x, y)
+
+	def room_at(self, x, y):
+		"""Name of the room at a single position, None outside of every room."""
+		code = int(self.room_codes(x, y))
+		return self.room_names[code - 1] if code != OUTSIDE else None
+
+	def room_names_of(self, codes):
+		"""Room names of an array of room labels, None for OUTSIDE."""
+		names = np.array([None] + self.room_names, dtype = object)
+		return names[np.asarray(codes)]
+
+	def corridor_length(self, name):
+		"""Width of a corridor room - the path length of a rat passing through it. None for other rooms."""
+		room = self.rooms[self.room_names.index(name)]
+		if not room.get('corridor', False):
+			return None
+		polygon = np.asarray(room['polygon'], dtype = float)
+		return polygon[:, 0].max() - polygon[:, 0].min()
+
+	def draw(self, frame, color = (255, 0, 0)):
+		"""Draw the room outlines on a frame."""
+		for room in self.rooms:
+			polygon = np.round(np.asarray(room['polygon'], dtype = float)).astype(np.int32)
+			cv2.polylines(frame, [polygon.reshape(-1, 1, 2)], True, color, 2)
+
+
+class BorderArena(Arena):
+	"""Rooms side by side, split by vertical borders - the layout of the original cage.
+
+	   The rooms are looked up by comparing x with the borders, the same rule motion_detector and
+	   Rat_cage_analysis always used: x <= first border is the first room, x >= last border the last room,
+	   the rooms in between take the positions strictly between their borders. The label image is still built,
+	   for drawing and the zones.
+
+	   Parameters
+	   ----------
+	   borders: list of float
+		   increasing x positions of the borders, one less than the rooms.
+
+	   room_names: list of str or None
+		   names of the rooms from left to right, defaults to room_1, room_2, ...
+
+	   corridors: list of str
+		   names of the corridor rooms, see the module description.
+
+	   zones, width, height:
+		   see `Arena`.
+	"""
+
+	def __init__(self, borders, room_names = None, corridors = (), zones = (), width = 640, height = 480):
+		self.borders = np.asarray(borders, dtype = float)
+		if len(self.borders) == 0 or np.any(np.diff(self.borders) <= 0):
+			raise ValueError('The borders have to be increasing x positions')
+		if room_names is None:
+			room_names = ['room_%i' % i for i in range(1, len(self.borders) + 2)]
+		if len(room_names) != len(self.borders) + 1:
+			raise ValueError('%i borders split the arena into %i rooms, not %i'
+							 % (len(self.borders), len(self.borders) + 1, len(room_names)))
+		self.corridors = list(corridors)
+		right = max(int(width), int(np.ceil(self.borders[-1])) + 1) - 1
+		bottom = int(height) - 1
+		edges = [0] + self.borders.tolist() + [right]
+		rooms = [{'name': name, 'polygon': [[x0, 0], [x1, 0], [x1, bottom], [x0, bottom]]}
+				 for name, x0, x1 in zip(room_names, edges[:-1], edges[1:])]
+		for room in rooms:
+			if room['name'] in self.corridors:
+				room['corridor'] = True
+		super(BorderArena, self).__init__(rooms, zones, right + 1, height)
+
+	def save(self, path):
+		"""Write the arena to a json file readable by `Arena.load`."""
+		with open(path, 'w') as f:
+			json.dump({'width': self.width, 'height': self.height, 'borders': self.borders.tolist(),
+					   'room_names': self.room_names, 'corridors': self.corridors, 'zones': self.zones}, f, indent = 2)
+
+	def room_codes(self, x, y):
+		"""Room labels of the positions by comparison with the borders, OUTSIDE (0) for NaN positions."""
+		x = np.asarray(x, dtype = float)
+		missing = np.isnan(x) | np.isnan(np.asarray(y, dtype = float))
+		with np.errstate(invalid = 'ignore'):
+			codes = np.searchsorted(self.borders, x, side = 'left')
+			codes = np.where(x >= self.borders[-1], len(self.borders), codes)
+		return np.where(missing, OUTSIDE, codes + 1)
+
+	def draw(self, frame, color = (255, 0, 0)):
+		"""Draw the room borders on a frame."""
+		for border in self.borders:
+			x = int(round(border))
+			cv2.line(frame, (x, 0), (x, frame.shape[0]), color, 2)
+
+
+def default_arena(width = 720, height = 576):
+	"""The three rooms of the original cage, split by vertical borders at `left_border` and `right_border`.
+	   `width` and `height` are the video resolution, the default is the size of the recorded images.
+	"""
+	return BorderArena([left_border, right_border], ['room_1', 'room_2', 'room_3'], ['room_2'],
+					   width = width, height = height)
+
+
+# Default arenas by (width, height), built on first use
+_default = {}
+
+
+def load_arena(arena = None, width = None, height = None):
+	"""Return an `Arena` from a json file path, an `Arena` as it is, or the default arena for None.
+	   `width` and `height` size the default arena to the video, they are ignored for the other arenas.
+	"""
+	if arena is None:
+		size = (width or 720, height or 576)
+		if size not in _default:
+			_default[size] = default_arena(*size)
+		return _default[size]
+	if isinstance(arena, Arena):
+		return arena
+	return Arena.load(arena)
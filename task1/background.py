@@ -0,0 +1,143 @@
+"""
+Background model for motion_detector.py.
+
+The background can be the first frame of the recording (it has to show the empty cage) or the per-pixel median
+of frames sampled across the whole recording, which removes the rat as long as it does not sit still
+in one place for most of the samples - no hand-curated empty first frame is needed.
+Computed backgrounds are saved next to the video, keyed by a hash of the video content and the
+background parameters, and reused by later runs, parallel workers and parameter sweeps.
+"""
+
+import os
+import glob
+import hashlib
+
+import cv2
+import numpy as np
+
+from frame_sources import natural_sort_key, open_frame_source, to_gray
+
+
+def _hash_file(sha, path, block_size = 1 << 16, n_blocks = 8):
+	"""Add the size and `n_blocks` evenly spaced blocks of the file to the hash."""
+	size = os.path.getsize(path)
+	sha.update(str(size).encode())
+	with open(path, 'rb') as f:
+		for offset in np.linspace(0, max(size - block_size, 0), n_blocks).astype(int):
+			f.seek(offset)
+			sha.update(f.read(block_size))
+
+
+def content_hash(video_path):
+	"""Hash identifying the content of a video file or images folder.
+
+	   Only sampled blocks of the files are read, so hashing a multi-hour recording is fast.
+	   For a folder the names and sizes of all images and the content of some of them are hashed.
+	"""
+	sha = hashlib.sha1()
+	if os.path.isdir(video_path):
+		paths = sorted((p for p in glob.glob(os.path.join(video_path, '*')) if os.path.isfile(p)), key = natural_sort_key)
+		for path in paths:
+			sha.update(os.path.basename(path).encode())
+			sha.update(str(os.path.getsize(path)).encode())
+		for path in paths[::max(len(paths) // 8, 1)]:
+			_hash_file(sha, path, n_blocks = 1)
+	else:
+		_hash_file(sha, video_path)
+	return sha.hexdigest()
+
+
+def blur(gray, kernel):
+	"""Gaussian blur with a `kernel` x `kernel` window, no blur for kernel 0."""
+	if not kernel:
+		return gray
+	return cv2.GaussianBlur(gray, (kernel, kernel), 0)
+
+
+def first_frame_background(source, kernel = 21):
+	"""Blurred greyscale first frame of the recording - it has to be the empty background."""
+	for _, frame in source.frames(0, 1):
+		return blur(to_gray(frame), kernel)
+	raise IOError('No frames in %s' % source.path)
+
+
+def median_background(source, kernel = 21, n_samples = 25):
+	"""Blurred per-pixel median of `n_samples` greyscale frames spread evenly over the recording."""
+	idcs = np.unique(np.linspace(0, max(source.n_frames - 1, 0), n_samples).astype(int))
+	frames = []
+	for idx in idcs:
+		for _, frame in source.frames(idx, idx + 1):
+			frames.append(to_gray(frame))
+	if not frames:
+		raise IOError('No frames in %s' % source.path)
+	median = np.median(np.stack(frames), axis = 0)
+	return blur(median.astype(np.uint8), kernel)
+
+
+# Available background models
+METHODS = ('first', 'median')
+
+
+def background_path(video_path, method = 'first', kernel = 21, n_samples = 25, content_key = None):
+	"""Path of the cached background, next to the video, ex. rat_video.avi.background_<hash>_median_b21_n25.npy
+	   `content_key` is the `content_hash` of the recording, computed when None.
+	"""
+	if method == 'first':
+		n_samples = 1
+	if content_key is None:
+		content_key = content_hash(video_path)
+	key = '%s_%s_b%i_n%i' % (content_key[:16], method, kernel, n_samples)
+	return '%s.background_%s.npy' % (os.path.normpath(video_path), key)
+
+
+def load_background(video_path, method = 'first', kernel = 21, n_samples = 25, cache = True, content_key = None):
+	"""Return the background of a recording, computing it only if it is not cached yet.
+
+	   Parameters
+	   ----------
+	   video_path: str
+		   video file or folder with images.
+
+	   method: str
+		   'first' - the first frame (must be the empty cage), 'median' - median of sampled frames.
+
+	   kernel: int
+		   size of the gaussian blur applied to the background, 0 for no blur.
+
+	   n_samples: int
+		   number of frames sampled for the median.
+
+	   cache: bool
+		   read and write the background next to the video.
+
+	   content_key: str or None
+		   `content_hash` of the recording, computed when None. Hashing a large images folder stats every file,
+		   callers loading several backgrounds or caches of one recording compute it once and pass it.
+
+	   Returns
+	   -------
+	   background: numpy.array
+		   uint8 greyscale background image.
+	"""
+	if method not in METHODS:
+		raise ValueError('Unknown background method %s, use one of %s' % (method, sorted(METHODS)))
+	path = background_path(video_path, method, kernel, n_samples, content_key) if cache else None
+	if path is not None and os.path.isfile(path):
+		return np.load(path)
+
+	source = open_frame_source(video_path)
+	if method == 'median':
+		background = median_background(source, kernel, n_samples)
+	else:
+		background = first_frame_background(source, kernel)
+
+	if path is not None:
+		# write to a temporary file first, so parallel runs never read a half written background
+		tmp_path = '%s.%i.tmp.npy' % (path[:-4], os.getpid())
+		try:
+			np.save(tmp_path, background)
+			os.replace(tmp_path, path)
+		except (IOError, OSError):
+			# read-only location, the background is only not reused
+			pass
+	return background
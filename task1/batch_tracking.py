@@ -0,0 +1,187 @@
+"""
+Tracks many recordings and computes the Rat_cage_analysis room statistics for each of them on a process pool.
+
+The recordings are the video files and image folders inside a directory, or the paths listed in a text file
+(one per line). The status, timing and output paths of every job are saved in a json manifest after each
+finished job, so an interrupted batch started again with the same output directory only runs the unfinished jobs.
+At the end the room statistics of all recordings are collected in one summary table.
+
+ex. python batch_tracking.py recordings/ --output-dir results/ --workers 8
+"""
+
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from frame_sources import natural_sort_key
+from motion_detector import track
+from Rat_cage_analysis import stream_summary
+
+
+# File extensions treated as videos when scanning a directory
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.mpg')
+
+
+def find_recordings(path):
+	"""List the recordings in a directory or in a text file with one recording path per line.
+
+	   Video files and folders with images directly inside a directory are recordings.
+	"""
+	if os.path.isfile(path):
+		with open(path) as f:
+			return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+	recordings = []
+	for name in sorted(os.listdir(path), key = natural_sort_key):
+		full_path = os.path.join(path, name)
+		if os.path.isdir(full_path) or os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+			recordings.append(full_path)
+	return recordings
+
+
+def job_name(recording):
+	"""Name of the job and of its output folder, ex. 'cage_3' for recordings/cage_3.avi"""
+	return os.path.splitext(os.path.basename(os.path.normpath(recording)))[0]
+
+
+def load_manifest(path):
+	if not os.path.isfile(path):
+		return {'jobs': {}}
+	with open(path) as f:
+		return json.load(f)
+
+
+def save_manifest(manifest, path):
+	"""Write the manifest to a temporary file first, so an interrupted write never corrupts it."""
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(manifest, f, indent = 2, sort_keys = True)
+	os.replace(tmp_path, path)
+
+
+def run_job(recording, output_dir, track_kwargs):
+	"""Track one recording and compute its room statistics. Runs in a worker process.
+
+	   Returns
+	   -------
+	   result: dict
+		   status, timing, output paths and error message of the job.
+	"""
+	start = time.time()
+	os.makedirs(output_dir, exist_ok = True)
+	trajectory_path = os.path.join(output_dir, 'rat_path.npz')
+	summary_path = os.path.join(output_dir, 'room_summary.csv')
+	result = {'recording': recording, 'started': start, 'outputs': {}}
+	try:
+		track(recording, output_path = trajectory_path, headless = True, **track_kwargs)
+		arena = track_kwargs.get('arena')
+		stream_summary(trajectory_path, arena).to_csv(summary_path, index = False)
+		result['status'] = 'done'
+		result['outputs'] = {'trajectory': trajectory_path, 'room_summary': summary_path}
+	except Exception:
+		result['status'] = 'failed'
+		result['error'] = traceback.format_exc()
+	result['finished'] = time.time()
+	result['seconds'] = result['finished'] - start
+	return result
+
+
+def run_batch(recordings, output_dir, n_workers = None, retry_failed = False, **track_kwargs):
+	"""Track and analyze all recordings, skipping the ones already done in a previous run.
+
+	   Parameters
+	   ----------
+	   recordings: str or list
+		   directory or text file with the recordings, see `find_recordings`, or a list of recording paths.
+
+	   output_dir: str
+		   one folder per recording is created here, together with manifest.json and summary.csv.
+
+	   n_workers: int or None
+		   number of worker processes, defaults to the number of CPUs.
+
+	   retry_failed: bool
+		   also run again the jobs that failed in a previous run.
+
+	   Other keyword arguments are passed to `motion_detector.track`, ex. detector = 'components'.
+	   The arena keyword also sets the rooms of the statistics.
+
+	   Returns
+	   -------
+	   summary: DataFrame
+		   room statistics of all finished recordings, see `Rat_cage_analysis.room_summary`, with a recording column.
+	"""
+	if not isinstance(recordings, (list, tuple)):
+		recordings = find_recordings(recordings)
+	os.makedirs(output_dir, exist_ok = True)
+	manifest_path = os.path.join(output_dir, 'manifest.json')
+	manifest = load_manifest(manifest_path)
+	jobs = manifest['jobs']
+
+	pending = []
+	for recording in recordings:
+		name = job_name(recording)
+		job = jobs.setdefault(name, {'recording': recording, 'status': 'pending'})
+		# jobs left 'running' were interrupted and are run again
+		if job['status'] == 'done' or (job['status'] == 'failed' and not retry_failed):
+			continue
+		job['status'] = 'pending'
+		pending.append(name)
+	save_manifest(manifest, manifest_path)
+	print('%i of %i recordings to process' % (len(pending), len(recordings)))
+
+	with ProcessPoolExecutor(max_workers = n_workers) as pool:
+		futures = {}
+		for name in pending:
+			jobs[name]['status'] = 'running'
+			futures[pool.submit(run_job, jobs[name]['recording'], os.path.join(output_dir, name), track_kwargs)] = name
+		save_manifest(manifest, manifest_path)
+		for future in as_completed(futures):
+			name = futures[future]
+			jobs[name].update(future.result())
+			save_manifest(manifest, manifest_path)
+			print('%s: %s in %.1f s' % (name, jobs[name]['status'], jobs[name]['seconds']))
+
+	summary = collect_summary(manifest)
+	summary.to_csv(os.path.join(output_dir, 'summary.csv'), index = False)
+	return summary
+
+
+def collect_summary(manifest):
+	"""Concatenate the room statistics of all finished jobs in the manifest."""
+	tables = []
+	for name, job in sorted(manifest['jobs'].items()):
+		if job['status'] != 'done':
+			continue
+		table = pd.read_csv(job['outputs']['room_summary'])
+		table.insert(0, 'recording', name)
+		tables.append(table)
+	if not tables:
+		return pd.DataFrame(columns = ['recording', 'room_id', 'total_time', 'total_distance', 'n_visits',
+									   'mean_visit_duration', 'mean_path_length'])
+	return pd.concat(tables, ignore_index = True)
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Track and analyze many rat cage recordings.')
+	parser.add_argument('recordings', help = 'directory with videos or image folders, or a text file with one path per line')
+	parser.add_argument('--output-dir', default = 'batch_results', help = 'where the results and the manifest are saved')
+	parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes')
+	parser.add_argument('--retry-failed', action = 'store_true', help = 'run again the jobs that failed before')
+	parser.add_argument('--detector', default = 'contours', help = 'detector backend')
+	parser.add_argument('--background', default = 'first', choices = ['first', 'median'], help = 'background model')
+	parser.add_argument('--arena', default = None, help = 'json file with the rooms of the cage, see arena.py')
+	args = parser.parse_args(argv)
+
+	summary = run_batch(args.recordings, args.output_dir, n_workers = args.workers, retry_failed = args.retry_failed,
+						detector = args.detector, background = args.background, arena = args.arena)
+	print(summary.round(2).to_string(index = False))
+
+
+if __name__ == '__main__':
+	main()
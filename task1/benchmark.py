@@ -0,0 +1,186 @@
+"""
+Benchmark suite for the tracking pipeline in motion_detector.py.
+
+Generates synthetic cage videos - a dark blob moving over a static textured background with pixel noise - of
+configurable resolution and length, tracks them headless with the per-stage timers enabled and reports
+frames/sec, the slowest stage and the tracking error against the known blob positions.
+No private recordings are needed, so regressions and backend comparisons are reproducible.
+
+Run python benchmark.py --help for the options.
+"""
+
+import os
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from motion_detector import track, DETECTORS
+from profiling import StageTimer
+
+
+def synthetic_positions(n_frames, width, height, radius, rng):
+	"""Smooth random walk of the blob center, bouncing off the cage walls."""
+	positions = np.empty((n_frames, 2))
+	position = np.array([width / 2.0, height / 2.0])
+	velocity = np.zeros(2)
+	low, high = np.array([radius, radius]), np.array([width - radius, height - radius])
+	for i in range(n_frames):
+		velocity = 0.9 * velocity + rng.normal(0, radius / 4.0, 2)
+		position = position + velocity
+		# bounce off the walls
+		out = (position < low) | (position > high)
+		velocity[out] *= -1
+		position = np.clip(position, low, high)
+		positions[i] = position
+	return positions
+
+
+def make_synthetic_video(path, width = 640, height = 480, n_frames = 300, fps = 25.0, radius = None, noise = 4.0,
+						 seed = 0):
+	"""Write a synthetic cage recording.
+
+	   Parameters
+	   ----------
+	   path: str
+		   video file (written with the MJPG codec) or a folder, which is filled with numbered jpeg images.
+
+	   width, height: int
+		   resolution of the video.
+
+	   n_frames: int
+		   number of frames, including the empty background first frame.
+
+	   fps: float
+		   frame rate of the video file.
+
+	   radius: int or None
+		   radius of the blob in pixels, defaults to 1/25 of the shorter side.
+
+	   noise: float
+		   standard deviation of the gaussian pixel noise added to every frame.
+
+	   seed: int
+		   seed of the random generator, the same seed gives the same video.
+
+	   Returns
+	   -------
+	   positions: numpy.array
+		   (n_frames, 2) x and y of the blob center, NaN for the empty first frame.
+	"""
+	rng = np.random.RandomState(seed)
+	if radius is None:
+		radius = max(min(width, height) // 25, 4)
+	# static textured background
+	background = cv2.GaussianBlur(rng.randint(90, 170, (height, width, 3)).astype(np.uint8), (0, 0), 8)
+	positions = synthetic_positions(n_frames, width, height, radius, rng)
+	positions[0] = np.nan
+
+	as_images = not os.path.splitext(path)[1]
+	if as_images:
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		out = None
+	else:
+		out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+
+	for i in range(n_frames):
+		frame = background.copy()
+		if i > 0:
+			center = tuple(int(round(v)) for v in positions[i])
+			cv2.ellipse(frame, center, (radius, int(radius * 0.6)), 0, 0, 360, (30, 30, 30), -1)
+		if noise:
+			frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+		if as_images:
+			cv2.imwrite(os.path.join(path, 'img%06d.jpeg' % (i + 1)), frame)
+		else:
+			out.write(frame)
+
+	if out is not None:
+		out.release()
+	return positions
+
+
+def run_benchmarks(resolutions = ((640, 480), (1280, 960), (1920, 1080)), n_frames = 300, detectors = ('contours',),
+				   windows = (False,), workdir = None, seed = 0):
+	"""Track synthetic videos for every combination of the settings.
+
+	   Parameters
+	   ----------
+	   resolutions: list
+		   (width, height) of the generated videos.
+
+	   n_frames: int
+		   length of the generated videos.
+
+	   detectors: list
+		   detector backends to run, see `motion_detector.DETECTORS`.
+
+	   windows: list
+		   search window modes to run, ex. (False, True).
+
+	   workdir: str or None
+		   where to write the generated videos, a temporary folder by default.
+
+	   seed: int
+		   seed of the generated videos.
+
+	   Returns
+	   -------
+	   results: DataFrame
+		   columns: width, height, detector, window, fps, slowest_stage, missed_frames, mean_error, max_error.
+		   Errors are distances between tracked and true blob centers in pixels.
+	"""
+	if workdir is None:
+		workdir = tempfile.mkdtemp(prefix = 'rat_benchmark_')
+	rows = []
+	for width, height in resolutions:
+		video_path = os.path.join(workdir, 'synthetic_%ix%i_%i.avi' % (width, height, n_frames))
+		truth = make_synthetic_video(video_path, width, height, n_frames, seed = seed)
+		for detector in detectors:
+			for window in windows:
+				timer = StageTimer()
+				rat_path, missed_frames_idx = track(video_path, output_path = None, headless = True, detector = detector,
+													window = window, timer = timer)
+				frames = rat_path.column('frame').astype(int)
+				tracked = np.column_stack([rat_path.column('x_cords'), rat_path.column('y_cords')])
+				error = np.hypot(*(tracked - truth[frames]).T)
+				error = error[~np.isnan(error)]
+				report = timer.report()
+				rows.append({'width': width, 'height': height, 'detector': detector, 'window': window, 'fps': timer.fps,
+							 'slowest_stage': report['total_s'].idxmax() if len(report) else None,
+							 'missed_frames': len(missed_frames_idx),
+							 'mean_error': error.mean() if len(error) else np.nan,
+							 'max_error': error.max() if len(error) else np.nan})
+	return pd.DataFrame(rows, columns = ['width', 'height', 'detector', 'window', 'fps', 'slowest_stage', 'missed_frames',
+										 'mean_error', 'max_error'])
+
+
+def parse_resolution(text):
+	"""'640x480' -> (640, 480)"""
+	width, height = text.lower().split('x')
+	return int(width), int(height)
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Benchmark the rat tracking on synthetic videos.')
+	parser.add_argument('--resolutions', nargs = '+', type = parse_resolution, default = [(640, 480), (1280, 960), (1920, 1080)],
+						metavar = 'WxH', help = 'resolutions of the generated videos')
+	parser.add_argument('--frames', type = int, default = 300, help = 'length of the generated videos')
+	parser.add_argument('--detectors', nargs = '+', default = ['contours'], choices = sorted(DETECTORS), help = 'detector backends')
+	parser.add_argument('--window', action = 'store_true', help = 'also run the search window mode')
+	parser.add_argument('--workdir', default = None, help = 'where to write the generated videos')
+	parser.add_argument('--output', default = None, help = 'save the results to this csv file')
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.resolutions, args.frames, args.detectors, (False, True) if args.window else (False,), args.workdir)
+	print(results.round(2).to_string(index = False))
+	if args.output is not None:
+		results.to_csv(args.output, index = False)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,127 @@
+"""
+On-disk cache of preprocessed frames for motion_detector.py.
+
+Decoding and blurring are the same for every threshold and dilation setting, so when tuning those only the
+later stages need to run. The cache is a memory-mapped uint8 .npy stack saved next to the video, with either
+the blurred greyscale frames ('blurred' stage) or their absolute difference to the background ('delta' stage),
+keyed by the video content hash, the blur kernel and, for the 'delta' stage, the background model.
+The headless tracker finds the cache by itself and starts from the cached stage.
+
+   python frame_cache.py rat_video.avi --stage delta
+"""
+
+import os
+import argparse
+
+import cv2
+import numpy as np
+
+from frame_sources import open_frame_source, to_gray
+from background import blur, content_hash, load_background
+
+
+# Cached pipeline stages, the later stage first
+STAGES = ('delta', 'blurred')
+
+
+def cache_path(video_path, stage = 'blurred', kernel = 21, background = 'first', background_samples = 25, content_key = None):
+	"""Path of the frame cache, next to the video, ex. rat_video.avi.frames_<hash>_delta_b21_first.npy
+	   `content_key` is the `background.content_hash` of the recording, computed when None.
+	"""
+	if content_key is None:
+		content_key = content_hash(video_path)
+	key = '%s_%s_b%i' % (content_key[:16], stage, kernel)
+	if stage == 'delta':
+		key += '_%s' % background if background == 'first' else '_%s%i' % (background, background_samples)
+	return '%s.frames_%s.npy' % (os.path.normpath(video_path), key)
+
+
+def find_frame_cache(video_path, kernel = 21, background = 'first', background_samples = 25, content_key = None):
+	"""Return (stage, memory-mapped stack) of the latest cached stage of the video, (None, None) if there is none."""
+	if content_key is None:
+		content_key = content_hash(video_path)
+	for stage in STAGES:
+		path = cache_path(video_path, stage, kernel, background, background_samples, content_key)
+		if os.path.isfile(path):
+			return stage, np.load(path, mmap_mode = 'r')
+	return None, None
+
+
+def build_frame_cache(video_path, stage = 'blurred', kernel = 21, background = 'first', background_samples = 25,
+					  content_key = None):
+	"""Preprocess all frames of the video once and save them as a memory-mapped stack.
+
+	   Parameters
+	   ----------
+	   video_path: str
+		   video file, images folder or frame stack.
+
+	   stage: str
+		   'blurred' - blurred greyscale frames,
+		   'delta' - absolute difference of the blurred frames and the background.
+
+	   kernel: int
+		   size of the gaussian blur.
+
+	   background, background_samples:
+		   background model of the 'delta' stage, see `background.load_background`.
+
+	   content_key: str or None
+		   `background.content_hash` of the recording, computed when None.
+
+	   Returns
+	   -------
+	   path: str
+		   path of the saved cache.
+	"""
+	if stage not in STAGES:
+		raise ValueError('Unknown stage %s, use one of %s' % (stage, STAGES))
+	if content_key is None:
+		content_key = content_hash(video_path)
+	path = cache_path(video_path, stage, kernel, background, background_samples, content_key)
+	source = open_frame_source(video_path)
+	first_frame = None
+	if stage == 'delta':
+		first_frame = load_background(video_path, background, kernel, background_samples, cache = background != 'first',
+									  content_key = content_key)
+
+	# write to a temporary file, an interrupted run never leaves a partial cache behind
+	tmp_path = '%s.%i.tmp.npy' % (path[:-4], os.getpid())
+	stack = np.lib.format.open_memmap(tmp_path, mode = 'w+', dtype = np.uint8, shape = (source.n_frames, source.height, source.width))
+	n_frames = 0
+	for frame_idx, frame in source:
+		# the frame count of some videos is only an estimate
+		if frame_idx >= len(stack):
+			break
+		gray = blur(to_gray(frame), kernel)
+		stack[frame_idx] = gray if first_frame is None else cv2.absdiff(first_frame, gray)
+		n_frames += 1
+	stack.flush()
+
+	if n_frames == len(stack):
+		del stack
+		os.replace(tmp_path, path)
+	else:
+		# only the frames actually read, also written to a temporary file first
+		short_path = '%s.%i.short.tmp.npy' % (path[:-4], os.getpid())
+		np.save(short_path, stack[:n_frames])
+		del stack
+		os.remove(tmp_path)
+		os.replace(short_path, path)
+	return path
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Cache the preprocessed frames of a video for threshold re-tuning.')
+	parser.add_argument('video_path', help = 'video file or images folder')
+	parser.add_argument('--stage', default = 'blurred', choices = STAGES, help = 'pipeline stage to cache')
+	parser.add_argument('--blur', type = int, default = 21, help = 'gaussian blur kernel size')
+	parser.add_argument('--background', default = 'first', choices = ['first', 'median'], help = 'background model of the delta stage')
+	args = parser.parse_args(argv)
+
+	print('Saved %s' % build_frame_cache(args.video_path, args.stage, args.blur, args.background))
+
+
+if __name__ == '__main__':
+	main()
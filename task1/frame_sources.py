@@ -0,0 +1,187 @@
+"""
+Frame sources for the tracking scripts - a video file, a folder of images or a frame stack saved
+by img2vid.py as a .npy file, read frame by frame.
+"""
+
+import os
+import re
+import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+def natural_sort_key(path):
+	"""Sort key ordering file names by the numbers they contain, so img2.jpeg comes before img10.jpeg."""
+	return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def to_gray(frame):
+	"""Greyscale version of a BGR frame, greyscale frames are returned unchanged."""
+	if frame.ndim == 2:
+		return frame
+	return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+class VideoFrameSource(object):
+	"""Frames of a video file decoded with cv2.VideoCapture.
+
+	   Parameters
+	   ----------
+	   path: str
+	       path to the video file.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		clip = cv2.VideoCapture(path)
+		if not clip.isOpened():
+			raise IOError('Could not open video %s' % path)
+		self.height = int(clip.get(cv2.CAP_PROP_FRAME_HEIGHT))
+		self.width = int(clip.get(cv2.CAP_PROP_FRAME_WIDTH))
+		self.n_frames = int(clip.get(cv2.CAP_PROP_FRAME_COUNT))
+		self.fps = clip.get(cv2.CAP_PROP_FPS)
+		clip.release()
+
+	def __len__(self):
+		return self.n_frames
+
+	def __iter__(self):
+		return self.frames()
+
+	def frames(self, start = 0, stop = None):
+		"""Yield (frame_idx, frame) pairs for frames in [`start`, `stop`)."""
+		clip = cv2.VideoCapture(self.path)
+		try:
+			if start:
+				clip.set(cv2.CAP_PROP_POS_FRAMES, start)
+			frame_idx = start
+			while stop is None or frame_idx < stop:
+				(grabbed, frame) = clip.read()
+				# if the frame could not be grabbed, then we have reached the end of the video
+				if not grabbed:
+					break
+				yield frame_idx, frame
+				frame_idx += 1
+		finally:
+			clip.release()
+
+
+class ImageFolderFrameSource(object):
+	"""Frames stored as separate image files in a folder, in natural numeric order of the file names.
+
+	   The images are decoded by a pool of threads (cv2.imread releases the GIL) and at most `prefetch` 
+	   decoded frames are kept waiting, so the tracking loop does not stall on disk reads and memory stays bounded.
+
+	   Parameters
+	   ----------
+	   folder: str
+	       directory with the images, ex. 'images'. All images must have the same resolution.
+
+	   n_workers: int
+	       number of decoding threads.
+
+	   prefetch: int
+	       maximum number of frames decoded ahead of the consumer.
+
+	   gray: bool
+	       decode the images directly to greyscale.
+	"""
+
+	def __init__(self, folder, n_workers = 4, prefetch = 32, gray = False):
+		self.path = folder
+		self.flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+		self.paths = sorted((p for p in glob.glob(os.path.join(folder, '*')) if os.path.isfile(p)), key = natural_sort_key)
+		if not self.paths:
+			raise IOError('No images found in %s' % folder)
+		self.n_workers = n_workers
+		self.prefetch = max(prefetch, n_workers)
+		first_img = self._read(self.paths[0])
+		self.height, self.width = first_img.shape[:2]
+		self.n_frames = len(self.paths)
+		self.fps = 25.0
+
+	def __len__(self):
+		return self.n_frames
+
+	def __iter__(self):
+		return self.frames()
+
+	def _read(self, path):
+		img = cv2.imread(path, self.flags)
+		if img is None:
+			raise IOError('Could not decode image %s' % path)
+		return img
+
+	def frames(self, start = 0, stop = None):
+		"""Yield (frame_idx, frame) pairs for frames in [`start`, `stop`)."""
+		paths = self.paths[start:stop]
+		with ThreadPoolExecutor(max_workers = self.n_workers) as pool:
+			# Futures of the frames being decoded, in frame order
+			pending = deque()
+			next_path = iter(paths)
+			for path in next_path:
+				pending.append(pool.submit(self._read, path))
+				if len(pending) >= self.prefetch:
+					break
+			frame_idx = start
+			try:
+				while pending:
+					frame = pending.popleft().result()
+					# Keep the prefetch queue full
+					for path in next_path:
+						pending.append(pool.submit(self._read, path))
+						break
+					yield frame_idx, frame
+					frame_idx += 1
+			finally:
+				for future in pending:
+					future.cancel()
+
+
+class StackFrameSource(object):
+	"""Frames of a uint8 (n_frames, height, width[, 3]) frame stack saved as .npy, ex. by img2vid.py.
+
+	   The file is memory-mapped, so any frame can be read by its index without decoding
+	   and parallel workers share the same pages.
+
+	   Parameters
+	   ----------
+	   path: str
+	       path to the .npy file.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.stack = np.load(path, mmap_mode = 'r')
+		self.n_frames, self.height, self.width = self.stack.shape[:3]
+		self.fps = 25.0
+
+	def __len__(self):
+		return self.n_frames
+
+	def __iter__(self):
+		return self.frames()
+
+	def __getitem__(self, frame_idx):
+		return self.stack[frame_idx]
+
+	def frames(self, start = 0, stop = None):
+		"""Yield (frame_idx, frame) pairs for frames in [`start`, `stop`)."""
+		stop = self.n_frames if stop is None else min(stop, self.n_frames)
+		for frame_idx in range(start, stop):
+			# copy, the memory-mapped pages are read-only and frames get drawn on
+			yield frame_idx, np.array(self.stack[frame_idx])
+
+
+def open_frame_source(path, **kwargs):
+	"""Return a frame source for `path` - a folder of images, a .npy frame stack or a video file.
+	   Keyword arguments are passed to `ImageFolderFrameSource` and ignored for the other sources.
+	"""
+	if os.path.isdir(path):
+		return ImageFolderFrameSource(path, **kwargs)
+	if path.endswith('.npy'):
+		return StackFrameSource(path)
+	return VideoFrameSource(path)
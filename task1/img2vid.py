@@ -1,37 +1,116 @@
 """
-Converts a folder of images to a video. Only for convienience.
+Converts a folder of images to a video. Only for convienience, motion_detector.py can read the images folder directly.
+
+The images are ordered by the numbers in their file names (img2.jpeg before img10.jpeg), decoded in parallel
+and streamed to the output one by one, so memory stays bounded for any number of images.
+Instead of a video the frames can be saved as a memory-mapped uint8 .npy frame stack, which can be sliced
+by frame index without any video decoding (motion_detector.py reads it like a video):
+
+   python img2vid.py images --output rat_video.avi
+   python img2vid.py images --output rat_frames.npy --gray
 """
 
+import argparse
+
 import numpy as np
 import cv2
-import glob
-
-# Get the paths of all images. Make sure these are in correct order, as they determine the frame number 
-img_paths = glob.glob('images/*')
-
-#All images must have the same resolution
-first_img = cv2.imread(img_paths[0],1)
-
-#Frame rate for the output video
-frameRate = 25
-
-# Define the codec and create VideoWriter object
-fourcc = cv2.VideoWriter_fourcc(*'XVID')
-# Pass the name, codec, frame rate and resolution to the VideoWriter
-out = cv2.VideoWriter('rat_video.avi',fourcc, frameRate, (first_img.shape[1], first_img.shape[0]))
-
-# Loop over all images
-for path in img_paths:
-        img = cv2.imread(path,1)
-        # Write the frame to the video
-        out.write(img)
-        
-        # Uncomment to play the video in a window
-        #cv2.imshow('frame',img)
-        #if cv2.waitKey(1) & 0xFF == ord('q'):
-            #break
-
-# Release everything if job is finished
-cap.release()
-out.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+
+from frame_sources import ImageFolderFrameSource
+
+
+def images_to_video(folder = 'images', output = 'rat_video.avi', frame_rate = 25, gray = False, n_workers = 4):
+	"""Write the images in `folder` to a video file.
+
+	   Parameters
+	   ----------
+	   folder: str
+		   directory with the images. All images must have the same resolution.
+
+	   output: str
+		   path of the video, written with the XVID codec.
+
+	   frame_rate: float
+		   frame rate of the output video.
+
+	   gray: bool
+		   write a greyscale video.
+
+	   n_workers: int
+		   number of image decoding threads.
+
+	   Returns
+	   -------
+	   n_frames: int
+		   number of frames written.
+	"""
+	source = ImageFolderFrameSource(folder, n_workers = n_workers, gray = gray)
+	# Define the codec and create VideoWriter object
+	fourcc = cv2.VideoWriter_fourcc(*'XVID')
+	# Pass the name, codec, frame rate and resolution to the VideoWriter
+	out = cv2.VideoWriter(output, fourcc, frame_rate, (source.width, source.height), not gray)
+	if not out.isOpened():
+		raise IOError('Could not open %s for writing, check the codec and the output path' % output)
+	n_frames = 0
+	try:
+		for _, img in source:
+			# Write the frame to the video
+			out.write(img)
+			n_frames += 1
+	finally:
+		# Release everything if job is finished
+		out.release()
+	return n_frames
+
+
+def images_to_stack(folder = 'images', output = 'rat_frames.npy', gray = False, n_workers = 4):
+	"""Write the images in `folder` to a memory-mapped uint8 .npy frame stack.
+
+	   Parameters
+	   ----------
+	   folder: str
+		   directory with the images. All images must have the same resolution.
+
+	   output: str
+		   path of the .npy file. The stack has the shape (n_frames, height, width) for greyscale
+		   and (n_frames, height, width, 3) for BGR frames.
+
+	   gray: bool
+		   save greyscale frames, a third of the size of BGR frames.
+
+	   n_workers: int
+		   number of image decoding threads.
+
+	   Returns
+	   -------
+	   n_frames: int
+		   number of frames written.
+	"""
+	source = ImageFolderFrameSource(folder, n_workers = n_workers, gray = gray)
+	shape = (source.n_frames, source.height, source.width) + (() if gray else (3,))
+	stack = np.lib.format.open_memmap(output, mode = 'w+', dtype = np.uint8, shape = shape)
+	for frame_idx, img in source:
+		stack[frame_idx] = img
+	stack.flush()
+	del stack
+	return source.n_frames
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Convert a folder of images to a video or a .npy frame stack.')
+	parser.add_argument('folder', nargs = '?', default = 'images', help = 'folder with the images')
+	parser.add_argument('--output', default = 'rat_video.avi', help = 'output video, or a .npy file for a frame stack')
+	parser.add_argument('--fps', type = float, default = 25, help = 'frame rate of the output video')
+	parser.add_argument('--gray', action = 'store_true', help = 'save greyscale frames')
+	parser.add_argument('--workers', type = int, default = 4, help = 'number of image decoding threads')
+	args = parser.parse_args(argv)
+
+	if args.output.endswith('.npy'):
+		n_frames = images_to_stack(args.folder, args.output, args.gray, args.workers)
+	else:
+		n_frames = images_to_video(args.folder, args.output, args.fps, args.gray, args.workers)
+	print('Saved %i frames to %s' % (n_frames, args.output))
+
+
+if __name__ == '__main__':
+	main()
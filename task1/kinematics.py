@@ -0,0 +1,233 @@
+"""
+Speed, acceleration, immobility bouts and occupancy maps of rat paths tracked by motion_detector.py.
+
+All measures are computed on whole columns of the rat path with NumPy/SciPy, there is no per-frame Python work:
+positions are smoothed with a Savitzky-Golay filter (short gaps of missed frames are interpolated first),
+speed and acceleration are their gradients, immobility bouts are the runs of frames below a speed threshold
+and the occupancy maps are 2D histograms of the positions in every room of the arena.
+The results of a recording are saved as one compact .npz file, many recordings are processed on a process pool.
+
+   python kinematics.py rat_path.npz other_cage/rat_path.npz --output-dir kinematics/ --fps 10
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_filter
+
+from trajectory import load_trajectory
+from arena import load_arena
+
+
+def smooth_positions(x, y, window = 7, polyorder = 2):
+	"""Savitzky-Golay smoothed positions.
+
+	   Parameters
+	   ----------
+	   x, y: numpy.array
+		   positions of the rat, NaN where it was not detected.
+
+	   window: int
+		   length of the filter window in frames (odd), shortened for short paths.
+
+	   polyorder: int
+		   order of the polynomial fitted in the window.
+
+	   Returns
+	   -------
+	   x, y: numpy.array
+		   smoothed positions, the missed frames are interpolated for the filter and are NaN again in the output.
+	"""
+	x = np.asarray(x, dtype = float)
+	y = np.asarray(y, dtype = float)
+	detected = ~(np.isnan(x) | np.isnan(y))
+	if detected.sum() < 2:
+		return x.copy(), y.copy()
+	window = min(window, len(x) if len(x) % 2 else len(x) - 1)
+	if window <= polyorder:
+		return x.copy(), y.copy()
+
+	frames = np.arange(len(x))
+	smoothed = []
+	for values in (x, y):
+		filled = np.interp(frames, frames[detected], values[detected])
+		values = savgol_filter(filled, window, polyorder)
+		values[~detected] = np.nan
+		smoothed.append(values)
+	return smoothed[0], smoothed[1]
+
+
+def speed_and_acceleration(x, y, fps = 1.0):
+	"""Instantaneous speed (pixels/s) and acceleration (pixels/s**2) of the positions, NaN around missed frames."""
+	if len(x) < 2:
+		return np.full(len(x), np.nan), np.full(len(x), np.nan)
+	vx = np.gradient(x) * fps
+	vy = np.gradient(y) * fps
+	speed = np.hypot(vx, vy)
+	return speed, np.gradient(speed) * fps
+
+
+def run_lengths(mask):
+	"""Start index and length of every run of True values in a boolean array."""
+	padded = np.concatenate(([False], np.asarray(mask, dtype = bool), [False]))
+	edges = np.flatnonzero(padded[1:] != padded[:-1])
+	starts, stops = edges[::2], edges[1::2]
+	return starts, stops - starts
+
+
+def immobility_bouts(speed, threshold = 2.0, min_frames = 3):
+	"""Runs of at least `min_frames` frames with a speed below `threshold`, missed frames end a bout.
+
+	   Returns
+	   -------
+	   starts, lengths: numpy.array
+		   first frame (position in `speed`) and number of frames of every bout.
+	"""
+	with np.errstate(invalid = 'ignore'):
+		starts, lengths = run_lengths(np.asarray(speed) < threshold)
+	keep = lengths >= min_frames
+	return starts[keep], lengths[keep]
+
+
+def occupancy_maps(x, y, room_codes, arena, bins = 32):
+	"""2D histograms of the positions in every room of the arena.
+
+	   Returns
+	   -------
+	   maps: numpy.array
+		   (n_rooms, bins, bins) frame counts, the rooms in the order of `arena.room_names`, rows are y bins.
+	"""
+	arena = load_arena(arena)
+	detected = ~(np.isnan(x) | np.isnan(y))
+	value_range = [[0, arena.width], [0, arena.height]]
+	maps = np.zeros((len(arena.room_names), bins, bins), dtype = np.int32)
+	for room in range(len(arena.room_names)):
+		inside = detected & (room_codes == room + 1)
+		counts, _, _ = np.histogram2d(x[inside], y[inside], bins = bins, range = value_range)
+		maps[room] = counts.T
+	return maps
+
+
+def kinematics(path, arena = None, fps = 1.0, window = 7, polyorder = 2, speed_threshold = 2.0, min_immobile_frames = 3,
+			   bins = 32):
+	"""Compute all measures of one rat path.
+
+	   Parameters
+	   ----------
+	   path: str
+		   rat path saved by motion_detector.py, see `trajectory.load_trajectory`.
+
+	   arena: str, Arena or None
+		   rooms of the cage, see `arena.load_arena`.
+
+	   fps: float
+		   frame rate of the recording, 1.0 gives speeds in pixels per frame.
+
+	   window, polyorder: int
+		   Savitzky-Golay filter settings, see `smooth_positions`.
+
+	   speed_threshold, min_immobile_frames:
+		   immobility bout settings, see `immobility_bouts`.
+
+	   bins: int
+		   number of bins along each axis of the occupancy maps.
+
+	   Returns
+	   -------
+	   results: dict of numpy.array
+		   frame, x, y (smoothed, float32), speed, acceleration (float32), room (uint8 room labels),
+		   bout_start, bout_length (frames of the immobility bouts), occupancy (n_rooms, bins, bins)
+		   and room_names.
+	"""
+	arena = load_arena(arena)
+	rat_path = load_trajectory(path)
+	x, y = smooth_positions(rat_path['x_cords'].values, rat_path['y_cords'].values, window, polyorder)
+	speed, acceleration = speed_and_acceleration(x, y, fps)
+	bout_starts, bout_lengths = immobility_bouts(speed, speed_threshold, min_immobile_frames)
+	rooms = arena.room_codes(x, y).astype(np.uint8)
+	frames = rat_path['frame'].values if 'frame' in rat_path else np.arange(len(rat_path))
+	return {'frame': frames.astype(np.int64), 'x': x.astype(np.float32), 'y': y.astype(np.float32),
+			'speed': speed.astype(np.float32), 'acceleration': acceleration.astype(np.float32), 'room': rooms,
+			'bout_start': frames[bout_starts].astype(np.int64), 'bout_length': bout_lengths.astype(np.int32),
+			'occupancy': occupancy_maps(x, y, rooms, arena, bins), 'room_names': np.array(arena.room_names)}
+
+
+def summarize(results, fps = 1.0):
+	"""Per-recording scalar measures of `kinematics` results, as a dict."""
+	speed = results['speed']
+	detected = ~np.isnan(speed)
+	immobile = results['bout_length'].sum()
+	return {'n_frames': len(speed), 'mean_speed': float(np.nanmean(speed)) if detected.any() else np.nan,
+			'max_speed': float(np.nanmax(speed)) if detected.any() else np.nan,
+			'n_immobility_bouts': len(results['bout_length']),
+			'immobile_fraction': immobile / float(max(detected.sum(), 1)),
+			'mean_bout_duration': results['bout_length'].mean() / fps if len(results['bout_length']) else np.nan}
+
+
+def _process(job):
+	path, output, kwargs = job
+	results = kinematics(path, **kwargs)
+	np.savez_compressed(output, **results)
+	return summarize(results, kwargs.get('fps', 1.0))
+
+
+def run_batch(paths, output_dir, n_workers = None, **kwargs):
+	"""Compute the measures of many rat paths on a process pool.
+
+	   Parameters
+	   ----------
+	   paths: list of str
+		   rat paths saved by motion_detector.py.
+
+	   output_dir: str
+		   every recording is saved here as <n>_<name>.kinematics.npz, see `kinematics` for the arrays.
+
+	   n_workers: int or None
+		   number of worker processes, defaults to the number of CPUs.
+
+	   Other keyword arguments are passed to `kinematics`.
+
+	   Returns
+	   -------
+	   summary: DataFrame
+		   one row per recording, see `summarize`, with path and output columns.
+	"""
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	jobs = []
+	for i, path in enumerate(paths):
+		name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+		jobs.append((path, os.path.join(output_dir, '%i_%s.kinematics.npz' % (i, name)), kwargs))
+	with ProcessPoolExecutor(max_workers = n_workers) as pool:
+		rows = list(pool.map(_process, jobs))
+	summary = pd.DataFrame(rows)
+	summary.insert(0, 'path', [job[0] for job in jobs])
+	summary['output'] = [job[1] for job in jobs]
+	summary.to_csv(os.path.join(output_dir, 'kinematics_summary.csv'), index = False)
+	return summary
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Speed, immobility and occupancy maps of tracked rat paths.')
+	parser.add_argument('paths', nargs = '+', help = 'rat paths: .npz, csv or checkpoint folders')
+	parser.add_argument('--output-dir', default = 'kinematics', help = 'where the results are saved')
+	parser.add_argument('--arena', default = None, help = 'json file with the rooms of the cage, see arena.py')
+	parser.add_argument('--fps', type = float, default = 1.0, help = 'frame rate of the recordings')
+	parser.add_argument('--window', type = int, default = 7, help = 'Savitzky-Golay window in frames (odd)')
+	parser.add_argument('--speed-threshold', type = float, default = 2.0, help = 'immobility speed threshold in pixels/s')
+	parser.add_argument('--min-immobile', type = int, default = 3, help = 'shortest immobility bout in frames')
+	parser.add_argument('--bins', type = int, default = 32, help = 'occupancy map bins along each axis')
+	parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes')
+	args = parser.parse_args(argv)
+
+	summary = run_batch(args.paths, args.output_dir, args.workers, arena = args.arena, fps = args.fps, window = args.window,
+						speed_threshold = args.speed_threshold, min_immobile_frames = args.min_immobile, bins = args.bins)
+	print(summary.round(3).to_string(index = False))
+
+
+if __name__ == '__main__':
+	main()
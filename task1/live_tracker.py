@@ -0,0 +1,354 @@
+"""
+Real-time rat tracking from a camera or stream with bounded latency.
+
+Three stages run concurrently, connected by bounded queues:
+
+   1) a capture thread grabbing frames from the camera (a video file is played at wall-clock speed),
+   2) the detection in the main thread, same algorithm as motion_detector.py, also showing the annotated frames,
+   3) a writer thread saving the annotated video and the rat path in append-only chunks.
+
+When detection falls behind, the capture queue drops frames by an explicit policy - 'oldest' keeps the
+newest frames and so the lowest latency, 'newest' keeps every frame already queued. The writer never
+holds up detection, annotated frames that do not fit in its queue are dropped, rat positions never are.
+End-to-end latency (capture to detection) and dropped frame counters are reported at the end.
+The first captured frame has to show the empty cage.
+
+   python live_tracker.py 0 --output-video live_track.avi
+   python live_tracker.py rat_video.avi
+"""
+
+import os
+import time
+import argparse
+import threading
+from collections import deque
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+import cv2
+import numpy as np
+
+from motion_detector import preprocess, detect, annotate, DETECTORS
+from arena import load_arena
+from trajectory import TrajectoryBuffer, TrajectoryCheckpointer, has_checkpoint, remove_checkpoint
+
+
+# Drop policies of the capture queue
+DROP_POLICIES = ('oldest', 'newest')
+
+# Marks the end of a queue
+_END = None
+
+
+class LiveStats(object):
+	"""Counters and latencies of a live tracking run."""
+
+	def __init__(self, max_latencies = 100000):
+		self.captured = 0
+		self.processed = 0
+		self.dropped_capture = 0
+		self.dropped_writes = 0
+		self.latencies = deque(maxlen = max_latencies)
+		self.start = time.perf_counter()
+
+	@property
+	def fps(self):
+		"""Processed frames per second."""
+		return self.processed / max(time.perf_counter() - self.start, 1e-9)
+
+	def report(self):
+		"""Summary of the run as a dict, latencies in milliseconds."""
+		latencies = np.array(self.latencies) * 1000.0
+		p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+		return {'captured': self.captured, 'processed': self.processed, 'dropped_capture': self.dropped_capture,
+				'dropped_writes': self.dropped_writes, 'fps': self.fps,
+				'latency_mean_ms': latencies.mean() if len(latencies) else np.nan,
+				'latency_p50_ms': p50, 'latency_p95_ms': p95, 'latency_p99_ms': p99,
+				'latency_max_ms': latencies.max() if len(latencies) else np.nan}
+
+
+class LiveTracker(object):
+	"""Tracks the rat in a live source, see the module description.
+
+	   Parameters
+	   ----------
+	   source: int or str
+		   camera index, stream url or video file.
+
+	   output_path: str
+		   folder for the rat path chunks, readable by Rat_cage_analysis. The frame numbers of every run start at 0,
+		   so a folder already holding a rat path is refused, unless `overwrite` is set.
+
+	   output_video: str or None
+		   where to save the annotated video, None to skip it.
+
+	   display: bool
+		   show the annotated frames in a window.
+
+	   realtime: bool or None
+		   pace the reading of a video file at its frame rate, defaults to True for files and False for cameras.
+
+	   fps: float or None
+		   frame rate of the source, read from the source by default.
+
+	   queue_size: int
+		   capacity of the capture and writer queues, in frames.
+
+	   drop_policy: str
+		   'oldest' or 'newest', which frame is dropped when the capture queue is full.
+
+	   detector: str
+		   detector backend, one of `motion_detector.DETECTORS`.
+
+	   flush_every: int
+		   number of rat positions sent to the writer together.
+
+	   arena: str, Arena or None
+		   rooms drawn on the annotated frames, see `arena.load_arena`.
+
+	   overwrite: bool
+		   delete the rat path already saved in `output_path` and start it fresh.
+	"""
+
+	def __init__(self, source, output_path = 'live_path', output_video = None, display = False, realtime = None,
+				 fps = None, queue_size = 8, drop_policy = 'oldest', detector = 'contours', flush_every = 250,
+				 arena = None, overwrite = False):
+		if drop_policy not in DROP_POLICIES:
+			raise ValueError('Unknown drop policy %s, use one of %s' % (drop_policy, DROP_POLICIES))
+		self.source = source
+		self.output_path = output_path
+		self.output_video = output_video
+		self.display = display
+		if realtime is None:
+			# only files can be read faster than real time
+			realtime = not isinstance(source, int) and not str(source).startswith(('rtsp:', 'http:', 'https:'))
+		self.realtime = realtime
+		self.fps = fps
+		self.drop_policy = drop_policy
+		self.detector = detector
+		self.flush_every = flush_every
+		# the default arena is sized to the captured frames in `annotate`
+		self.arena = arena if arena is None else load_arena(arena)
+		self.overwrite = overwrite
+		self.captured = queue.Queue(maxsize = queue_size)
+		# the first frame is the background, it is handed over apart from the droppable capture queue
+		self.first_captured = queue.Queue(maxsize = 1)
+		self._writer_error = None
+		self.to_write = queue.Queue(maxsize = queue_size)
+		self.stats = LiveStats()
+		self._stop = threading.Event()
+
+	def stop(self):
+		"""Stop capturing, the frames already captured are still processed."""
+		self._stop.set()
+
+	def _put_captured(self, item):
+		"""Queue a captured frame, dropping a frame by the drop policy when the queue is full."""
+		while True:
+			try:
+				self.captured.put_nowait(item)
+				return
+			except queue.Full:
+				if self.drop_policy == 'newest':
+					self.stats.dropped_capture += 1
+					return
+				try:
+					self.captured.get_nowait()
+					self.stats.dropped_capture += 1
+				except queue.Empty:
+					pass
+
+	def _capture_loop(self, clip, max_frames):
+		frame_idx = 0
+		start = time.perf_counter()
+		try:
+			while not self._stop.is_set() and (max_frames is None or frame_idx < max_frames):
+				if self.realtime and self.fps:
+					# play a file at wall-clock speed
+					delay = start + frame_idx / self.fps - time.perf_counter()
+					if delay > 0:
+						time.sleep(delay)
+				(grabbed, frame) = clip.read()
+				if not grabbed:
+					break
+				self.stats.captured += 1
+				if frame_idx == 0:
+					self.first_captured.put((frame_idx, time.perf_counter(), frame))
+				else:
+					self._put_captured((frame_idx, time.perf_counter(), frame))
+				frame_idx += 1
+		finally:
+			clip.release()
+			if frame_idx == 0:
+				self.first_captured.put(_END)
+			# the end marker is never dropped
+			self.captured.put(_END)
+
+	def _write_loop(self, checkpointer):
+		out = None
+		try:
+			while True:
+				item = self.to_write.get()
+				if item is _END:
+					break
+				kind, value = item
+				if kind == 'rows':
+					checkpointer.flush(*value)
+					continue
+				if out is None:
+					height, width = value.shape[:2]
+					out = cv2.VideoWriter(self.output_video, cv2.VideoWriter_fourcc(*'XVID'), self.fps or 25.0, (width, height))
+					if not out.isOpened():
+						raise IOError('Could not open %s for writing' % self.output_video)
+				out.write(value)
+		except Exception as error:
+			# raised again in the main thread, see _put_write
+			self._writer_error = error
+		finally:
+			if out is not None:
+				out.release()
+
+	def _put_write(self, item, writer):
+		"""Queue an item for the writer, waiting for space. Raises the error of the writer if it stopped."""
+		while True:
+			if self._writer_error is not None:
+				raise self._writer_error
+			try:
+				self.to_write.put(item, timeout = 0.5)
+				return
+			except queue.Full:
+				if not writer.is_alive():
+					raise self._writer_error or RuntimeError('The writer thread stopped')
+
+	def _send_rows(self, rat_path, last_frame, writer, complete = False):
+		"""Hand the buffered rat positions to the writer, waiting for space - positions are never dropped."""
+		rows = TrajectoryBuffer(capacity = max(len(rat_path), 1))
+		rows.extend(rat_path)
+		self._put_write(('rows', (rows, last_frame, complete)), writer)
+		rat_path.clear()
+
+	def run(self, max_frames = None):
+		"""Track until the source ends, `stop` is called or `max_frames` frames were captured.
+
+		   Returns
+		   -------
+		   stats: dict
+			   see `LiveStats.report`.
+		"""
+		if os.path.isdir(self.output_path) and has_checkpoint(self.output_path):
+			if not self.overwrite:
+				raise ValueError('%s already holds a rat path, choose another folder or overwrite it' % self.output_path)
+			remove_checkpoint(self.output_path)
+		clip = cv2.VideoCapture(self.source)
+		if not clip.isOpened():
+			raise IOError('Could not open %s' % self.source)
+		if self.fps is None:
+			self.fps = clip.get(cv2.CAP_PROP_FPS) or 25.0
+		checkpointer = TrajectoryCheckpointer(self.output_path, str(self.source))
+
+		capture = threading.Thread(target = self._capture_loop, args = (clip, max_frames), name = 'capture')
+		writer = threading.Thread(target = self._write_loop, args = (checkpointer,), name = 'writer')
+		capture.daemon = writer.daemon = True
+		self.stats = LiveStats()
+		capture.start()
+		writer.start()
+
+		last_frame = -1
+		rat_path = TrajectoryBuffer(capacity = self.flush_every)
+		annotate_frames = self.output_video is not None or self.display
+		# the first frame is the empty cage
+		first = self.first_captured.get()
+		ended = first is _END
+		first_frame = None if ended else preprocess(first[2])
+		# the source ended or the run was stopped, not interrupted by an error
+		finished = False
+		try:
+			while not ended:
+				if self._writer_error is not None:
+					raise self._writer_error
+				item = self.captured.get()
+				if item is _END:
+					ended = True
+					break
+				frame_idx, captured_at, frame = item
+				gray = preprocess(frame)
+
+				bbox = detect(first_frame, gray, self.detector)
+				if bbox is None:
+					rat_path.append_missed(frame_idx)
+				else:
+					(x, y, w, h, area) = bbox
+					rat_path.append(frame_idx, x + w/2.0, y + h/2.0, w, h, area)
+				last_frame = frame_idx
+				self.stats.latencies.append(time.perf_counter() - captured_at)
+				self.stats.processed += 1
+
+				if annotate_frames and bbox is not None:
+					annotate(frame, bbox, self.arena)
+				if self.output_video is not None:
+					try:
+						self.to_write.put_nowait(('frame', frame))
+					except queue.Full:
+						self.stats.dropped_writes += 1
+				if self.display:
+					# HighGUI is only safe in the main thread on some backends
+					cv2.imshow('live cage view', frame)
+					if cv2.waitKey(1) & 0xFF == ord('q'):
+						self.stop()
+				if len(rat_path) >= self.flush_every:
+					self._send_rows(rat_path, last_frame, writer)
+			finished = True
+		finally:
+			self.stop()
+			# let the capture thread queue its end marker
+			while not ended:
+				ended = self.captured.get() is _END
+			if self.display:
+				cv2.destroyAllWindows()
+			try:
+				self._send_rows(rat_path, last_frame, writer, complete = finished)
+				self._put_write(_END, writer)
+			finally:
+				capture.join()
+				writer.join()
+		if self._writer_error is not None:
+			raise self._writer_error
+		return self.stats.report()
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Track the rat live from a camera, stream or video file.')
+	parser.add_argument('source', help = 'camera index, stream url or video file')
+	parser.add_argument('--output', default = 'live_path', help = 'folder for the rat path chunks')
+	parser.add_argument('--overwrite', action = 'store_true', help = 'delete a rat path already saved in the output folder')
+	parser.add_argument('--output-video', default = None, help = 'save the annotated video')
+	parser.add_argument('--display', action = 'store_true', help = 'show the annotated frames')
+	parser.add_argument('--no-realtime', action = 'store_true', help = 'read a video file as fast as possible')
+	parser.add_argument('--queue-size', type = int, default = 8, help = 'capacity of the queues between the stages')
+	parser.add_argument('--drop', default = 'oldest', choices = DROP_POLICIES, help = 'frame dropped when detection falls behind')
+	parser.add_argument('--detector', default = 'contours', choices = sorted(DETECTORS), help = 'detector backend')
+	parser.add_argument('--arena', default = None, help = 'json file with the rooms drawn on the video, see arena.py')
+	parser.add_argument('--max-frames', type = int, default = None, help = 'stop after this many frames')
+	args = parser.parse_args(argv)
+
+	source = int(args.source) if args.source.isdigit() else args.source
+	tracker = LiveTracker(source, args.output, args.output_video, args.display, False if args.no_realtime else None,
+						  queue_size = args.queue_size, drop_policy = args.drop, detector = args.detector,
+						  arena = args.arena, overwrite = args.overwrite)
+	try:
+		stats = tracker.run(args.max_frames)
+	except KeyboardInterrupt:
+		tracker.stop()
+		stats = tracker.stats.report()
+	for key, value in stats.items():
+		print('%s: %s' % (key, round(value, 2) if isinstance(value, float) else value))
+	if stats['dropped_capture']:
+		print('WARNING: detection did not keep up with the %.1f fps of the source' % tracker.fps)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,12 +1,17 @@
 """
 Uses OpenCV 3 to track the rat in a cage and save its' x and y coordinates.
-NOTE: The input video must have an empty background as the first frame.
+NOTE: The input video must have an empty background as the first frame,
+unless the median background is used (--background median).
+The input can be a video file or the images folder directly (no need to run img2vid.py first),
+ex. python motion_detector.py images
+On machines without a display use --headless (no drawing, window or annotated video) or --annotate-every N.
+Run python motion_detector.py --help for all options, or call track() from python.
 
 Steps taken in the tracking algorithm:
 
    1) Converting a video frame to greyscale
    2) Smoothing the pixel values with gaussian blur
-   3) Computing the absolute difference between the first frame and the current frame
+   3) Computing the absolute difference between the background (first frame) and the current frame
    4) Finding the pixels above threshold value
    5) Dillating the thresholded pixels to fill in gaps
    6) Fitting contours to areas above threshold
@@ -14,71 +19,59 @@ Steps taken in the tracking algorithm:
 """
 
 
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
+import numpy as np
 import pandas as pd
 
+from frame_sources import to_gray, open_frame_source
+from background import content_hash, load_background
+from trajectory import TrajectoryBuffer, TrajectoryCheckpointer
+from profiling import StageTimer, NULL_TIMER, timed_frames
+from frame_cache import find_frame_cache
+from arena import load_arena
 
-# Load the input video with the rat moving around the cage
-clip = cv2.VideoCapture('rat_video.avi')
-# Get video parameters
-height = int(clip.get(cv2.CAP_PROP_FRAME_HEIGHT))
-width = int(clip.get(cv2.CAP_PROP_FRAME_WIDTH))
-n_frames = clip.get(cv2.CAP_PROP_FRAME_COUNT)
 
-# Create the output video for saving the results of object tracking
-fourcc = cv2.VideoWriter_fourcc(*'XVID') # specify the codec
-out = cv2.VideoWriter('obj_track.avi',fourcc, 10.0, (width,height)) # path, codec, frame rate, dimensions (must be the same dimension as the input video)
+def preprocess(frame, timer = NULL_TIMER, kernel = 21):
+	"""Convert the frame to grayscale and blur it with a `kernel` x `kernel` gaussian."""
+	with timer('cvtColor'):
+		gray = to_gray(frame)
+	with timer('GaussianBlur'):
+		return cv2.GaussianBlur(gray, (kernel, kernel), 0)
 
-# initialize the first frame in the video stream - has to be the background image!
-first_frame = None
-# intialize the dataframe for saving rat position
-rat_path = pd.DataFrame(columns = ['x_cords', 'y_cords'])
-# initialize a list of frames where rat was not detected - it might remain empty
-missed_frames_idx = []
 
-# Define room borders
-left_border = 276
-right_border = 463
+def threshold_mask(first_frame, gray, timer = NULL_TIMER, threshold = 25, dilate_iterations = 2):
+	"""Binary mask of the pixels differing from the background, dilated to fill in holes."""
+	# compute the absolute difference between the current frame and first frame
+	with timer('absdiff'):
+		frameDelta = cv2.absdiff(first_frame, gray)
+	return delta_mask(frameDelta, timer, threshold, dilate_iterations)
 
-# loop over the frames of the video
-while True:
-	# get current frame, idx corresponds to image filename
-	frame_idx = clip.get(cv2.CAP_PROP_POS_FRAMES)
 
-	# grab the current frame
-	(grabbed, frame) = clip.read()
+def delta_mask(frameDelta, timer = NULL_TIMER, threshold = 25, dilate_iterations = 2):
+	"""Binary mask of the pixels of the background difference above `threshold`, dilated to fill in holes."""
+	# threshold the frame
+	with timer('threshold'):
+		thresh = cv2.threshold(frameDelta, threshold, 255, cv2.THRESH_BINARY)[1]
 
-	# if the frame could not be grabbed, then we have reached the end of the video
-	if not grabbed:
-		break
+	# dilate the thresholded image to fill in holes
+	with timer('dilate'):
+		return cv2.dilate(thresh, None, iterations=dilate_iterations)
 
-	# Convert the frame to grayscale and blur it
-	gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-	gray = cv2.GaussianBlur(gray, (21, 21), 0)
 
-	# if the first frame is None, initialize it (has to be only bakground view)
-	if first_frame is None:
-		first_frame = gray
-		continue
+def largest_contour(thresh):
+	"""Detector backend: bounding box of the largest external contour."""
+	# [-2] picks the contours for both OpenCV 3 and 4 return signatures
+	contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
 
-	# compute the absolute difference between the current frame and first frame
-	frameDelta = cv2.absdiff(first_frame, gray)
-	# threshold the frame
-	thresh = cv2.threshold(frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
- 
-	# dilate the thresholded image to fill in holes, then find contours on thresholded image
-	thresh = cv2.dilate(thresh, None, iterations=2)
-
-	(_, contours, _) = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE) 
-
-	# Check for detecting the rat - this should not fail too often, best never
 	if not contours:
-		print("No contour found at frame: %i" %frame_idx)
-		rat_path.loc[frame_idx, :] = [None, None]
-		missed_frames_idx.append(frame_idx)
-		continue
+		return None
 
-    # select only the largest contour -  extra fix in case gaussian blurring does not get rid of extra contours
+	# select only the largest contour -  extra fix in case gaussian blurring does not get rid of extra contours
 	areaArray = []
 
 	# loop over the contours and get their area
@@ -93,54 +86,702 @@ while True:
 	largest_contour = sorteddata[0][1]
 
 	# compute the bounding box for the contour
-	(x, y, w, h) = cv2.boundingRect(largest_contour)
-	# draw it on the frame
-	cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+	return cv2.boundingRect(largest_contour) + (sorteddata[0][0],)
 
-	#Storet he center of the contour in the rat position dataframe
-	rat_path.loc[frame_idx, :] = [x + w/2.0, y + h/2.0]
-	
-	# Get occupied room number and print it on the video
-	if rat_path.loc[frame_idx, 'x_cords'] <= left_border:
-		text = "room_1"
-	elif (rat_path.loc[frame_idx, 'x_cords'] >= right_border):
-		text = "room_3"
-	else:
-		text = "room_2"
 
-	cv2.putText(frame,text,(10,40), cv2.FONT_HERSHEY_SIMPLEX, 1.5,(0,0,255),1,cv2.LINE_AA)
-
-	# Draw room borders on the video
-	cv2.line(frame,(276,0),(276,height),(255,0,0),2)
-	cv2.line(frame,(463,0),(463,height),(255,0,0),2)
+def largest_component(thresh):
+	"""Detector backend: bounding box of the largest connected component, selected with a vectorized argmax.
+	   The area is the pixel count of the component.
+	"""
+	n_labels, _, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity = 8)
+	# label 0 is the background
+	if n_labels < 2:
+		return None
+	largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+	(x, y, w, h, area) = stats[largest, :5]
+	return (int(x), int(y), int(w), int(h), float(area))
 
 
-	# play the frame in the window
-	cv2.imshow("cage view", frame)
-	# save the frame to the output video
-	out.write(frame)
-
-	# Other views, uncomment if needed
-	#cv2.imshow("Thresh", thresh)
-	#cv2.imshow("Frame Delta", frameDelta)
+def mask_moments(thresh):
+	"""Detector backend: centroid of all foreground pixels from the image moments, computed with NumPy.
+	   Returns a box with the size of the foreground extent centered on the centroid. Fastest, 
+	   but every foreground pixel pulls the centroid, so it needs a clean mask.
+	"""
+	ys, xs = np.nonzero(thresh)
+	if len(xs) == 0:
+		return None
+	w = float(xs.max() - xs.min() + 1)
+	h = float(ys.max() - ys.min() + 1)
+	return (xs.mean() - w/2.0, ys.mean() - h/2.0, w, h, float(len(xs)))
+
+
+# Interchangeable detector backends, each takes the thresholded mask and returns (x, y, w, h, area) or None
+DETECTORS = {'contours': largest_contour, 'components': largest_component, 'moments': mask_moments}
+
+
+def detect(first_frame, gray, detector = 'contours', timer = NULL_TIMER, threshold = 25, dilate_iterations = 2):
+	"""Find the rat as the largest area differing from the background.
+
+	   Parameters
+	   ----------
+	   first_frame: numpy.array
+	       blurred greyscale background image.
+
+	   gray: numpy.array
+	       blurred greyscale current frame.
+
+	   detector: str
+	       detector backend, one of the `DETECTORS` keys.
+
+	   timer: StageTimer
+	       records the duration of each step, see profiling.py.
+
+	   threshold: int
+	       minimum difference to the background of the rat pixels.
+
+	   dilate_iterations: int
+	       number of dilations filling in holes of the thresholded mask.
+
+	   Returns
+	   -------
+	   detection: tuple or None
+	       (x, y, w, h, area) bounding box and area of the rat, None if nothing was detected.
+	"""
+	thresh = threshold_mask(first_frame, gray, timer, threshold, dilate_iterations)
+	with timer('detect (%s)' % detector):
+		return DETECTORS[detector](thresh)
+
+
+def detect_delta(frameDelta, detector = 'contours', timer = NULL_TIMER, threshold = 25, dilate_iterations = 2):
+	"""Same as `detect`, starting from the absolute difference of the frame and the background, ex. from the frame cache."""
+	thresh = delta_mask(frameDelta, timer, threshold, dilate_iterations)
+	with timer('detect (%s)' % detector):
+		return DETECTORS[detector](thresh)
+
+class SearchWindow(object):
+	"""Tracks the rat by processing only a window around its last known position.
+
+	   The window is the last bounding box extended by `margin` pixels plus `speed_gain` times the last
+	   displacement of the rat, centered on the predicted position. The window is cropped with the blur support
+	   around it, so its pixels are the same as in full frame processing. When the rat is not found in the window,
+	   its contour touches the window border or a coarse copy of the frame shows a large enough change outside 
+	   of the window (and periodically), the whole frame is searched instead, so a static artifact cannot hold 
+	   the window when the rat is elsewhere.
+	   Optionally the window is processed on a downscaled pyramid level (each level halves the resolution).
+
+	   Parameters
+	   ----------
+	   background: numpy.array
+	       greyscale background image, not blurred, see `background.load_background`.
+
+	   margin: int
+	       pixels added around the last bounding box.
+
+	   speed_gain: float
+	       how much the last displacement of the rat grows the window.
+
+	   level: int
+	       pyramid level to process, 0 is the full resolution.
+
+	   detector: str
+	       detector backend, one of the `DETECTORS` keys.
+
+	   kernel, threshold, dilate_iterations: int
+	       detection settings at full resolution, see `preprocess` and `detect`.
+
+	   recheck_every: int
+	       search the full frame every this many frames, 0 to never do it.
+
+	   coarse_scale: int
+	       block size of the coarse copy of every frame checked for a larger moving object outside of the window.
+
+	   outside_fraction: float
+	       the full frame is searched when the coarse area differing from the background outside of the window
+	       reaches this fraction of the area found in the window.
+	"""
+
+	def __init__(self, background, margin = 40, speed_gain = 2.0, level = 0, detector = 'contours', kernel = 21, 
+	             threshold = 25, dilate_iterations = 2, recheck_every = 50, coarse_scale = 8, outside_fraction = 0.5):
+		self.detector = detector
+		self.threshold = threshold
+		self.dilate_iterations = dilate_iterations
+		self.margin = margin
+		self.speed_gain = speed_gain
+		self.level = level
+		self.scale = 2 ** level
+		# blur kernel scaled to the pyramid level, must be odd
+		self.kernel = max(kernel // self.scale, 1) | 1
+		self.height, self.width = background.shape[:2]
+		self.background = self._preprocess(background)
+		self.recheck_every = recheck_every
+		self.coarse_scale = coarse_scale
+		self.outside_fraction = outside_fraction
+		self.coarse_background = cv2.resize(to_gray(background), (max(self.width // coarse_scale, 1), 
+		                                    max(self.height // coarse_scale, 1)), interpolation = cv2.INTER_AREA)
+		self.bbox = None
+		self.velocity = (0.0, 0.0)
+		# pixels of the searched windows at full resolution, and after downscaling to the pyramid level
+		self.window_pixels = 0
+		self.processed_pixels = 0
+		self.n_frames = 0
+
+	def _preprocess(self, frame):
+		gray = to_gray(frame)
+		for _ in range(self.level):
+			gray = cv2.pyrDown(gray)
+		return cv2.GaussianBlur(gray, (self.kernel, self.kernel), 0)
+
+	@property
+	def window_fraction(self):
+		"""Fraction of the frame area searched so far, 1.0 means the full frame was searched every frame."""
+		if self.n_frames == 0:
+			return 0.0
+		return self.window_pixels / float(self.n_frames * self.width * self.height)
+
+	@property
+	def processed_fraction(self):
+		"""Pixels processed so far after downscaling, as a fraction of full resolution full frame processing."""
+		if self.n_frames == 0:
+			return 0.0
+		return self.processed_pixels / float(self.n_frames * self.width * self.height)
+
+	def region(self):
+		"""(x0, y0, x1, y1) of the window to search in the next frame."""
+		if self.bbox is None:
+			return (0, 0, self.width, self.height)
+		(x, y, w, h) = self.bbox[:4]
+		vx, vy = self.velocity
+		# center on the predicted position, grow by the observed speed
+		cx, cy = x + w/2.0 + vx, y + h/2.0 + vy
+		half_w = w/2.0 + self.margin + self.speed_gain * abs(vx)
+		half_h = h/2.0 + self.margin + self.speed_gain * abs(vy)
+		# align to the pyramid level so the downscaled window matches the downscaled background
+		s = self.scale
+		x0 = max(int(cx - half_w) // s * s, 0)
+		y0 = max(int(cy - half_h) // s * s, 0)
+		x1 = min(int(cx + half_w) // s * s + s, self.width)
+		y1 = min(int(cy + half_h) // s * s + s, self.height)
+		return (x0, y0, x1, y1)
+
+	def _detect_region(self, frame, region):
+		(x0, y0, x1, y1) = region
+		s = self.scale
+		self.window_pixels += (x1 - x0) * (y1 - y0)
+		# crop with the support of the blur and pyramid filters around the window, so the window pixels are 
+		# blurred exactly as in the full frame, then trim the padding
+		pad = (self.kernel // 2 + 2 * self.level) * s
+		px0, py0 = max(x0 - pad, 0), max(y0 - pad, 0)
+		px1, py1 = min(x1 + pad, self.width), min(y1 + pad, self.height)
+		gray = self._preprocess(frame[py0:py1, px0:px1])
+		self.processed_pixels += gray.shape[0] * gray.shape[1]
+		top, left = (y0 - py0) // s, (x0 - px0) // s
+		gray = gray[top:top + -(-(y1 - y0) // s), left:left + -(-(x1 - x0) // s)]
+		background = self.background[y0 // s:y0 // s + gray.shape[0], x0 // s:x0 // s + gray.shape[1]]
+		gray = gray[:background.shape[0], :background.shape[1]]
+		bbox = detect(background, gray, self.detector, threshold = self.threshold, dilate_iterations = self.dilate_iterations)
+		if bbox is None:
+			return None
+		(x, y, w, h, area) = bbox
+		return (x0 + x * s, y0 + y * s, w * s, h * s, area * s * s)
+
+	def _coarse(self, frame):
+		"""Greyscale frame averaged over `coarse_scale` x `coarse_scale` blocks."""
+		return cv2.resize(to_gray(frame), (self.coarse_background.shape[1], self.coarse_background.shape[0]), 
+		                  interpolation = cv2.INTER_AREA)
+
+	def _outside_area(self, frame, region):
+		"""Area (full resolution pixels) of the largest object differing from the background that is not entirely 
+		   inside of the window, on the coarse frame."""
+		coarse = self._coarse(frame)
+		self.processed_pixels += coarse.size
+		mask = (cv2.absdiff(coarse, self.coarse_background) > self.threshold).astype(np.uint8)
+		n_labels, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity = 8)
+		c = self.coarse_scale
+		(x0, y0, x1, y1) = region
+		# label 0 is the background, objects strictly inside of the window were already seen by the window search
+		(x, y, w, h, area) = [stats[1:, i] for i in range(5)]
+		inside = (x * c > x0) & (y * c > y0) & ((x + w) * c < x1) & ((y + h) * c < y1)
+		if not np.any(~inside):
+			return 0
+		return int(area[~inside].max()) * c * c
+
+	def _touches_border(self, bbox, region):
+		(x, y, w, h) = bbox[:4]
+		(x0, y0, x1, y1) = region
+		return ((x <= x0 and x0 > 0) or (y <= y0 and y0 > 0) or 
+		        (x + w >= x1 and x1 < self.width) or (y + h >= y1 and y1 < self.height))
+
+	def detect(self, frame):
+		"""Find the rat in `frame`, return (x, y, w, h, area) in full frame coordinates or None."""
+		self.n_frames += 1
+		region = self.region()
+		bbox = self._detect_region(frame, region)
+		full_frame = region == (0, 0, self.width, self.height)
+		# fall back to the full frame search when the rat was lost or might be cut by the window, 
+		# when something as large as the rat shows up outside of the window, and every `recheck_every` frames
+		if not full_frame and (bbox is None or self._touches_border(bbox, region) or
+		                       (self.recheck_every and self.n_frames % self.recheck_every == 0) or
+		                       self._outside_area(frame, region) >= self.outside_fraction * bbox[4]):
+			bbox = self._detect_region(frame, (0, 0, self.width, self.height))
+
+		if bbox is None:
+			self.bbox = None
+			self.velocity = (0.0, 0.0)
+			return None
+		if self.bbox is not None:
+			self.velocity = (bbox[0] + bbox[2]/2.0 - self.bbox[0] - self.bbox[2]/2.0,
+			                 bbox[1] + bbox[3]/2.0 - self.bbox[1] - self.bbox[3]/2.0)
+		self.bbox = bbox
+		return bbox
+
+
+def annotate(frame, bbox, arena = None):
+	"""Draw the bounding box, the occupied room name and the room outlines of the `arena.Arena` on the frame."""
+	arena = load_arena(arena, frame.shape[1], frame.shape[0])
+	(x, y, w, h) = [int(round(v)) for v in bbox[:4]]
+	cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
-	# Specify the window refresh rate
-	key = cv2.waitKey(1) & 0xFF 
-	if key == ord("q"):
-		break
+	# Get occupied room name from the arena and print it on the video
+	text = arena.room_at(bbox[0] + bbox[2]/2.0, bbox[1] + bbox[3]/2.0) or "outside"
 
-# Save the path of the rat to a csv file 
-rat_path.to_csv('rat_path.csv', index = False)
+	cv2.putText(frame,text,(10,40), cv2.FONT_HERSHEY_SIMPLEX, 1.5,(0,0,255),1,cv2.LINE_AA)
 
-# Check the performance of the tracking
-# n_frames -1 because first frame is the empty background 
-missed_frames = n_frames -1 - len(rat_path.dropna())
-if missed_frames != 0:
-	print('Missed %i frames at indices:' %missed_frames)
-	print(missed_frames_idx)
+	# Draw room outlines on the video
+	arena.draw(frame)
 
-# cleanup the clip and close any windows
-clip.release()
-out.release()
-cv2.destroyAllWindows()
 
+def track(video_path, output_path = 'rat_path.npz', output_csv = None, output_video = 'obj_track.avi', headless = False, 
+          annotate_every = 1, display = True, window = False, window_margin = 40, pyramid_level = 0, 
+          detector = 'contours', max_frames = None, background = 'first', background_samples = 25, timer = None, 
+          checkpoint_dir = None, checkpoint_every = 10000, blur_kernel = 21, threshold = 25, dilate_iterations = 2, 
+          use_cache = True, arena = None):
+	"""Track the rat in a video or an images folder and save its path.
+
+	   Parameters
+	   ----------
+	   video_path: str
+	       video file or folder with images. The first frame has to be the empty background, unless the median background is used.
+
+	   output_path: str or None
+	       where to save the rat path as a binary columnar .npz file, None to skip saving.
+
+	   output_csv: str or None
+	       where to also save the rat path as csv, None to skip csv export.
+
+	   output_video: str or None
+	       where to save the annotated video, None to skip saving.
+
+	   headless: bool
+	       skip all drawing, display and annotated video writing - the detection loop runs at pure compute speed.
+
+	   annotate_every: int
+	       draw, display and write only every Nth frame, for spot checks on long recordings.
+
+	   display: bool
+	       play the annotated frames in a window. Press q to stop tracking.
+
+	   window: bool
+	       process only a search window around the last rat position, see `SearchWindow`.
+
+	   window_margin: int
+	       pixels added around the last bounding box in window mode.
+
+	   pyramid_level: int
+	       in window mode process frames downscaled by 2**pyramid_level.
+
+	   detector: str
+	       detector backend, one of the `DETECTORS` keys: 'contours', 'components' or 'moments'.
+
+	   max_frames: int or None
+	       stop after this many frames, None to track the whole video.
+
+	   background: str
+	       'first' - the first frame is the empty background and is not tracked, 
+	       'median' - median of sampled frames, cached next to the video, all frames are tracked.
+
+	   background_samples: int
+	       number of frames sampled for the median background.
+
+	   timer: StageTimer or None
+	       records the duration of every pipeline stage (decode, cvtColor, GaussianBlur, absdiff, threshold, 
+	       dilate, detect, draw, write, display), None to skip profiling.
+
+	   checkpoint_dir: str or None
+	       save the rat path in append-only chunks to this folder every `checkpoint_every` frames. If the folder 
+	       already holds a checkpoint of this video, tracking continues after the last saved frame.
+	       Rat_cage_analysis can read the folder directly.
+
+	   checkpoint_every: int
+	       number of frames between checkpoints.
+
+	   blur_kernel, threshold, dilate_iterations: int
+	       detection settings, see `preprocess` and `detect`.
+
+	   use_cache: bool
+	       in headless full frame mode start from the preprocessed frames saved by frame_cache.py, if there are any.
+
+	   arena: str, Arena or None
+	       rooms drawn on the annotated frames, an arena json file, see `arena.Arena`. None for the default rooms.
+
+	   Returns
+	   -------
+	   rat_path: TrajectoryBuffer
+	       columns are: frame, x_cords, y_cords, width, height, area, detected. Missed frames are NaN.
+
+	   missed_frames_idx: list
+	       frame numbers where the rat was not detected.
+	"""
+	clip = open_frame_source(video_path)
+	# the first frame has to be the background image, unless the median of the whole recording is used
+	start = 1 if background == 'first' else 0
+	checkpointer = None
+	if checkpoint_dir is not None:
+		checkpointer = TrajectoryCheckpointer(checkpoint_dir, os.path.abspath(video_path))
+		# resume after the last saved frame
+		if checkpointer.last_frame >= start:
+			print('Resuming from checkpoint at frame %i' % checkpointer.last_frame)
+			start = checkpointer.last_frame + 1
+	# Get video parameters
+	height = clip.height
+	width = clip.width
+	n_frames = clip.n_frames
+
+	annotate_every = max(int(annotate_every), 1)
+	# the recording content is hashed once, for the frame cache and the cached backgrounds
+	content_key = content_hash(video_path) if use_cache or background != 'first' else None
+	display = display and not headless
+	arena = load_arena(arena, width, height)
+
+	# the cached frames can replace decoding when the original frames are not needed for drawing or the search window
+	cached_stage, cached = (None, None)
+	if use_cache and headless and not window:
+		cached_stage, cached = find_frame_cache(video_path, blur_kernel, background, background_samples, content_key)
+	if cached is not None:
+		print('Using the cached %s frames' % cached_stage)
+		stop = len(cached) if max_frames is None else min(max_frames, len(cached))
+		frames = ((frame_idx, cached[frame_idx]) for frame_idx in range(start, stop))
+	else:
+		frames = clip.frames(start, max_frames)
+	if timer is None:
+		timer = NULL_TIMER
+	else:
+		frames = timed_frames(frames, timer)
+
+	out = None
+	if not headless and output_video is not None:
+		# Create the output video for saving the results of object tracking
+		fourcc = cv2.VideoWriter_fourcc(*'XVID') # specify the codec
+		out = cv2.VideoWriter(output_video,fourcc, 10.0, (width,height)) # path, codec, frame rate, dimensions (must be the same dimension as the input video)
+
+	# caching is only worth it for computed backgrounds
+	cache = background != 'first'
+	first_frame = load_background(video_path, background, blur_kernel, background_samples, cache = cache, content_key = content_key)
+	searcher = None
+	if window:
+		searcher = SearchWindow(load_background(video_path, background, kernel = 0, n_samples = background_samples, cache = cache,
+		                                        content_key = content_key), 
+		                        margin = window_margin, level = pyramid_level, detector = detector, kernel = blur_kernel,
+		                        threshold = threshold, dilate_iterations = dilate_iterations)
+	# intialize the buffer for saving rat position
+	rat_path = TrajectoryBuffer(capacity = max(min(n_frames, checkpoint_every) if checkpointer else n_frames, 1))
+	# initialize a list of frames where rat was not detected - it might remain empty
+	missed_frames_idx = []
+	stopped = False
+	# last processed frame as a Python int, exact for any recording length
+	last_frame = start - 1
+
+	# loop over the frames of the video, idx corresponds to image position in natural filename order
+	for frame_idx, frame in frames:
+		timer.frame_done()
+		last_frame = frame_idx
+		# save the frames processed so far
+		if checkpointer is not None and len(rat_path) >= checkpoint_every:
+			with timer('checkpoint'):
+				checkpointer.flush(rat_path, frame_idx - 1)
+		if searcher is not None:
+			with timer('search window'):
+				bbox = searcher.detect(frame)
+		elif cached_stage == 'delta':
+			bbox = detect_delta(frame, detector, timer, threshold, dilate_iterations)
+		elif cached_stage == 'blurred':
+			bbox = detect(first_frame, frame, detector, timer, threshold, dilate_iterations)
+		else:
+			bbox = detect(first_frame, preprocess(frame, timer, blur_kernel), detector, timer, threshold, dilate_iterations)
+
+		# Check for detecting the rat - this should not fail too often, best never
+		if bbox is None:
+			print("No contour found at frame: %i" %frame_idx)
+			rat_path.append_missed(frame_idx)
+			missed_frames_idx.append(frame_idx)
+			continue
+
+		(x, y, w, h, area) = bbox
+		#Store the center of the contour in the rat position buffer
+		rat_path.append(frame_idx, x + w/2.0, y + h/2.0, w, h, area)
+
+		if headless or frame_idx % annotate_every != 0:
+			continue
+
+		with timer('draw'):
+			# greyscale frame stacks are drawn on in color
+			if frame.ndim == 2:
+				frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+			annotate(frame, bbox, arena)
+
+		# save the frame to the output video
+		if out is not None:
+			with timer('write'):
+				out.write(frame)
+
+		if display:
+			# play the frame in the window
+			with timer('display'):
+				cv2.imshow("cage view", frame)
+				# Specify the window refresh rate
+				key = cv2.waitKey(1) & 0xFF 
+			if key == ord("q"):
+				stopped = True
+				break
+
+	if checkpointer is not None:
+		last_frame = max(last_frame, checkpointer.last_frame)
+		# a run cut short by max_frames did not reach the end of the recording
+		reached_end = max_frames is None or max_frames >= n_frames or last_frame < max_frames - 1
+		checkpointer.flush(rat_path, last_frame, complete = reached_end and not stopped)
+		# the whole path, including the frames tracked before a restart
+		rat_path = TrajectoryBuffer.load(checkpoint_dir)
+		missed_frames_idx = rat_path.missed_frames_idx
+
+	save_path(rat_path, output_path, output_csv)
+	report_missed(rat_path, missed_frames_idx)
+	if searcher is not None:
+		print('Search window covered %.1f%% of the frame area, processed %.1f%% of the full resolution pixels' 
+		      % (100 * searcher.window_fraction, 100 * searcher.processed_fraction))
+
+	# cleanup and close any windows
+	if out is not None:
+		out.release()
+	if display:
+		cv2.destroyAllWindows()
+
+	return rat_path, missed_frames_idx
+
+
+def save_path(rat_path, output_path, output_csv = None):
+	"""Save the path of the rat once, after tracking."""
+	if output_path is not None:
+		rat_path.save(output_path)
+	if output_csv is not None:
+		rat_path.to_csv(output_csv)
+
+
+def report_missed(rat_path, missed_frames_idx):
+	"""Check the performance of the tracking."""
+	missed_frames = len(rat_path) - rat_path.n_detected
+	if missed_frames != 0:
+		print('Missed %i frames at indices:' %missed_frames)
+		print(missed_frames_idx)
+
+
+# Set in each worker process by _init_chunk_worker
+_worker_source = None
+_worker_cached = (None, None)
+_worker_background = None
+_worker_settings = None
+
+
+def _init_chunk_worker(video_path, first_frame, settings, use_cache):
+	global _worker_source, _worker_cached, _worker_background, _worker_settings
+	# the workers already run in parallel, one decoding thread each is enough
+	_worker_source = open_frame_source(video_path, n_workers = 1, prefetch = 4)
+	if use_cache:
+		# the memory-mapped cache pages are shared by all workers
+		_worker_cached = find_frame_cache(video_path, settings['kernel'], settings['background'], settings['background_samples'],
+		                                  settings['content_key'])
+	_worker_background = first_frame
+	_worker_settings = settings
+
+
+def _track_chunk(bounds):
+	"""Track the frames in [start, stop) against the shared background, return the trajectory slice."""
+	start, stop = bounds
+	detector, kernel = _worker_settings['detector'], _worker_settings['kernel']
+	threshold, dilate_iterations = _worker_settings['threshold'], _worker_settings['dilate_iterations']
+	cached_stage, cached = _worker_cached
+	if cached is not None:
+		frames = ((frame_idx, cached[frame_idx]) for frame_idx in range(start, len(cached) if stop is None else min(stop, len(cached))))
+	else:
+		frames = _worker_source.frames(start, stop)
+
+	rat_path = TrajectoryBuffer(capacity = (stop - start) if stop is not None else 1024)
+	for frame_idx, frame in frames:
+		if cached_stage == 'delta':
+			bbox = detect_delta(frame, detector, threshold = threshold, dilate_iterations = dilate_iterations)
+		else:
+			gray = frame if cached_stage == 'blurred' else preprocess(frame, kernel = kernel)
+			bbox = detect(_worker_background, gray, detector, threshold = threshold, dilate_iterations = dilate_iterations)
+		if bbox is None:
+			rat_path.append_missed(frame_idx)
+		else:
+			(x, y, w, h, area) = bbox
+			rat_path.append(frame_idx, x + w/2.0, y + h/2.0, w, h, area)
+	return rat_path
+
+
+def track_parallel(video_path, n_workers = None, chunk_size = 2000, output_path = 'rat_path.npz', output_csv = None, 
+                   detector = 'contours', background = 'first', background_samples = 25, blur_kernel = 21, threshold = 25, 
+                   dilate_iterations = 2, use_cache = True):
+	"""Track a single long video on several processes. Always headless.
+
+	   The frame range (after the background frame) is split into chunks of `chunk_size` frames. Each worker process
+	   seeks to its chunk, tracks it against the shared background and returns its trajectory slice. 
+	   The slices are merged in frame order, so the result is the same as `track` frame for frame.
+	   NOTE: seeking relies on cv2.CAP_PROP_POS_FRAMES being frame accurate, which holds for image folders
+	   and for the ffmpeg backend of OpenCV.
+
+	   Parameters
+	   ----------
+	   video_path: str
+	       video file or folder with images.
+
+	   n_workers: int or None
+	       number of worker processes, defaults to the number of CPUs.
+
+	   chunk_size: int
+	       number of frames tracked by a worker in one task.
+
+	   output_path, output_csv, detector, background, background_samples, blur_kernel, threshold, dilate_iterations, use_cache:
+	       see `track`.
+
+	   Returns
+	   -------
+	   rat_path: TrajectoryBuffer
+	       see `track`.
+
+	   missed_frames_idx: list
+	       frame numbers where the rat was not detected.
+	"""
+	n_frames = open_frame_source(video_path).n_frames
+	# the recording is hashed and the background computed (or read from the cache) once, and shared with all workers
+	content_key = content_hash(video_path)
+	first_frame = load_background(video_path, background, blur_kernel, background_samples, cache = background != 'first',
+	                              content_key = content_key)
+	settings = {'detector': detector, 'kernel': blur_kernel, 'threshold': threshold, 'dilate_iterations': dilate_iterations,
+	            'background': background, 'background_samples': background_samples, 'content_key': content_key}
+	first_idx = 1 if background == 'first' else 0
+
+	# the last chunk reads until the end in case the frame count is an estimate
+	starts = list(range(first_idx, max(n_frames, first_idx + 1), chunk_size))
+	bounds = [(start, start + chunk_size) for start in starts[:-1]] + [(starts[-1], None)]
+
+	rat_path = TrajectoryBuffer(capacity = max(n_frames, 1))
+	with ProcessPoolExecutor(max_workers = n_workers, initializer = _init_chunk_worker, 
+	                         initargs = (video_path, first_frame, settings, use_cache)) as pool:
+		# map returns the slices in the order of the chunks
+		for chunk in pool.map(_track_chunk, bounds):
+			rat_path.extend(chunk)
+
+	missed_frames_idx = rat_path.missed_frames_idx
+	save_path(rat_path, output_path, output_csv)
+	report_missed(rat_path, missed_frames_idx)
+
+	return rat_path, missed_frames_idx
+
+
+def compare_detectors(video_path, detectors = None, max_frames = 500):
+	"""Compare the detector backends on accuracy and frames/sec.
+
+	   The first `max_frames` frames are decoded and preprocessed once and kept in memory, 
+	   so only thresholding and detection are timed. Accuracy is measured against the 'contours' backend.
+
+	   Parameters
+	   ----------
+	   video_path: str
+	       video file or folder with images. The first frame has to be the empty background.
+
+	   detectors: list or None
+	       names of the backends to compare, defaults to all `DETECTORS`.
+
+	   max_frames: int
+	       number of frames to use.
+
+	   Returns
+	   -------
+	   comparison: DataFrame
+	       columns: detector, fps, missed_frames, mean_error, max_error. Errors are centroid distances in pixels.
+	"""
+	if detectors is None:
+		detectors = sorted(DETECTORS)
+	grays = [preprocess(frame) for _, frame in open_frame_source(video_path).frames(0, max_frames)]
+	first_frame, grays = grays[0], grays[1:]
+
+	centers = {}
+	fps = {}
+	for name in set(detectors) | set(['contours']):
+		start = time.perf_counter()
+		bboxes = [detect(first_frame, gray, name) for gray in grays]
+		fps[name] = len(grays) / max(time.perf_counter() - start, 1e-9)
+		centers[name] = np.array([(b[0] + b[2]/2.0, b[1] + b[3]/2.0) if b is not None else (np.nan, np.nan) 
+		                          for b in bboxes], dtype = float).reshape(-1, 2)
+
+	rows = []
+	for name in detectors:
+		error = np.hypot(*(centers[name] - centers['contours']).T)
+		error = error[~np.isnan(error)]
+		rows.append({'detector': name, 'fps': fps[name], 'missed_frames': int(np.isnan(centers[name][:, 0]).sum()),
+		             'mean_error': error.mean() if len(error) else np.nan, 'max_error': error.max() if len(error) else np.nan})
+	return pd.DataFrame(rows, columns = ['detector', 'fps', 'missed_frames', 'mean_error', 'max_error'])
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Track the rat in a cage video or images folder.')
+	parser.add_argument('video_path', nargs = '?', default = 'rat_video.avi', help = 'video file or images folder')
+	parser.add_argument('--output', default = 'rat_path.npz', help = 'path of the saved rat path (.npz)')
+	parser.add_argument('--output-csv', default = None, help = 'also save the rat path as csv')
+	parser.add_argument('--output-video', default = 'obj_track.avi', help = 'path of the annotated video')
+	parser.add_argument('--headless', action = 'store_true', help = 'no drawing, display or annotated video')
+	parser.add_argument('--annotate-every', type = int, default = 1, metavar = 'N', help = 'annotate only every Nth frame')
+	parser.add_argument('--no-display', action = 'store_true', help = 'do not play the annotated frames in a window')
+	parser.add_argument('--window', action = 'store_true', help = 'search only a window around the last rat position')
+	parser.add_argument('--window-margin', type = int, default = 40, help = 'pixels added around the last bounding box')
+	parser.add_argument('--pyramid-level', type = int, default = 0, help = 'in window mode downscale frames by 2**level')
+	parser.add_argument('--background', default = 'first', choices = ['first', 'median'], 
+	                    help = 'first frame (empty cage) or median of sampled frames as background')
+	parser.add_argument('--blur', type = int, default = 21, help = 'gaussian blur kernel size (odd)')
+	parser.add_argument('--threshold', type = int, default = 25, help = 'minimum difference to the background of the rat pixels')
+	parser.add_argument('--dilate', type = int, default = 2, help = 'dilation iterations of the thresholded mask')
+	parser.add_argument('--no-cache', action = 'store_true', help = 'ignore the preprocessed frames saved by frame_cache.py')
+	parser.add_argument('--detector', default = 'contours', choices = sorted(DETECTORS), help = 'detector backend')
+	parser.add_argument('--compare-detectors', action = 'store_true', help = 'print accuracy and frames/sec of all detector backends')
+	parser.add_argument('--profile', action = 'store_true', help = 'print the time spent in each pipeline stage')
+	parser.add_argument('--checkpoint-dir', default = None, help = 'save the rat path in chunks to this folder and resume from it')
+	parser.add_argument('--checkpoint-every', type = int, default = 10000, help = 'frames between checkpoints')
+	parser.add_argument('--workers', type = int, default = 1, help = 'track in parallel on this many processes (headless)')
+	parser.add_argument('--arena', default = None, help = 'json file with the rooms drawn on the video, see arena.py')
+	parser.add_argument('--chunk-size', type = int, default = 2000, help = 'frames per parallel task')
+	args = parser.parse_args(argv)
+
+	if args.compare_detectors:
+		print(compare_detectors(args.video_path))
+		return
+
+	if args.workers > 1:
+		track_parallel(args.video_path, n_workers = args.workers, chunk_size = args.chunk_size, 
+		               output_path = args.output, output_csv = args.output_csv, detector = args.detector, background = args.background,
+		               blur_kernel = args.blur, threshold = args.threshold, dilate_iterations = args.dilate, use_cache = not args.no_cache)
+		return
+
+	timer = StageTimer() if args.profile else None
+	track(args.video_path, output_path = args.output, output_csv = args.output_csv, output_video = args.output_video, headless = args.headless,
+	      annotate_every = args.annotate_every, display = not args.no_display, window = args.window, 
+	      window_margin = args.window_margin, pyramid_level = args.pyramid_level, detector = args.detector, 
+	      background = args.background, timer = timer, checkpoint_dir = args.checkpoint_dir, 
+	      checkpoint_every = args.checkpoint_every, blur_kernel = args.blur, threshold = args.threshold, 
+	      dilate_iterations = args.dilate, use_cache = not args.no_cache, arena = args.arena)
+	if timer is not None:
+		timer.print_report()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,217 @@
+"""
+Evaluates a grid of detection settings of motion_detector.py - blur kernel, binary threshold and dilation
+iterations - in a single pass over the frames, instead of one full tracking run per setting.
+
+Every frame is decoded once (or read from the frame cache of frame_cache.py) and blurred once per kernel.
+All thresholds are applied at once with NumPy broadcasting and the dilations are applied incrementally,
+so a mask dilated twice is reused for three iterations. The frames are split in chunks spread over a process pool.
+For every setting the number of missed frames, the centroid jitter and the detection throughput are reported.
+
+   python param_sweep.py rat_video.avi --blur 11 21 31 --threshold 15 25 35 --dilate 0 1 2 4
+"""
+
+import os
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from frame_sources import open_frame_source, to_gray
+from background import content_hash, load_background
+from frame_cache import cache_path
+from motion_detector import DETECTORS
+
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def _init_worker(video_path, backgrounds, thresholds, dilations, detector, caches):
+	_worker['source'] = open_frame_source(video_path, n_workers = 1, prefetch = 4)
+	_worker['backgrounds'] = backgrounds
+	_worker['thresholds'] = np.asarray(thresholds, dtype = np.uint8)
+	_worker['dilations'] = sorted(dilations)
+	_worker['detector'] = DETECTORS[detector]
+	# memory-mapped blurred frames per kernel, shared by the workers
+	_worker['caches'] = dict((kernel, np.load(path, mmap_mode = 'r') if path else None) for kernel, path in caches.items())
+
+
+def _sweep_chunk(bounds):
+	"""Detect the rat in the frames [start, stop) with every setting.
+
+	   Returns
+	   -------
+	   frame_idcs: numpy.array
+		   indices of the processed frames.
+
+	   centers: dict
+		   (kernel, threshold, dilation) -> (n_frames, 2) array of rat centers, NaN when not detected.
+
+	   seconds: dict
+		   (kernel, threshold, dilation) -> time spent thresholding, dilating and detecting for this setting.
+	"""
+	start, stop = bounds
+	source, backgrounds, caches = _worker['source'], _worker['backgrounds'], _worker['caches']
+	thresholds, dilations, detector = _worker['thresholds'], _worker['dilations'], _worker['detector']
+	kernels = sorted(backgrounds)
+	n_thresholds = len(thresholds)
+
+	# decode only when a kernel has no cached blurred frames
+	if all(caches[kernel] is not None for kernel in kernels):
+		n_cached = min(len(caches[kernel]) for kernel in kernels)
+		frames = ((frame_idx, None) for frame_idx in range(start, n_cached if stop is None else min(stop, n_cached)))
+	else:
+		frames = source.frames(start, stop)
+
+	frame_idcs = []
+	centers = dict((key, []) for key in itertools.product(kernels, thresholds.tolist(), dilations))
+	seconds = dict((key, 0.0) for key in centers)
+	for frame_idx, frame in frames:
+		frame_idcs.append(frame_idx)
+		gray = to_gray(frame) if frame is not None else None
+		for kernel in kernels:
+			if caches[kernel] is not None:
+				blurred = caches[kernel][frame_idx]
+			else:
+				blurred = cv2.GaussianBlur(gray, (kernel, kernel), 0)
+			tic = time.perf_counter()
+			delta = cv2.absdiff(backgrounds[kernel], blurred)
+			# all thresholds at once, same as cv2.threshold THRESH_BINARY: pixels above the threshold are 255
+			masks = (delta[np.newaxis] > thresholds[:, np.newaxis, np.newaxis]).view(np.uint8) * np.uint8(255)
+			shared = (time.perf_counter() - tic) / n_thresholds
+			for threshold, mask in zip(thresholds.tolist(), masks):
+				done = 0
+				for dilation in dilations:
+					tic = time.perf_counter()
+					# dilate incrementally from the previous setting
+					if dilation > done:
+						mask = cv2.dilate(mask, None, iterations = dilation - done)
+						done = dilation
+					bbox = detector(mask)
+					seconds[(kernel, threshold, dilation)] += time.perf_counter() - tic + shared
+					if bbox is None:
+						centers[(kernel, threshold, dilation)].append((np.nan, np.nan))
+					else:
+						centers[(kernel, threshold, dilation)].append((bbox[0] + bbox[2]/2.0, bbox[1] + bbox[3]/2.0))
+	centers = dict((key, np.array(value, dtype = float).reshape(-1, 2)) for key, value in centers.items())
+	return np.array(frame_idcs, dtype = int), centers, seconds
+
+
+def centroid_jitter(centers):
+	"""Mean size in pixels of the second difference of the rat centers - high values mean a shaky path.
+	   Only triples of consecutive detected frames count.
+	"""
+	if len(centers) < 3:
+		return np.nan
+	second_diff = centers[2:] - 2 * centers[1:-1] + centers[:-2]
+	jitter = np.hypot(second_diff[:, 0], second_diff[:, 1])
+	jitter = jitter[~np.isnan(jitter)]
+	return jitter.mean() if len(jitter) else np.nan
+
+
+def sweep(video_path, kernels = (21,), thresholds = (25,), dilations = (2,), detector = 'contours', background = 'first',
+		  n_workers = None, chunk_size = 2000, max_frames = None):
+	"""Evaluate every combination of the detection settings in one pass over the frames.
+
+	   Parameters
+	   ----------
+	   video_path: str
+		   video file, images folder or frame stack.
+
+	   kernels, thresholds, dilations: list
+		   blur kernel sizes (odd), binary thresholds (0-255) and dilation iterations to combine.
+
+	   detector: str
+		   detector backend, one of `motion_detector.DETECTORS`.
+
+	   background: str
+		   background model, see `background.load_background`.
+
+	   n_workers: int or None
+		   number of worker processes, defaults to the number of CPUs.
+
+	   chunk_size: int
+		   number of frames processed by a worker in one task.
+
+	   max_frames: int or None
+		   only use the frames before this index.
+
+	   Returns
+	   -------
+	   results: DataFrame
+		   one row per setting, columns: blur, threshold, dilate, missed_frames, jitter, fps.
+		   fps counts only the thresholding, dilation and detection of the setting.
+	"""
+	bad = [t for t in thresholds if not 0 <= t <= 255]
+	if bad:
+		raise ValueError('Thresholds must be in 0..255, got %s' % bad)
+	n_frames = open_frame_source(video_path).n_frames
+	if max_frames is not None:
+		n_frames = min(n_frames, max_frames)
+	kernels = sorted(set(kernels))
+	# the content of the recording is hashed once for all backgrounds and caches
+	content_key = content_hash(video_path)
+	backgrounds = dict((kernel, load_background(video_path, background, kernel, cache = background != 'first', 
+												content_key = content_key)) for kernel in kernels)
+	caches = {}
+	for kernel in kernels:
+		path = cache_path(video_path, 'blurred', kernel, content_key = content_key)
+		caches[kernel] = path if os.path.isfile(path) else None
+
+	first_idx = 1 if background == 'first' else 0
+	starts = list(range(first_idx, max(n_frames, first_idx + 1), chunk_size))
+	last_stop = None if max_frames is None else n_frames
+	bounds = [(start, start + chunk_size) for start in starts[:-1]] + [(starts[-1], last_stop)]
+
+	frame_idcs = []
+	centers = {}
+	seconds = {}
+	wall = time.perf_counter()
+	with ProcessPoolExecutor(max_workers = n_workers, initializer = _init_worker,
+							 initargs = (video_path, backgrounds, sorted(set(thresholds)), sorted(set(dilations)), detector, caches)) as pool:
+		# map returns the chunks in frame order
+		for chunk_idcs, chunk_centers, chunk_seconds in pool.map(_sweep_chunk, bounds):
+			frame_idcs.append(chunk_idcs)
+			for key in chunk_centers:
+				centers.setdefault(key, []).append(chunk_centers[key])
+				seconds[key] = seconds.get(key, 0.0) + chunk_seconds[key]
+	wall = time.perf_counter() - wall
+	n_processed = sum(len(idcs) for idcs in frame_idcs)
+
+	rows = []
+	for (kernel, threshold, dilation), value in sorted(centers.items()):
+		value = np.concatenate(value)
+		rows.append({'blur': kernel, 'threshold': threshold, 'dilate': dilation,
+					 'missed_frames': int(np.isnan(value[:, 0]).sum()), 'jitter': centroid_jitter(value),
+					 'fps': n_processed / max(seconds[(kernel, threshold, dilation)], 1e-9)})
+	print('Evaluated %i settings on %i frames in %.1f s' % (len(rows), n_processed, wall))
+	return pd.DataFrame(rows, columns = ['blur', 'threshold', 'dilate', 'missed_frames', 'jitter', 'fps'])
+
+
+def main(argv = None):
+	"""Command line entry point, run with --help for the options."""
+	parser = argparse.ArgumentParser(description = 'Evaluate a grid of rat detection settings in one pass.')
+	parser.add_argument('video_path', help = 'video file, images folder or frame stack')
+	parser.add_argument('--blur', nargs = '+', type = int, default = [21], help = 'gaussian blur kernel sizes (odd)')
+	parser.add_argument('--threshold', nargs = '+', type = int, default = [25], help = 'binary thresholds')
+	parser.add_argument('--dilate', nargs = '+', type = int, default = [2], help = 'dilation iterations')
+	parser.add_argument('--detector', default = 'contours', choices = sorted(DETECTORS), help = 'detector backend')
+	parser.add_argument('--background', default = 'first', choices = ['first', 'median'], help = 'background model')
+	parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes')
+	parser.add_argument('--max-frames', type = int, default = None, help = 'only use the first frames')
+	parser.add_argument('--output', default = None, help = 'save the results to this csv file')
+	args = parser.parse_args(argv)
+
+	results = sweep(args.video_path, args.blur, args.threshold, args.dilate, args.detector, args.background,
+					args.workers, max_frames = args.max_frames)
+	print(results.round(3).to_string(index = False))
+	if args.output is not None:
+		results.to_csv(args.output, index = False)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,117 @@
+"""
+Per-stage timers for the tracking pipeline in motion_detector.py.
+
+Wrap a pipeline stage in `with timer('stage'):` to record its duration for every frame.
+The default `NULL_TIMER` records nothing, so the timers cost almost nothing when profiling is off.
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class _Stage(object):
+	"""Context manager adding the duration of its block to a stage of a `StageTimer`."""
+
+	def __init__(self, durations):
+		self.durations = durations
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		self.durations.append(time.perf_counter() - self.start)
+
+
+class StageTimer(object):
+	"""Collects the duration of every call of each pipeline stage, in seconds."""
+
+	def __init__(self):
+		self.durations = OrderedDict()
+		self.n_frames = 0
+		self._start = None
+
+	def __call__(self, stage):
+		return _Stage(self.durations.setdefault(stage, []))
+
+	def add(self, stage, seconds):
+		"""Record a duration measured outside of a with block, ex. the decoding done by a frame source."""
+		self.durations.setdefault(stage, []).append(seconds)
+
+	def frame_done(self):
+		"""Count a tracked frame, the first call starts the frames/sec clock."""
+		if self._start is None:
+			self._start = time.perf_counter()
+		self.n_frames += 1
+
+	@property
+	def fps(self):
+		"""Frames per second since the first tracked frame."""
+		if self._start is None:
+			return 0.0
+		return self.n_frames / max(time.perf_counter() - self._start, 1e-9)
+
+	def report(self):
+		"""Summary of the stages.
+
+		   Returns
+		   -------
+		   report: DataFrame
+			   one row per stage, columns: calls, total_s, share, mean_ms, p50_ms, p90_ms, p99_ms.
+			   share is the fraction of the time spent in all the timed stages.
+		"""
+		rows = []
+		for stage, durations in self.durations.items():
+			ms = np.array(durations) * 1000.0
+			p50, p90, p99 = np.percentile(ms, [50, 90, 99]) if len(ms) else (np.nan,) * 3
+			rows.append({'stage': stage, 'calls': len(ms), 'total_s': ms.sum() / 1000.0, 'mean_ms': ms.mean() if len(ms) else np.nan,
+						 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99})
+		report = pd.DataFrame(rows, columns = ['stage', 'calls', 'total_s', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms'])
+		report.insert(3, 'share', report['total_s'] / max(report['total_s'].sum(), 1e-12))
+		return report.set_index('stage')
+
+	def print_report(self):
+		print('Tracked %i frames at %.1f frames/sec' % (self.n_frames, self.fps))
+		print(self.report().round(3).to_string())
+
+
+def timed_frames(frames, timer, stage = 'decode'):
+	"""Yield the items of `frames`, recording the time spent waiting for each one as `stage`."""
+	frames = iter(frames)
+	while True:
+		start = time.perf_counter()
+		try:
+			item = next(frames)
+		except StopIteration:
+			return
+		timer.add(stage, time.perf_counter() - start)
+		yield item
+
+
+class _NullStage(object):
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *exc):
+		pass
+
+
+class NullTimer(object):
+	"""Timer that records nothing, used when profiling is off."""
+
+	_stage = _NullStage()
+
+	def __call__(self, stage):
+		return self._stage
+
+	def add(self, stage, seconds):
+		pass
+
+	def frame_done(self):
+		pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,40 @@
+"""Regression tests of the search window tracking on the sample images, run with pytest."""
+
+import os
+
+import numpy as np
+import pytest
+
+from motion_detector import track, SearchWindow
+from frame_sources import open_frame_source
+from background import load_background
+
+
+IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+
+
+def centers(detections):
+	"""(n, 2) centers of (x, y, w, h, area) detections, NaN where nothing was detected."""
+	return np.array([(np.nan, np.nan) if d is None else (d[0] + d[2]/2.0, d[1] + d[3]/2.0) for d in detections])
+
+
+def test_window_matches_full_frame():
+	full, _ = track(IMAGES, output_path = None, output_video = None, headless = True, use_cache = False)
+	window, _ = track(IMAGES, output_path = None, output_video = None, headless = True, use_cache = False, window = True)
+	np.testing.assert_array_equal(full.column('frame'), window.column('frame'))
+	for column in ('x_cords', 'y_cords', 'width', 'height'):
+		np.testing.assert_array_equal(full.column(column), window.column(column))
+
+
+@pytest.mark.parametrize('level', [1, 2])
+def test_pyramid_window_matches_full_frame_at_the_same_level(level):
+	background = load_background(IMAGES, 'first', kernel = 0)
+	# searching the full frame every frame is the reference at this pyramid level
+	full = SearchWindow(background, level = level, recheck_every = 1)
+	window = SearchWindow(background, level = level)
+	full_detections, window_detections = [], []
+	for _, frame in open_frame_source(IMAGES).frames(1):
+		full_detections.append(full.detect(frame))
+		window_detections.append(window.detect(frame))
+	np.testing.assert_allclose(centers(window_detections), centers(full_detections), atol = 0.5)
+	assert window.processed_fraction < 0.5
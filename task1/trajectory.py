@@ -0,0 +1,305 @@
+"""
+Storage for the rat path produced by motion_detector.py.
+
+The path is kept in preallocated NumPy buffers (int64 frame numbers, float32 positions) that grow geometrically,
+so appending a frame costs the same at the start and at the end of a long recording. It is written once at the end
+to a binary columnar .npz file (one array per column), CSV export is optional.
+For multi-day recordings the buffer can instead be flushed periodically to a folder of append-only
+.npz chunks, together with the last processed frame, so tracking can resume after a crash.
+"""
+
+import os
+import glob
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+# Stored columns, in order
+COLUMNS = ('frame', 'x_cords', 'y_cords', 'width', 'height', 'area', 'detected')
+# Columns stored as float32, the frame numbers are int64
+VALUE_COLUMNS = COLUMNS[1:]
+
+
+class TrajectoryBuffer(object):
+	"""Growable columnar buffer with one row per tracked frame.
+
+	   The frame numbers are kept in their own int64 array, float32 would round them above 2**24 frames
+	   (about a week at 25 fps). The other columns share one float32 array.
+
+	   Parameters
+	   ----------
+	   capacity: int
+		   initial number of rows, the buffer doubles when it gets full.
+	"""
+
+	def __init__(self, capacity = 1024):
+		capacity = max(int(capacity), 1)
+		self._frames = np.empty(capacity, dtype = np.int64)
+		self._values = np.empty((len(VALUE_COLUMNS), capacity), dtype = np.float32)
+		self._n = 0
+
+	def __len__(self):
+		return self._n
+
+	def _grow(self, n_rows):
+		"""Make room for at least `n_rows` more rows."""
+		capacity = len(self._frames)
+		if self._n + n_rows <= capacity:
+			return
+		while capacity < self._n + n_rows:
+			capacity *= 2
+		frames = np.empty(capacity, dtype = np.int64)
+		frames[:self._n] = self._frames[:self._n]
+		values = np.empty((len(VALUE_COLUMNS), capacity), dtype = np.float32)
+		values[:, :self._n] = self._values[:, :self._n]
+		self._frames, self._values = frames, values
+
+	def append(self, frame_idx, x, y, w, h, area):
+		"""Store the rat position (center of the bounding box) detected at `frame_idx`."""
+		self._grow(1)
+		self._frames[self._n] = frame_idx
+		self._values[:, self._n] = (x, y, w, h, area, 1)
+		self._n += 1
+
+	def append_missed(self, frame_idx):
+		"""Store a frame where the rat was not detected."""
+		self._grow(1)
+		self._frames[self._n] = frame_idx
+		self._values[:, self._n] = (np.nan, np.nan, np.nan, np.nan, np.nan, 0)
+		self._n += 1
+
+	def _append_columns(self, frames, values):
+		n_rows = len(frames)
+		self._grow(n_rows)
+		self._frames[self._n:self._n + n_rows] = frames
+		self._values[:, self._n:self._n + n_rows] = values
+		self._n += n_rows
+
+	def extend(self, other):
+		"""Append all rows of another buffer, ex. a trajectory slice computed by a worker."""
+		self._append_columns(other._frames[:other._n], other._values[:, :other._n])
+
+	def clear(self):
+		"""Remove all rows, keeping the allocated memory."""
+		self._n = 0
+
+	def column(self, name):
+		"""View of a single column, ex. buffer.column('x_cords')."""
+		if name == 'frame':
+			return self._frames[:self._n]
+		return self._values[VALUE_COLUMNS.index(name), :self._n]
+
+	def columns(self):
+		"""Dict of views of all columns."""
+		return dict((name, self.column(name)) for name in COLUMNS)
+
+	@property
+	def last_frame(self):
+		"""Number of the last stored frame, None for an empty buffer."""
+		return int(self._frames[self._n - 1]) if self._n else None
+
+	@property
+	def n_detected(self):
+		return int(self.column('detected').sum())
+
+	@property
+	def missed_frames_idx(self):
+		"""Frame numbers where the rat was not detected."""
+		return self.column('frame')[self.column('detected') == 0].tolist()
+
+	def to_dataframe(self):
+		"""Return the rows as a DataFrame indexed by frame number."""
+		return trajectory_dataframe(self.columns())
+
+	def save(self, path):
+		"""Save the buffer to a binary columnar .npz file."""
+		np.savez(path, **self.columns())
+
+	def to_csv(self, path):
+		"""Save the buffer to a csv file, one row per frame."""
+		self.to_dataframe().to_csv(path, index = False)
+
+	@classmethod
+	def load(cls, path):
+		"""Read a buffer saved with `save` or a folder of checkpoint chunks."""
+		paths = chunk_paths(path) if os.path.isdir(path) else [path]
+		buffer = cls()
+		for chunk_path in paths:
+			with np.load(chunk_path) as columns:
+				buffer._append_columns(columns['frame'], np.stack([columns[name] for name in VALUE_COLUMNS]))
+		return buffer
+
+
+class TrajectoryCheckpointer(object):
+	"""Flushes a `TrajectoryBuffer` to append-only chunk files in a folder.
+
+	   Every flush writes the buffered rows to a new chunk_<number>.npz file and then records the last processed 
+	   frame in checkpoint.json. A chunk written by a run killed before updating checkpoint.json is 
+	   overwritten when the run resumes, so the chunks never hold a frame twice.
+
+	   Parameters
+	   ----------
+	   directory: str
+		   folder with the chunks, created if needed.
+
+	   video_path: str or None
+		   recording tracked into this folder, resuming with a different recording raises a ValueError.
+	"""
+
+	def __init__(self, directory, video_path = None):
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.state_path = os.path.join(directory, 'checkpoint.json')
+		self.state = {'video_path': video_path, 'last_frame': -1, 'n_chunks': 0, 'complete': False}
+		if os.path.isfile(self.state_path):
+			with open(self.state_path) as f:
+				self.state = json.load(f)
+			if video_path is not None and self.state['video_path'] not in (None, video_path):
+				raise ValueError('%s holds the path of %s, not %s' % (directory, self.state['video_path'], video_path))
+
+	@property
+	def last_frame(self):
+		"""Index of the last frame already saved, -1 if nothing was saved yet."""
+		return self.state['last_frame']
+
+	@property
+	def complete(self):
+		return self.state['complete']
+
+	def flush(self, buffer, last_frame, complete = False):
+		"""Append the rows of `buffer` as a new chunk, record `last_frame` and empty the buffer."""
+		if len(buffer):
+			chunk_path = os.path.join(self.directory, 'chunk_%06d.npz' % self.state['n_chunks'])
+			tmp_path = chunk_path[:-4] + '.tmp.npz'
+			buffer.save(tmp_path)
+			os.replace(tmp_path, chunk_path)
+			self.state['n_chunks'] += 1
+		self.state['last_frame'] = int(last_frame)
+		self.state['complete'] = complete
+		tmp_path = self.state_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.state, f)
+		os.replace(tmp_path, self.state_path)
+		buffer.clear()
+
+
+def has_checkpoint(directory):
+	"""True if the folder holds checkpoint chunks or a checkpoint.json."""
+	return (os.path.isfile(os.path.join(directory, 'checkpoint.json')) or
+			bool(glob.glob(os.path.join(directory, 'chunk_*.npz'))))
+
+
+def remove_checkpoint(directory):
+	"""Delete the checkpoint chunks and checkpoint.json of a folder, other files are kept."""
+	paths = glob.glob(os.path.join(directory, 'chunk_*.npz')) + glob.glob(os.path.join(directory, 'checkpoint.json*'))
+	for path in paths:
+		os.remove(path)
+
+
+def chunk_paths(directory):
+	"""Chunk files of a checkpoint folder, in frame order. Only chunks recorded in checkpoint.json are listed."""
+	state_path = os.path.join(directory, 'checkpoint.json')
+	if os.path.isfile(state_path):
+		with open(state_path) as f:
+			n_chunks = json.load(f)['n_chunks']
+		return [os.path.join(directory, 'chunk_%06d.npz' % i) for i in range(n_chunks)]
+	return sorted(glob.glob(os.path.join(directory, 'chunk_*[0-9].npz')))
+
+
+def trajectory_dataframe(columns):
+	"""Build the rat path DataFrame from a dict of column arrays."""
+	rat_path = pd.DataFrame({name: columns[name] for name in COLUMNS if name in columns})
+	rat_path['frame'] = rat_path['frame'].astype(int)
+	rat_path['detected'] = rat_path['detected'].astype(bool)
+	return rat_path.set_index('frame', drop = False)
+
+
+def iter_trajectory_chunks(path, chunksize = 100000):
+	"""Read a rat path saved by motion_detector.py piece by piece.
+
+	   Parameters
+	   ----------
+	   path: str
+		   see `load_trajectory`.
+
+	   chunksize: int
+		   rows per piece, the pieces of a checkpoint folder do not span two chunk files.
+
+	   Yields
+	   ------
+	   rat_path: DataFrame
+		   consecutive pieces of the rat path, in frame order.
+	"""
+	if os.path.isdir(path):
+		for chunk_path in chunk_paths(path):
+			for columns in iter_npz_columns(chunk_path, chunksize):
+				yield trajectory_dataframe(columns)
+	elif path.endswith('.npz'):
+		for columns in iter_npz_columns(path, chunksize):
+			yield trajectory_dataframe(columns)
+	else:
+		for chunk in pd.read_csv(path, chunksize = chunksize):
+			yield chunk
+
+
+def iter_npz_columns(path, chunksize = 100000):
+	"""Read the 1D columns of an .npz file `chunksize` rows at a time.
+
+	   The .npy members of the archive are read sequentially from their zip streams, so only one piece
+	   of every column is in memory, for plain and compressed archives alike.
+
+	   Yields
+	   ------
+	   columns: dict of numpy.array
+		   the next `chunksize` rows of every column.
+	"""
+	with zipfile.ZipFile(path) as archive:
+		streams = {}
+		try:
+			n_rows = None
+			for member in archive.namelist():
+				stream = archive.open(member)
+				version = np.lib.format.read_magic(stream)
+				if version == (1, 0):
+					shape, _, dtype = np.lib.format.read_array_header_1_0(stream)
+				else:
+					shape, _, dtype = np.lib.format.read_array_header_2_0(stream)
+				if len(shape) != 1 or (n_rows is not None and shape[0] != n_rows):
+					raise ValueError('%s does not hold columns of the same length' % path)
+				n_rows = shape[0]
+				streams[member[:-4] if member.endswith('.npy') else member] = (stream, dtype)
+			# an empty path is still one (empty) piece
+			n_rows = n_rows or 0
+			for start in range(0, max(n_rows, 1), chunksize):
+				n = min(chunksize, n_rows - start)
+				yield dict((name, np.frombuffer(stream.read(n * dtype.itemsize), dtype = dtype))
+						   for name, (stream, dtype) in streams.items())
+		finally:
+			for stream, _ in streams.values():
+				stream.close()
+
+
+def load_trajectory(path):
+	"""Read a rat path saved by motion_detector.py.
+
+	   Parameters
+	   ----------
+	   path: str
+		   .npz file written by `TrajectoryBuffer.save`, a folder of checkpoint chunks written by 
+		   `TrajectoryCheckpointer` or a csv file with at least x_cords and y_cords columns.
+
+	   Returns
+	   -------
+	   rat_path: DataFrame
+		   one row per tracked frame, missed frames have NaN coordinates.
+	"""
+	if os.path.isdir(path):
+		return TrajectoryBuffer.load(path).to_dataframe()
+	if path.endswith('.npz'):
+		with np.load(path) as columns:
+			return trajectory_dataframe({name: columns[name] for name in columns.files})
+	return pd.read_csv(path)
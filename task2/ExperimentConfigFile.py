@@ -4,7 +4,10 @@
 import os    
 import numpy as np                                           
 import time
-from ConfigParser import RawConfigParser, NoSectionError
+try:
+    from ConfigParser import RawConfigParser, NoSectionError
+except ImportError:
+    from configparser import RawConfigParser, NoSectionError
 import matplotlib.ticker
 import matplotlib.dates as mpd
 
@@ -16,12 +19,26 @@ class ExperimentConfigFile(RawConfigParser, matplotlib.ticker.Formatter):
             if os.path.isfile(os.path.join(path, 'config.txt')):
                 self.fname = 'config.txt'
             else:
-                self.fname = filter(lambda x: x.startswith('config') 
-                        and x.endswith('.txt'), os.listdir(path))[0]
+                self.fname = [x for x in os.listdir(path) if x.startswith('config')
+                        and x.endswith('.txt')][0]
         else:                  
             self.fname = fname
         self.read(os.path.join(path, self.fname)) 
-        
+        self._build_phase_table()
+
+    def _build_phase_table(self):
+        """Parse the times of all sections once into arrays sorted by start:
+        phase_names, phase_starts, phase_ends."""
+        times = [self._parsetime(sec) for sec in self.sections()]
+        self._times = dict(zip(self.sections(), times))
+        order = np.argsort([t[0] for t in times], kind='mergesort')
+        self.phase_names = np.array(self.sections(), dtype=object)[order]
+        self.phase_starts = np.array([t[0] for t in times], dtype=np.float64)[order]
+        self.phase_ends = np.array([t[1] for t in times], dtype=np.float64)[order]
+        # a phase starting before the end of an earlier one needs the slow path of assign_phase
+        self._overlapping = bool(np.any(self.phase_starts[1:] <
+                                        np.maximum.accumulate(self.phase_ends)[:-1]))
+
     def gettime(self, sec): 
         """Convert start and end time and date read from section sec
         (might be a list)
@@ -35,29 +52,52 @@ class ExperimentConfigFile(RawConfigParser, matplotlib.ticker.Formatter):
                 starts.append(st)
                 ends.append(et)
             return min(starts), max(ends)
+        elif sec not in self._times:
+            raise NoSectionError(sec)
         else:
-            tstr1 = self.get(sec, 'startdate') + self.get(sec, 'starttime')
-            tstr2 = self.get(sec, 'enddate') + self.get(sec, 'endtime')
-            if len(tstr1) == 15:
-                t1 = time.strptime(tstr1, '%d.%m.%Y%H:%M')
-            elif len(tstr1) == 18:                        
-                t1 = time.strptime(tstr1, '%d.%m.%Y%H:%M:%S')
-            else: 
-                raise Exception('Wrong date format in %s' %self.fname)
-
-            if len(tstr2) == 15:
-                t2 = time.strptime(tstr2, '%d.%m.%Y%H:%M')
-            elif len(tstr2) == 18:                        
-                t2 = time.strptime(tstr2, '%d.%m.%Y%H:%M:%S')
-            else: 
-                raise Exception('Wrong date format in %s' %self.fname)
-
-            return time.mktime(t1), time.mktime(t2)
+            return self._times[sec]
+
+    def assign_phase(self, timestamps, unknown='Unknown'):
+        """Names of the phases of an array of times from epoch, `unknown`
+        for times outside of every phase. One binary search for all times.
+
+        A time inside overlapping phases (ex. a section enclosing others)
+        gets the first of them in the config file, one masked pass per
+        section is made then."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if self._overlapping:
+            names = np.full(timestamps.shape, unknown, dtype=object)
+            # later assignments win, so the sections go in reverse file order
+            for sec in reversed(self.sections()):
+                start, end = self._times[sec]
+                names[(start <= timestamps) & (timestamps < end)] = sec
+            return names
+        idcs = np.searchsorted(self.phase_starts, timestamps, side='right') - 1
+        inside = idcs >= 0
+        inside[inside] = timestamps[inside] < self.phase_ends[idcs[inside]]
+        names = np.full(timestamps.shape, unknown, dtype=object)
+        names[inside] = self.phase_names[idcs[inside]]
+        return names
+
+    def _parsetime(self, sec):
+        """Parse the start and end time of section sec to times from epoch."""
+        tstr1 = self.get(sec, 'startdate') + self.get(sec, 'starttime')
+        tstr2 = self.get(sec, 'enddate') + self.get(sec, 'endtime')
+        if len(tstr1) == 15:
+            t1 = time.strptime(tstr1, '%d.%m.%Y%H:%M')
+        elif len(tstr1) == 18:                        
+            t1 = time.strptime(tstr1, '%d.%m.%Y%H:%M:%S')
+        else: 
+            raise Exception('Wrong date format in %s' %self.fname)
+
+        if len(tstr2) == 15:
+            t2 = time.strptime(tstr2, '%d.%m.%Y%H:%M')
+        elif len(tstr2) == 18:                        
+            t2 = time.strptime(tstr2, '%d.%m.%Y%H:%M:%S')
+        else: 
+            raise Exception('Wrong date format in %s' %self.fname)
+
+        return time.mktime(t1), time.mktime(t2)
 
     def __call__(self, x, pos=0):
-        x = mpd.num2epoch(x)
-        for sec in self.sections():
-            t1, t2 = self.gettime(sec)
-            if t1 <= x and x < t2:
-                return sec
-        return 'Unknown'    
\ No newline at end of file
+        return self.assign_phase([mpd.num2epoch(x)])[0]  
\ No newline at end of file
@@ -4,8 +4,16 @@
 import os
 import csv
 import time
+import json
+import heapq
+from itertools import islice
 import numpy as np
 
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
 class Data(object):
     def __init__(self, path, _ant_pos=None):
         pass
@@ -15,6 +23,41 @@ class Data(object):
         return (time.mktime(time.strptime(s[:-4], '%Y%m%d %H:%M:%S'))
                     + float(s[-3:])/1000.)          
 
+    @staticmethod
+    def convert_times(strings):
+        """Convert a column of 'YYYYmmdd HH:MM:SS.mmm' strings to a float64
+        array of seconds since epoch, the same as convert_time on each string.
+
+        The fields are cut from fixed character positions of the whole column
+        at once. Like mktime the times are local, time.mktime is called once
+        per distinct minute to get its UTC offset, so DST is handled the same
+        way. Columns with other string lengths fall back to convert_time."""
+        strings = np.asarray(strings).astype('U')
+        if strings.size == 0:
+            return np.empty(0, dtype=np.float64)
+        if np.any(np.char.str_len(strings) != 21):
+            return np.array([Data.convert_time(s) for s in strings], dtype=np.float64)
+        # one row of character codes per string
+        codes = strings.astype('U21').ravel().view(np.uint32).reshape(-1, 21)
+        separators = [8, 11, 14, 17]
+        digits = codes.astype(np.int64) - ord('0')
+        fields = np.delete(np.arange(21), separators)
+        if (np.any((digits[:, fields] < 0) | (digits[:, fields] > 9)) or
+                np.any(codes[:, separators] != [ord(c) for c in ' ::.'])):
+            raise ValueError('Timestamps must look like YYYYmmdd HH:MM:SS.mmm')
+
+        def number(first, last):
+            return digits[:, first:last].dot(10 ** np.arange(last - first - 1, -1, -1))
+
+        months = (number(0, 4) - 1970) * 12 + number(4, 6) - 1
+        days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + number(6, 8) - 1
+        # seconds since epoch if the wall clock time was UTC
+        naive = days * 86400 + number(9, 11) * 3600 + number(12, 14) * 60 + number(15, 17)
+        minutes, inverse = np.unique(naive // 60, return_inverse=True)
+        offsets = np.array([time.mktime(time.gmtime(m * 60)[:8] + (-1,)) - m * 60
+                            for m in minutes.tolist()])
+        return naive + offsets[inverse] + number(18, 21) / 1000.
+
 class ISession(object):
     def getstarttimes(self, *arg, **kwarg):
         raise NotImplementedError("Virtual method called")
@@ -31,15 +74,432 @@ class ISession(object):
     def getproperty(self, *arg, **kwarg):
         raise NotImplementedError("Virtual method called")
 
+class SessionColumns(object):
+    """Typed columns of the visits, sorted by (tag, start time).
+
+    The visits of one mouse are a contiguous slice of the columns,
+    offsets[code]:offsets[code + 1] for the mouse with tag code `code`.
+    `order` maps every row back to its position in the original lists."""
+
+    def __init__(self, tags, addresses, starts, ends):
+        self.tag_names, codes = np.unique(np.asarray(tags), return_inverse=True)
+        self.tag_codes = dict((tag, code) for code, tag in enumerate(self.tag_names))
+        starts = np.asarray(starts, dtype=np.float64)
+        # lexsort is stable, visits starting at the same time keep their order
+        self.order = np.lexsort((starts, codes))
+        self.tag = codes[self.order].astype(np.int32)
+        self.start = starts[self.order]
+        self.end = np.asarray(ends, dtype=np.float64)[self.order]
+        self.address = np.asarray(addresses, dtype=np.int16)[self.order]
+        self.offsets = np.searchsorted(self.tag, np.arange(len(self.tag_names) + 1))
+        self._buffers = None
+
+    # arrays saved by save, all other attributes are derived from them
+    ARRAYS = ('tag_names', 'order', 'tag', 'start', 'end', 'address', 'offsets')
+    # row columns, views of over-allocated buffers once visits are appended
+    ROWS = ('order', 'tag', 'start', 'end', 'address')
+
+    def __len__(self):
+        return len(self.order)
+
+    def save(self, directory, meta=None):
+        """Save the columns as .npy files to `directory`, readable by load.
+        A 'complete' marker is written last, a partial cache is never used.
+        `meta` (ex. a LogFollower checkpoint) is saved with them as json."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        marker = os.path.join(directory, 'complete')
+        if os.path.isfile(marker):
+            os.remove(marker)
+        for name in self.ARRAYS:
+            tmp_path = os.path.join(directory, '%s.%i.tmp.npy' % (name, os.getpid()))
+            np.save(tmp_path, getattr(self, name))
+            os.rename(tmp_path, os.path.join(directory, name + '.npy'))
+        if meta is not None:
+            tmp_path = os.path.join(directory, 'meta.%i.tmp.json' % os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp_path, os.path.join(directory, 'meta.json'))
+        open(marker, 'w').close()
+
+    @staticmethod
+    def load_meta(directory):
+        """`meta` saved with the columns, None if there is none."""
+        path = os.path.join(directory, 'meta.json')
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def is_cached(directory, source=None):
+        """True if `directory` holds saved columns newer than the `source` file."""
+        marker = os.path.join(directory, 'complete')
+        if not os.path.isfile(marker):
+            return False
+        return source is None or not os.path.isfile(source) or \
+            os.path.getmtime(marker) >= os.path.getmtime(source)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Columns saved by save. By default the arrays are memory-mapped
+        read-only, so processes loading the same columns share their pages."""
+        columns = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(columns, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+        columns.tag_codes = dict((tag, code) for code, tag in enumerate(columns.tag_names.tolist()))
+        return columns
+
+    def extend(self, tags, addresses, starts, ends):
+        """Add visits after the end of the original lists.
+
+        Visits of a log arrive after the earlier visits of the same mouse,
+        so each new visit goes at the end of its mouse's slice: only the new
+        visits are sorted. When they all sort after the last row (ex. new
+        mice or the last mouse) they are copied to the end of over-allocated
+        buffers, at amortised cost of the new visits, otherwise the columns
+        are extended with one np.insert each. New visits starting before a
+        known visit of their mouse rebuild the whole index."""
+        tags = np.asarray(tags)
+        starts = np.asarray(starts, dtype=np.float64)
+        n_old = len(self.order)
+        new_tags, inverse = np.unique(tags, return_inverse=True)
+        unknown = [tag for tag in new_tags.tolist() if tag not in self.tag_codes]
+        if unknown:
+            self.tag_names = np.array(self.tag_names.tolist() + unknown)
+            for tag in unknown:
+                self.tag_codes[tag] = len(self.tag_codes)
+            self.offsets = np.concatenate((self.offsets, np.repeat(self.offsets[-1], len(unknown))))
+        codes = np.array([self.tag_codes[tag] for tag in new_tags.tolist()], dtype=np.int32)[inverse]
+
+        order = np.lexsort((starts, codes))
+        codes = codes[order]
+        starts = starts[order]
+        last = self.offsets[codes + 1] - 1
+        has_old = last >= self.offsets[codes]
+        if np.any(starts[has_old] < self.start[last[has_old]]):
+            self._rebuild(tags, addresses, starts[np.argsort(order)], ends)
+            return
+        new = {'order': n_old + order, 'tag': codes, 'start': starts,
+               'end': np.asarray(ends, dtype=np.float64)[order],
+               'address': np.asarray(addresses, dtype=np.int16)[order]}
+        if n_old == 0 or codes[0] >= self.tag[n_old - 1]:
+            self._append_rows(new)
+        else:
+            at = self.offsets[codes + 1]
+            for name in self.ROWS:
+                setattr(self, name, np.insert(getattr(self, name), at, new[name]))
+            self._buffers = None
+        # the slices of the mice after a mouse with new visits move
+        counts = np.bincount(codes, minlength=len(self.tag_names))
+        self.offsets = self.offsets + np.concatenate(([0], np.cumsum(counts)))
+
+    def _append_rows(self, new):
+        """Copy the sorted `new` rows after the last row, growing the buffers
+        geometrically, so a row is copied O(1) times on average."""
+        n_old = len(self.order)
+        n = n_old + len(new['order'])
+        buffers = getattr(self, '_buffers', None)
+        if buffers is None or len(buffers['order']) < n:
+            capacity = max(n, 2 * n_old, 1024)
+            grown = {}
+            for name in self.ROWS:
+                grown[name] = np.empty(capacity, dtype=getattr(self, name).dtype)
+                grown[name][:n_old] = getattr(self, name)
+            buffers = self._buffers = grown
+        for name in self.ROWS:
+            buffers[name][n_old:n] = new[name]
+            # a view, arrays returned before keep their length
+            setattr(self, name, buffers[name][:n])
+
+    def _rebuild(self, tags, addresses, starts, ends):
+        """Index the visits again, with new visits after the current ones."""
+        original = np.empty_like(self.order)
+        original[self.order] = np.arange(len(self.order))
+        self.__init__(np.concatenate((self.tag_names[self.tag][original], tags)),
+                      np.concatenate((self.address[original], addresses)),
+                      np.concatenate((self.start[original], starts)),
+                      np.concatenate((self.end[original], ends)))
+
+    def column(self, propname):
+        """Typed column of a property, None for properties kept only in the lists."""
+        return {'AbsStartTimecode': self.start, 'AbsEndTimecode': self.end,
+                'Address': self.address, 'Tag': self.tag}.get(propname)
+
+    def rows(self, mice, starttime=None, endtime=None):
+        """Row numbers of the visits of `mice` starting in [starttime, endtime), in time order.
+        A missing starttime or endtime leaves that side of the window open."""
+        if starttime is None and endtime is None:
+            return self.window_rows(mice)[0]
+        return self.window_rows(mice, [-np.inf if starttime is None else starttime],
+                                [np.inf if endtime is None else endtime])[0]
+
+    def window_rows(self, mice, starttimes=None, endtimes=None):
+        """Row numbers of the visits of `mice` starting in each of the windows
+        [starttimes[i], endtimes[i]), all windows in one vectorized pass.
+        Without windows all visits of `mice` are returned as window 0.
+
+        Returns (rows, windows) - the rows are ordered by window, then time,
+        for any number of mice, windows[j] is the window of rows[j]."""
+        if starttimes is not None:
+            starttimes = np.atleast_1d(np.asarray(starttimes, dtype=np.float64))
+            endtimes = np.atleast_1d(np.asarray(endtimes, dtype=np.float64))
+        rows, windows = [], []
+        for mouse in mice:
+            code = self.tag_codes.get(mouse)
+            if code is None:
+                continue
+            lo, hi = self.offsets[code], self.offsets[code + 1]
+            if starttimes is None:
+                first, counts = np.array([lo]), np.array([hi - lo])
+            else:
+                # the start times of one mouse are sorted, every window is a binary search
+                first = lo + np.searchsorted(self.start[lo:hi], starttimes)
+                counts = np.maximum(lo + np.searchsorted(self.start[lo:hi], endtimes) - first, 0)
+            window = np.repeat(np.arange(len(counts)), counts)
+            # consecutive row numbers from first[i] for counts[i] rows of every window
+            steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            rows.append(np.repeat(first, counts) + steps)
+            windows.append(window)
+        if not rows:
+            return np.arange(0), np.arange(0)
+        rows = np.concatenate(rows)
+        windows = np.concatenate(windows)
+        if len(mice) > 1:
+            # the visits of several mice are merged in time order, visits
+            # starting at the same time in the order of the original lists
+            order = np.lexsort((self.order[rows], self.start[rows], windows))
+            rows, windows = rows[order], windows[order]
+        return rows, windows
+
+
+# Columns of a visit log, in the order of the merged visits
+LOG_COLUMNS = ('AbsStartTimecode', 'Tag', 'Address', 'AbsEndTimecode')
+
+
+def _parse_times(values):
+    """Epoch seconds of a list of time fields - numbers or
+    'YYYYmmdd HH:MM:SS.mmm' strings, see Data.convert_times."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except ValueError:
+        return Data.convert_times(values)
+
+
+def _log_fields(header, names, path):
+    """Positions of the LOG_COLUMNS in the header of a visit log."""
+    names = dict((column, column) for column in LOG_COLUMNS) if names is None \
+        else dict((column, names.get(column, column)) for column in LOG_COLUMNS)
+    header = [name.strip() for name in header]
+    try:
+        return [header.index(names[column]) for column in LOG_COLUMNS]
+    except ValueError:
+        raise ValueError('%s must have the columns %s'
+                         % (path, ', '.join(names[c] for c in LOG_COLUMNS)))
+
+
+def _visit_chunk(rows, fields):
+    """Typed LOG_COLUMNS arrays of csv rows, None if there are no visits."""
+    rows = [[row[i].strip() for i in fields] for row in rows if row]
+    if not rows:
+        return None
+    starts, tags, addresses, ends = zip(*rows)
+    return {'AbsStartTimecode': _parse_times(starts),
+            'Tag': np.array(tags),
+            'Address': np.asarray(addresses, dtype=np.int16),
+            'AbsEndTimecode': _parse_times(ends)}
+
+
+def iter_visit_log(path, chunksize=100000, delimiter=',', names=None):
+    """Read a csv log of visits in chunks of `chunksize` rows.
+
+    The first line of the file names the columns. `names` maps the
+    LOG_COLUMNS to the column names of the file, where they differ.
+    The times are epoch seconds or 'YYYYmmdd HH:MM:SS.mmm' strings.
+
+    Yields dicts with the typed LOG_COLUMNS arrays of every chunk."""
+    with open(path) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        fields = _log_fields(next(reader), names, path)
+        while True:
+            batch = list(islice(reader, chunksize))
+            if not batch:
+                return
+            chunk = _visit_chunk(batch, fields)
+            if chunk is not None:
+                yield chunk
+
+
+class LogFollower(object):
+    """Reads the visits appended to a growing csv visit log.
+
+    Every read_new call returns the complete lines written since the last
+    call, a partly written last line is left for the next call. The byte
+    offset reached is the checkpoint: `state` can be saved with the data
+    built from the log and passed back to continue after a restart.
+    See iter_visit_log for the log format."""
+
+    def __init__(self, path, state=None, delimiter=',', names=None,
+                 max_bytes=64 * 2 ** 20):
+        self.path = path
+        self.delimiter = delimiter
+        self.names = names
+        self.max_bytes = max_bytes
+        self.state = {'path': os.path.abspath(path), 'offset': 0, 'header': None}
+        self.caught_up = False
+        if state is not None:
+            if state['path'] != self.state['path']:
+                raise ValueError('Checkpoint of %s, not %s' % (state['path'], path))
+            self.state.update(state)
+
+    def read_new(self):
+        """Visits appended since the last call, as a dict of typed
+        LOG_COLUMNS arrays, None if there are none.
+
+        At most about `max_bytes` are read per call, a single longer line is
+        read whole. `caught_up` tells if the end of the log was reached."""
+        offset = self.state['offset']
+        if os.path.getsize(self.path) < offset:
+            raise IOError('%s is shorter than the checkpoint, was it replaced?' % self.path)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            new = read = f.read(self.max_bytes)
+            while read and b'\n' not in read:
+                read = f.read(self.max_bytes)
+                new += read
+            self.caught_up = f.tell() >= os.fstat(f.fileno()).st_size
+        complete = new[:new.rfind(b'\n') + 1]
+        if not complete:
+            return None
+        lines = complete.decode('utf-8').splitlines()
+        self.state['offset'] = offset + len(complete)
+        if self.state['header'] is None:
+            self.state['header'] = lines.pop(0)
+        header = next(csv.reader([self.state['header']], delimiter=self.delimiter))
+        return _visit_chunk(csv.reader(lines, delimiter=self.delimiter),
+                            _log_fields(header, self.names, self.path))
+
+
+def _iter_visits(path, log_idx, **kwargs):
+    """Visits of a log as (start, log_idx, row, tag, address, end) tuples,
+    so that tuples of different logs compare by time."""
+    row = 0
+    for chunk in iter_visit_log(path, **kwargs):
+        columns = [chunk[column].tolist() for column in LOG_COLUMNS]
+        for start, tag, address, end in zip(*columns):
+            yield start, log_idx, row, tag, address, end
+            row += 1
+
+
+def merge_visit_logs(paths, chunksize=100000, **kwargs):
+    """Merge visit logs, each in time order, into one time ordered stream.
+
+    The logs are read in chunks and merged with a k-way merge, so only
+    one chunk per log is held in memory. Yields dicts of typed LOG_COLUMNS
+    arrays of up to `chunksize` visits, see iter_visit_log for the
+    other arguments."""
+    merged = heapq.merge(*[_iter_visits(path, i, chunksize=chunksize, **kwargs)
+                           for i, path in enumerate(paths)])
+    while True:
+        visits = [(v[0], v[3], v[4], v[5]) for v in islice(merged, chunksize)]
+        if not visits:
+            return
+        starts, tags, addresses, ends = zip(*visits)
+        yield {'AbsStartTimecode': np.array(starts, dtype=np.float64),
+               'Tag': np.array(tags),
+               'Address': np.array(addresses, dtype=np.int16),
+               'AbsEndTimecode': np.array(ends, dtype=np.float64)}
+
+
 class Sessions(ISession):
 
-    def __init__(self, ehd, **kwargs):
-        pass
+    def __init__(self, ehd=None, data=None, **kwargs):
+        """Visits of the mice to the rooms.
+
+        ehd - experiment data with a `mice` attribute, optional.
+        data - dict of equally long columns, at least Tag, Address,
+        AbsStartTimecode and AbsEndTimecode, in time order."""
+        self._ehd = ehd
+        self.data = data if data is not None else dict(
+            (column, []) for column in LOG_COLUMNS)
+        self.mask = None
+
+    @classmethod
+    def from_logs(cls, paths, chunksize=100000, ehd=None, **kwargs):
+        """Build Sessions from csv visit logs, see merge_visit_logs.
+        Logs of several cages or antennas are merged by visit start time."""
+        if isinstance(paths, string_types):
+            paths = [paths]
+        chunks = list(merge_visit_logs(paths, chunksize, **kwargs))
+        if chunks:
+            data = dict((column, np.concatenate([chunk[column] for chunk in chunks]))
+                        for column in LOG_COLUMNS)
+        else:
+            data = None
+        return cls(ehd, data)
+
+    @classmethod
+    def from_columns(cls, columns, ehd=None):
+        """Sessions backed only by indexed SessionColumns, ex. loaded from a
+        cache. Only the Tag, Address and timecode properties are available."""
+        sessions = cls(ehd)
+        sessions.data = None
+        sessions._columns = columns
+        return sessions
+
+    def append(self, visits):
+        """Add newly arrived visits, ex. from LogFollower.read_new.
+
+        visits - dict of LOG_COLUMNS arrays, visits after the current ones.
+        The index is updated incrementally, see SessionColumns.extend.
+        Other properties of the new visits are None."""
+        n_new = len(visits['Tag'])
+        if n_new == 0:
+            return
+        index = self._index()
+        if self.data is not None:
+            for column in list(self.data):
+                values = self.data[column]
+                new = np.asarray(visits[column]).tolist() if column in visits else [None] * n_new
+                if isinstance(values, list):
+                    values.extend(new)
+                else:
+                    self.data[column] = np.concatenate((values, visits[column] if column in visits else new))
+        index.extend(visits['Tag'], visits['Address'],
+                     visits['AbsStartTimecode'], visits['AbsEndTimecode'])
+
+    @property
+    def mice(self):
+        """Tags of all mice with visits."""
+        return self._index().tag_names.tolist()
+
+    def tags(self, codes):
+        """Tags of the codes in the Tag column returned by query."""
+        return self._index().tag_names[np.asarray(codes)]
+
+    def _index(self):
+        """Typed, indexed columns of self.data, built on first use
+        (also for Sessions unpickled from older versions)."""
+        columns = getattr(self, '_columns', None)
+        if self.data is None:
+            return columns
+        if columns is None or len(columns) != len(self.data['Tag']):
+            columns = SessionColumns(self.data['Tag'], self.data['Address'],
+                                     self.data['AbsStartTimecode'],
+                                     self.data['AbsEndTimecode'])
+            self._columns = columns
+        return columns
+
+    def __getstate__(self):
+        # the index is rebuilt after unpickling
+        state = self.__dict__.copy()
+        if state.get('data') is not None:
+            state.pop('_columns', None)
+        return state
         
     def unmask_data(self):
         """Remove the mask - future queries will not be clipped"""
         self.mask = None
-        self._mask_slice = None
 
     def mask_data(self, *args):
         """mask_data(endtime) or mask_data(starttime, endtime)
@@ -49,39 +509,61 @@ class Sessions(ISession):
             starttime = args[0]
             endtime = args[1]
         except IndexError:   
-            starttime = min(self.getstarttimes(self._ehd.mice))
+            mice = self._ehd.mice if getattr(self, '_ehd', None) is not None else self.mice
+            starttime = min(self.getstarttimes(mice))
             endtime = args[0]
         self.mask = (starttime, endtime) 
-        arr = np.array(self.data['AbsStartTimecode'])
-        idcs = np.where((arr >= starttime) & (arr < endtime))[0]
-        if len(idcs) >= 2:
-            self._mask_slice = (idcs[0], idcs[-1] + 1)
-        elif len(idcs) == 1:
-            self._mask_slice = (idcs[0], idcs[0] + 1)
-        else:
-            self._mask_slice = (0, 0)
 
-    def getproperty(self, mice, propname, astype=None):
-        if isinstance(mice, (str, unicode)):
+    def query(self, mice, start=None, end=None,
+              columns=('AbsStartTimecode', 'AbsEndTimecode', 'Address')):
+        """Visits of `mice` starting in [start, end), as a dict of NumPy
+        arrays, one per column. Ignores the mask and does not change the
+        object, so it can be shared between threads.
+
+        start and end may be arrays, one time window per element. All windows
+        are answered at once, the result then has a 'window' array with the
+        window index of every visit. Visits are ordered by window then start
+        time, the visits of several mice are merged, not grouped by mouse.
+        A missing start or end leaves that side of the windows open, without
+        both all visits of `mice` are returned."""
+        if isinstance(mice, string_types):
             mice = [mice]
-        if self.mask is None:
-            if astype is None:
-                return [x[0] for x in zip(self.data[propname], 
-                        self.data['Tag']) if x[1] in mice]
-            elif astype == 'float':                          
-                return [float(x[0]) for x in zip(self.data[propname], 
-                        self.data['Tag']) if x[1] in mice]
+        index = self._index()
+        vectorized = np.ndim(start) > 0 or np.ndim(end) > 0
+        if start is None and end is None:
+            rows, windows = index.window_rows(mice)
         else:
-            if astype is None:
-                return [x[0] for x in zip(
-                        self.data[propname][self._mask_slice[0]:self._mask_slice[1]], 
-                        self.data['Tag'][self._mask_slice[0]:self._mask_slice[1]]) 
-                        if x[1] in mice] 
-            elif astype == 'float':
-                return [float(x[0]) for x in zip(
-                        self.data[propname][self._mask_slice[0]:self._mask_slice[1]], 
-                        self.data['Tag'][self._mask_slice[0]:self._mask_slice[1]]) 
-                        if x[1] in mice]
+            start, end = np.broadcast_arrays(
+                np.asarray(-np.inf if start is None else start, dtype=np.float64),
+                np.asarray(np.inf if end is None else end, dtype=np.float64))
+            rows, windows = index.window_rows(mice, start, end)
+        result = dict((name, self._values(index, name, rows)) for name in columns)
+        if vectorized:
+            result['window'] = windows
+        return result
+
+    def _values(self, index, propname, rows):
+        column = index.column(propname)
+        if column is not None:
+            return column[rows]
+        if self.data is None:
+            raise KeyError('%s is not stored in the cached columns' % propname)
+        values = self.data[propname]
+        return np.array([values[i] for i in index.order[rows]])
+
+    def getcolumn(self, mice, propname):
+        """Values of a property for the visits of `mice`, in time order,
+        as a NumPy array. Clipped to the mask, if there is one."""
+        mask = getattr(self, 'mask', None) or (None, None)
+        return self.query(mice, mask[0], mask[1], (propname,))[propname]
+
+    def getproperty(self, mice, propname, astype=None):
+        values = self.getcolumn(mice, propname)
+        if propname == 'Tag':
+            values = self._index().tag_names[values]
+        if astype == 'float':
+            return values.astype(np.float64).tolist()
+        return values.tolist()
                     
     def getstarttimes(self, mice): 
         return self.getproperty(mice, 'AbsStartTimecode', 'float')
@@ -92,3 +574,77 @@ class Sessions(ISession):
     def getaddresses(self, mice): 
         return self.getproperty(mice, 'Address')
     
+
+
+class SessionStore(object):
+    """Sessions saved in a folder, kept up to date at the cost of the new
+    visits.
+
+    The indexed columns are saved whole once (SessionColumns.save), later
+    visits are written as small pending_<n>.npz files next to them and
+    meta.json records how many of them belong to the state, together with
+    the caller's `meta` (ex. a LogFollower checkpoint). When the pending
+    visits outgrow `compact_fraction` of the saved ones, or there are
+    `max_pending` files, the columns are saved whole again."""
+
+    def __init__(self, directory, compact_fraction=0.25, max_pending=1000):
+        self.directory = directory
+        self.compact_fraction = compact_fraction
+        self.max_pending = max_pending
+        self.n_saved = 0
+        self.n_pending = 0
+        self.pending_rows = 0
+
+    def exists(self):
+        """True if the folder holds a saved state."""
+        return SessionColumns.is_cached(self.directory)
+
+    def _pending_path(self, i):
+        return os.path.join(self.directory, 'pending_%06i.npz' % i)
+
+    def load(self, ehd=None):
+        """Saved (sessions, meta), (None, None) if nothing was saved."""
+        if not self.exists():
+            return None, None
+        state = SessionColumns.load_meta(self.directory) or {}
+        sessions = Sessions.from_columns(SessionColumns.load(self.directory), ehd)
+        self.n_saved = len(sessions._index())
+        self.n_pending = state.get('n_pending', 0)
+        self.pending_rows = 0
+        for i in range(self.n_pending):
+            with np.load(self._pending_path(i)) as f:
+                visits = dict((column, f[column]) for column in LOG_COLUMNS)
+            sessions.append(visits)
+            self.pending_rows += len(visits['Tag'])
+        return sessions, state.get('meta')
+
+    def save(self, sessions, meta=None):
+        """Save all visits of `sessions` whole, dropping the pending files."""
+        sessions._index().save(self.directory, {'meta': meta, 'n_pending': 0})
+        for i in range(self.n_pending):
+            if os.path.isfile(self._pending_path(i)):
+                os.remove(self._pending_path(i))
+        self.n_saved = len(sessions._index())
+        self.n_pending = 0
+        self.pending_rows = 0
+
+    def append(self, sessions, visits, meta=None):
+        """Record `visits`, already appended to `sessions`, and the new `meta`.
+        Only the new visits are written, unless it is time to save whole."""
+        n_new = 0 if visits is None else len(visits['Tag'])
+        if (not self.exists() or self.n_pending >= self.max_pending or
+                self.pending_rows + n_new > self.compact_fraction * self.n_saved):
+            self.save(sessions, meta)
+            return
+        if n_new:
+            path = self._pending_path(self.n_pending)
+            tmp_path = path[:-4] + '.%i.tmp.npz' % os.getpid()
+            np.savez(tmp_path, **dict((column, np.asarray(visits[column])) for column in LOG_COLUMNS))
+            os.rename(tmp_path, path)
+            self.n_pending += 1
+            self.pending_rows += n_new
+        # the pending file is only used once meta.json counts it
+        tmp_path = os.path.join(self.directory, 'meta.%i.tmp.json' % os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'meta': meta, 'n_pending': self.n_pending}, f)
+        os.rename(tmp_path, os.path.join(self.directory, 'meta.json'))
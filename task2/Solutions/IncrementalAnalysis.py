@@ -0,0 +1,140 @@
+"""
+Keeps the individual results (time of each mouse in each room in each phase) up to date while an experiment runs.
+
+New visits are read from the end of a growing csv log (see Handler.LogFollower) and appended to the Sessions,
+only the mice and phases with new visits are computed again. With --state-dir the visits and the log offset are
+saved together after every update (see Handler.SessionStore, only the new visits are written), a restarted run
+continues from there. A log far ahead of the last read is read without pausing until it is caught up.
+
+    python IncrementalAnalysis.py ../data/visits.csv --state-dir ../data/live_state --interval 60
+"""
+
+import sys
+import os.path
+import time
+import argparse
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+import Handler
+from load_data import get_phases
+
+
+class PhaseAggregates(object):
+    """Total time and number of visits per mouse, phase and room, updated incrementally.
+
+        Parameters
+        ----------
+        sessions: Handler.Sessions
+            visits of the mice, new visits are added with `update`.
+
+        phases: ExperimentConfigFile
+            phases of the experiment.
+    """
+
+    def __init__(self, sessions, phases):
+        self.sessions = sessions
+        self.phases = phases
+        # (mouse, phase) -> (room numbers, room times in ms, visit counts)
+        self.results = {}
+        mice = sessions.mice
+        if mice:
+            visits = sessions.query(mice, columns = ('Tag', 'AbsStartTimecode'))
+            tags = sessions.tags(visits['Tag'])
+            self.refresh(zip(tags, phases.assign_phase(visits['AbsStartTimecode'])))
+
+    def refresh(self, mice_phases):
+        """Compute the results of the given (mouse, phase) pairs again."""
+        for mouse, phase in set(mice_phases):
+            if phase == 'Unknown':
+                continue
+            visits = self.sessions.query(mouse, *self.phases.gettime(phase))
+            rooms, inverse = np.unique(visits['Address'], return_inverse = True)
+            durations = ((visits['AbsEndTimecode'] - visits['AbsStartTimecode']) * 1000).astype(np.int64)
+            self.results[(mouse, phase)] = (rooms, np.bincount(inverse, weights = durations).astype(np.int64),
+                                            np.bincount(inverse))
+
+    def update(self, visits):
+        """Append new visits (dict of Handler.LOG_COLUMNS arrays) and update only the affected mice and phases.
+
+            Returns
+            -------
+            affected: set
+                (mouse, phase) pairs computed again.
+        """
+        if visits is None or not len(visits['Tag']):
+            return set()
+        self.sessions.append(visits)
+        affected = set(zip(np.asarray(visits['Tag']).tolist(),
+                           self.phases.assign_phase(visits['AbsStartTimecode']).tolist()))
+        self.refresh(affected)
+        return affected
+
+    def to_dataframe(self):
+        """Results in the format of indiv_times.csv, with a number_of_visits column.
+
+            Returns
+            -------
+            room_time_db: DataFrame
+                columns: 'room_id', 'room_time', 'phase', 'mouse_id', 'number_of_visits'
+        """
+        tables = []
+        for (mouse, phase), (rooms, room_times, counts) in sorted(self.results.items()):
+            tables.append(pd.DataFrame({'room_id': rooms, 'room_time': room_times, 'phase': phase,
+                                        'mouse_id': mouse, 'number_of_visits': counts},
+                                       columns = ['room_id', 'room_time', 'phase', 'mouse_id', 'number_of_visits']))
+        if not tables:
+            return pd.DataFrame(columns = ['room_id', 'room_time', 'phase', 'mouse_id', 'number_of_visits'])
+        return pd.concat(tables, ignore_index = True)
+
+
+def load_state(log_path, state_dir = None, **kwargs):
+    """Sessions, log follower and state store, continued from `state_dir` when it holds a saved state."""
+    store = Handler.SessionStore(state_dir) if state_dir is not None else None
+    sessions, log_state = store.load() if store is not None else (None, None)
+    if sessions is None:
+        sessions = Handler.Sessions()
+    return sessions, Handler.LogFollower(log_path, log_state, **kwargs), store
+
+
+def follow(log_path, state_dir = None, output = None, interval = 60.0, delimiter = ','):
+    """Read new visits from the log every `interval` seconds and keep the results up to date, until interrupted.
+       While the log holds more than one read of new lines, they are read without waiting.
+    """
+    sessions, follower, store = load_state(log_path, state_dir, delimiter = delimiter)
+    aggregates = PhaseAggregates(sessions, get_phases())
+    while True:
+        visits = follower.read_new()
+        affected = aggregates.update(visits)
+        if affected:
+            print('%i new visits, updated %i mouse phases' % (len(visits['Tag']), len(affected)))
+            if store is not None:
+                store.append(sessions, visits, follower.state)
+            if output is not None:
+                aggregates.to_dataframe().to_csv(output, index = False)
+        if follower.caught_up:
+            time.sleep(interval)
+
+
+def main(argv = None):
+    """Command line entry point, run with --help for the options."""
+    parser = argparse.ArgumentParser(description = 'Keep the individual results up to date from a growing visit log.')
+    parser.add_argument('log', help = 'csv visit log, see Handler.iter_visit_log')
+    parser.add_argument('--state-dir', default = None, help = 'save the visits and the log offset here to continue after a restart')
+    parser.add_argument('--output', default = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'parsed_data', 'indiv_times_live.csv'),
+                        help = 'csv file with the results')
+    parser.add_argument('--interval', type = float, default = 60.0, help = 'seconds between reads of the log')
+    parser.add_argument('--delimiter', default = ',', help = 'field delimiter of the log')
+    args = parser.parse_args(argv)
+
+    try:
+        follow(args.log, args.state_dir, args.output, args.interval, args.delimiter)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
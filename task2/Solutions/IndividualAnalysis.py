@@ -5,11 +5,11 @@ Computes the times of the visits per mouse per phase to each room.
 import sys
 import os.path
 sys.path.append(os.path.dirname(__file__))
-sys.path.append("..")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 import pandas as pd
-from load_data import mice
-from ParseData import get_mice_phase
+from load_data import get_mice
+from ParseData import get_mice_phases
 import numpy as np
 
 
@@ -25,16 +25,19 @@ def get_all_times():
     # Define the phases to iterate over
     phases = ['PHASE 1 dark', 'PHASE 1 light', 'PHASE 2 dark', 'PHASE 2 light', 'PHASE 3 dark', 'PHASE 3 light']
     # Define the mice names to iterate over
-    mice_list = list(mice)
+    mice_list = list(get_mice())
     # Prepare a dataframe to store the results
     room_time_db = pd.DataFrame(columns = ['room_id', 'room_time', 'phase', 'mouse_id'])
     # Iterate over all mice in all phases
     for mouse in mice_list:
         print(mouse)
+        # Load the visits in all phases at once and drop unneccessary columns - event_number is used for PairAnalysis
+        mouse_phases = dict(list(get_mice_phases(mouse, phases).drop('event_number', axis =1).groupby('phase')))
         for phase in phases:
             print(phase)
-            # Load the data and drop unneccessary columns - event_number is used for PairAnalysis
-            _mice_phase = get_mice_phase(mouse, phase).drop('event_number', axis =1)
+            if phase not in mouse_phases:
+                continue
+            _mice_phase = mouse_phases[phase]
             # Calculate the time spent in each room by this mouse in this phase
             r_time = calc_room_time(_mice_phase)
             # Add the phase and mouse id info to the results
@@ -44,7 +47,7 @@ def get_all_times():
             room_time_db = room_time_db.append(r_time, ignore_index = True, verify_integrity = True)
             
     # Save the results so they don't need to be computed each time for the anlysis    
-    path = os.path.dirname(os.path.realpath(__file__)) + '/Solutions'
+    path = os.path.dirname(os.path.realpath(__file__))
 
     room_time_db.to_csv(path +'/parsed_data/indiv_times.csv', index = False)
     
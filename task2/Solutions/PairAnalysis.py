@@ -2,10 +2,10 @@ import sys
 import os.path
 
 sys.path.append(os.path.dirname(__file__))
-sys.path.append("..")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 import pandas as pd
-from load_data import mice
+from load_data import get_mice
 from ParseData import get_mice_phase
 import numpy as np
 from itertools import combinations
@@ -26,7 +26,7 @@ def get_all_combinations():
     meetings_db = pd.DataFrame(columns = ['mice_combination', 'room_id', 'phase', 'total_meeting_duration', 'number_of_meetings', 'average_meeting_duration'])
 
     # Iterate over all unique combinations of mice names
-    for name_a, name_b in combinations(list(mice),2):
+    for name_a, name_b in combinations(list(get_mice()),2):
         print(name_a)
         for phase in phases:
             # Calculate results for the current mice pair in the current phase
@@ -37,7 +37,7 @@ def get_all_combinations():
             # Aggregate the results
             meetings_db = meetings_db.append(single_entry, ignore_index = True)            
     # Save results to file
-    path = os.path.dirname(os.path.realpath(__file__)) + '/Solutions'
+    path = os.path.dirname(os.path.realpath(__file__))
     meetings_db.to_csv(path +'/parsed_data/pair_times.csv', index = False)
     return meetings_db
     
@@ -3,10 +3,12 @@ Prepares the dataframes that are aggregated for individual and pair analysis.
 
 """
 
+import os
 import sys
-sys.path.append("..") # Adds higher directory to python modules path.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) # Adds higher directory to python modules path.
+import numpy as np
 import pandas as pd
-from load_data import data, phases
+from load_data import get_data, get_phases
 from datetime import datetime
 
 
@@ -19,7 +21,7 @@ def get_mice_phase(mouse, phase):
         Parameters
         ----------
         mouse:str
-            mouse identifier from the load_data.mice variable.
+            mouse identifier from load_data.get_mice().
             
         phase:str
             one of: PHASE 1 dark, PHASE 1 light, PHASE 2 dark, ... PHASE 3 light.
@@ -36,29 +38,60 @@ def get_mice_phase(mouse, phase):
                 event_number - is the unnique number per each visit to the room 
     """
 
-    data.unmask_data()
-    data.mask_data(*phases.gettime(phase))
-    # Because of masking only visits starting in the given phase are returned.
-    start_times = data.getstarttimes(mouse)
-    end_times = data.getendtimes(mouse)
-    room_numbers = data.getaddresses(mouse)
+    # Only visits starting in the given phase are returned.
+    visits = get_data().query(mouse, *get_phases().gettime(phase))
+    return visits_frame(visits)
 
-    mice_phase_df = pd.DataFrame(columns = ['timestamp', 'status', 'room', 'phase', 'mouse_id', 'event_number'])
-    idx = 0
- 
-    for st, en, room in zip(start_times, end_times, room_numbers):
 
-        # Convert timestamps to datetime format 
-        _st = datetime.fromtimestamp(st)
-        _en = datetime.fromtimestamp(en)
-        
-        # add a new row to the dataframe, one for mouse entering and one for leaving the room
-        mice_phase_df.loc[idx, ['timestamp', 'status', 'room', 'event_number']] = [_st, 'start',room, idx/2]
-        mice_phase_df.loc[idx+1, ['timestamp', 'status', 'room', 'event_number']] = [_en,'end',room, idx/2]
-       # Move the index by two, beacuse at each iteration we add two rows
-        idx = idx + 2
+def get_mice_phases(mouse, phases = None):
+    """Room visits of a single mouse in many phases at once, each visit annotated with the phase it starts in.
+       All visits of the mouse are labelled in one `ExperimentConfigFile.assign_phase` call instead of a query per phase.
+
+        Parameters
+        ----------
+        mouse:str
+            mouse identifier from load_data.get_mice().
+
+        phases: list or None
+            phase names to keep, None for all phases of the config file.
+
+        Returns
+        -------
+        mice_phases_df: DataFrame
+            Same as `get_mice_phase()`, with the phase column filled and event_number counted within each phase.
+    """
+    visits = get_data().query(mouse)
+    phase_names = get_phases().assign_phase(visits['AbsStartTimecode'])
+    keep = phase_names != 'Unknown' if phases is None else np.isin(phase_names, list(phases))
+    visits = dict((name, values[keep]) for name, values in visits.items())
+    return visits_frame(visits, phase_names[keep])
+
+
+def visits_frame(visits, phase_names = None):
+    """Build the dataframe of `get_mice_phase()` from the arrays returned by `Handler.Sessions.query`.
+       With `phase_names` (one per visit, visits of a phase are consecutive) the phase column is filled
+       and the event numbers restart in every phase.
+    """
+    n_visits = len(visits['Address'])
+    event_number = np.arange(n_visits)
+    phase = np.nan
+    if phase_names is not None and n_visits:
+        # number the visits from 0 in every phase
+        phase_start = np.flatnonzero(np.r_[True, phase_names[1:] != phase_names[:-1]])
+        event_number = event_number - np.repeat(phase_start, np.diff(np.r_[phase_start, n_visits]))
+        phase = np.repeat(phase_names, 2)
+
+    # two rows per visit, one for mouse entering and one for leaving the room
+    times = np.empty(2 * n_visits)
+    times[0::2] = visits['AbsStartTimecode']
+    times[1::2] = visits['AbsEndTimecode']
+    mice_phase_df = pd.DataFrame({'timestamp': [datetime.fromtimestamp(t) for t in times],
+                                  'status': np.tile(['start', 'end'], n_visits),
+                                  'room': np.repeat(visits['Address'], 2),
+                                  'phase': phase, 'mouse_id': np.nan,
+                                  'event_number': np.repeat(event_number, 2)},
+                                 columns = ['timestamp', 'status', 'room', 'phase', 'mouse_id', 'event_number'])
     # Use the entry and leaving times as index. This will allow to easily calculate mice visit intersections and durations.
     mice_phase_df.set_index(keys = 'timestamp', drop = False, inplace = True)
     
     return mice_phase_df
-    
@@ -2,7 +2,9 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from load_data import data, mice, phases
+from load_data import get_data, get_mice, get_phases
+
+data, mice, phases = get_data(), get_mice(), get_phases()
 
 # List of animals in experiment
 print list(mice)
@@ -1,21 +1,63 @@
 #!/usr/bin/env python
 
 # encoding: utf-8i
+"""
+Lazily loaded experiment data - nothing is read at import.
+
+get_data() returns the Sessions of data/data.pickle. The first call unpickles it
+once and saves its indexed columns to data/data_cache as .npy files, later calls
+(also in other processes) memory-map the cache read-only, so worker processes
+share the same pages instead of holding private copies. The cache is rebuilt
+when data.pickle is newer. get_mice() and get_phases() load mice.pickle and
+the experiment config on first use.
+
+In Python 3.7+ `from load_data import data, mice, phases` still works, it calls
+the accessors through the module __getattr__. Python 2 modules have no
+__getattr__, there the accessors have to be called directly.
+"""
+import os
+import pickle
 import Handler
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.dates import epoch2num
-import locale
 from ExperimentConfigFile import ExperimentConfigFile
-import pickle
-import os
-
-abspath = os.path.abspath(__file__)
-dname = os.path.dirname(abspath)
-os.chdir(dname)
 
-_path = 'data'
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+_cache_path = os.path.join(_path, 'data_cache')
 _smells = {'data': {'soc': 3, 'nsoc': 1}}
-data = pickle.load(open(os.path.join('data', 'data.pickle'), 'rb'))
-mice = pickle.load(open(os.path.join('data', 'mice.pickle'), 'rb'))
-phases = ExperimentConfigFile(_path)
+_loaded = {}
+
+
+def _load_pickle(name):
+    with open(os.path.join(_path, name), 'rb') as f:
+        return pickle.load(f)
+
+
+def get_data():
+    """Sessions with the visits of all mice, backed by the memory-mapped cache."""
+    if 'data' not in _loaded:
+        pickle_path = os.path.join(_path, 'data.pickle')
+        if not Handler.SessionColumns.is_cached(_cache_path, pickle_path):
+            Handler.SessionStore(_cache_path).save(_load_pickle('data.pickle'))
+        _loaded['data'] = Handler.Sessions.from_columns(
+            Handler.SessionColumns.load(_cache_path))
+    return _loaded['data']
+
+
+def get_mice():
+    """Identifiers of the mice in the experiment."""
+    if 'mice' not in _loaded:
+        _loaded['mice'] = _load_pickle('mice.pickle')
+    return _loaded['mice']
+
+
+def get_phases():
+    """ExperimentConfigFile with the phases of the experiment."""
+    if 'phases' not in _loaded:
+        _loaded['phases'] = ExperimentConfigFile(_path)
+    return _loaded['phases']
+
+
+def __getattr__(name):
+    accessors = {'data': get_data, 'mice': get_mice, 'phases': get_phases}
+    if name in accessors:
+        return accessors[name]()
+    raise AttributeError("module 'load_data' has no attribute %r" % name)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Tests of the bulk timestamp parsing in Handler.Data, run with pytest."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from Handler import Data, Sessions, SessionColumns
+
+
+@pytest.fixture(params=['Europe/Warsaw', 'America/New_York', 'UTC'])
+def timezone(request):
+    """Run the test in a local time zone with (or without) DST."""
+    if not hasattr(time, 'tzset'):
+        pytest.skip('time.tzset is not available')
+    old = os.environ.get('TZ')
+    os.environ['TZ'] = request.param
+    time.tzset()
+    yield request.param
+    if old is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = old
+    time.tzset()
+
+
+def check_same_as_convert_time(strings):
+    bulk = Data.convert_times(strings)
+    scalar = np.array([Data.convert_time(s) for s in strings])
+    np.testing.assert_allclose(bulk, scalar, rtol=0, atol=1e-6)
+
+
+def test_random_times(timezone):
+    rng = np.random.RandomState(0)
+    seconds = rng.randint(946684800, 1893456000, 2000)
+    strings = ['%s.%03i' % (time.strftime('%Y%m%d %H:%M:%S', time.gmtime(t)), ms)
+               for t, ms in zip(seconds.tolist(), rng.randint(0, 1000, 2000).tolist())]
+    check_same_as_convert_time(strings)
+
+
+def test_dst_transitions(timezone):
+    # spring forward (a missing hour) and fall back (a repeated hour) in Europe and the US
+    strings = []
+    for day in ('20160327', '20161030', '20160313', '20161106'):
+        for hour in range(0, 4):
+            for minute in (0, 29, 59):
+                strings.append('%s %02i:%02i:30.250' % (day, hour, minute))
+    check_same_as_convert_time(strings)
+
+
+def test_wide_string_dtype():
+    strings = np.array(['20160101 00:00:00.123', '20160101 12:34:56.789'], dtype='U30')
+    check_same_as_convert_time(strings)
+
+
+def test_bytes():
+    strings = np.array([b'20160101 00:00:00.123', b'20160701 23:59:59.999'])
+    np.testing.assert_allclose(Data.convert_times(strings),
+                               Data.convert_times([s.decode() for s in strings]))
+
+
+def test_other_lengths_fall_back():
+    check_same_as_convert_time(['20160101 0:00:00.123', '20160101 00:00:00.123'])
+
+
+@pytest.mark.parametrize('string', ['20160101 00:00:00,123', '20160101T00:00:00.123',
+                                    '20160101 00-00:00.123', '2016010a 00:00:00.123'])
+def test_malformed(string):
+    with pytest.raises(ValueError):
+        Data.convert_times([string, '20160101 00:00:00.123'])
+
+
+def test_empty():
+    assert Data.convert_times([]).shape == (0,)
+
+
+def shuffled_sessions():
+    # visits of two mice, the lists are deliberately not in time order
+    starts = [5.0, 1.0, 3.0, 2.0, 4.0, 3.0]
+    return Sessions(data={'Tag': ['b', 'a', 'b', 'a', 'a', 'a'],
+                          'Address': [1, 2, 3, 4, 5, 6],
+                          'AbsStartTimecode': starts,
+                          'AbsEndTimecode': [s + 0.5 for s in starts]})
+
+
+@pytest.mark.parametrize('mice', [['a'], ['a', 'b'], ['b', 'a']])
+def test_query_time_order(mice):
+    visits = shuffled_sessions().query(mice)
+    assert np.all(np.diff(visits['AbsStartTimecode']) >= 0)
+    # visits starting at the same time keep the order of the lists
+    if mice != ['a']:
+        np.testing.assert_array_equal(visits['Address'], [2, 4, 3, 6, 5, 1])
+
+
+def test_windowed_query_time_order():
+    visits = shuffled_sessions().query(['b', 'a'], [0.0, 2.5], [3.5, 10.0])
+    np.testing.assert_array_equal(visits['window'], [0, 0, 0, 0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(visits['AbsStartTimecode'], [1, 2, 3, 3, 3, 3, 4, 5])
+
+
+def test_getcolumn_same_order_for_any_mice_order():
+    sessions = shuffled_sessions()
+    np.testing.assert_array_equal(sessions.getcolumn(['a', 'b'], 'Address'),
+                                  sessions.getcolumn(['b', 'a'], 'Address'))
+
+
+def test_extend_same_as_indexing_at_once():
+    rng = np.random.RandomState(0)
+    columns = SessionColumns([], [], [], [])
+    tags, starts = [], []
+    for step in range(200):
+        # new mice (appended at the end), known mice (inserted) and late visits (rebuilt)
+        new_tags = [['new%i' % step], ['m%i' % rng.randint(5)], ['m%i' % i for i in rng.randint(10, size=3)]][step % 3]
+        new_starts = step + np.sort(rng.rand(len(new_tags))) - (5 if step % 50 == 49 else 0)
+        columns.extend(new_tags, np.arange(len(new_tags)), new_starts, new_starts + 1)
+        tags += new_tags
+        starts += new_starts.tolist()
+    expected = SessionColumns(tags, np.zeros(len(tags)), starts, starts)
+    for tag in expected.tag_names.tolist():
+        code, expected_code = columns.tag_codes[tag], expected.tag_codes[tag]
+        rows = slice(columns.offsets[code], columns.offsets[code + 1])
+        expected_rows = slice(expected.offsets[expected_code], expected.offsets[expected_code + 1])
+        assert np.all(columns.tag[rows] == code)
+        np.testing.assert_array_equal(columns.order[rows], expected.order[expected_rows])
+        np.testing.assert_array_equal(columns.start[rows], expected.start[expected_rows])
+
+
+def test_save_meta(tmpdir):
+    columns = SessionColumns(['a', 'b'], [1, 2], [0.0, 1.0], [0.5, 1.5])
+    columns.save(str(tmpdir), {'n_pending': 0})
+    assert SessionColumns.load_meta(str(tmpdir)) == {'n_pending': 0}
+    assert not [name for name in os.listdir(str(tmpdir)) if '.tmp.' in name]